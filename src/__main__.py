@@ -1,13 +1,57 @@
+import sys
+import time
+START_TIME = time.perf_counter()
+
+if "--profile-startup" in sys.argv:
+    # installed before any other import, so that every import is timed
+    try:
+        from .profiling import StartupProfiler
+    except ImportError:
+        from profiling import StartupProfiler
+    StartupProfiler().enable(START_TIME)
+
+from argparse import ArgumentParser
+from multiprocessing import freeze_support
+
+from gamuLogger import Logger, LEVELS
+
+
+if __name__ == "__main__" and len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+    # a headless command (see cli), tkinter and the UI are never imported
+    freeze_support()
+    try:
+        from .cli import main
+    except ImportError:
+        from cli import main
+    sys.exit(main())
+
 try:
     from .ui import UI
+    from .modIndex import ModIndex
+    from .metrics import Metrics
 except ImportError:
     from ui import UI
+    from modIndex import ModIndex
+    from metrics import Metrics
 
-from gamuLogger import Logger, LEVELS
 
+if __name__ == "__main__":
+    # the mods are loaded in worker processes, which import this module again
+    freeze_support()
+    
+    parser = ArgumentParser(description="Farming Simulator mods manager", epilog="headless commands : list, enable, disable, import, verify, stats (python -m src <command> --help)")
+    parser.add_argument("--rebuild-index", action="store_true", help="discard the mod index and parse every mod again")
+    parser.add_argument("--profile-startup", action="store_true", help="log the time spent in each import and startup phase")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE", help="log load metrics at exit, and write them to FILE (json, or csv if FILE ends with .csv)")
+    args = parser.parse_args()
+    
+    if args.metrics is not None:
+        Metrics().enable(args.metrics or None)
 
-try:
-    ui = UI()
-    ui.mainloop()
-except Exception as e:
-    Logger.critical(f"An error occured: {e}")
\ No newline at end of file
+    try:
+        if args.rebuild_index:
+            ModIndex().clear()
+        ui = UI(START_TIME)
+        ui.mainloop()
+    except Exception as e:
+        Logger.critical(f"An error occured: {e}")
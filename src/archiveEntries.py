@@ -0,0 +1,72 @@
+"""
+Compact list of the files of an archive (name, crc and size of each entry), read from the zip central directory
+and kept in the mod index, so the conflict analysis does not open the archives again
+"""
+import os
+from array import array
+
+from gamuLogger import Logger
+
+try:
+    from .modIndex import ModIndex
+    from .metrics import Metrics
+    from .zipReader import ZipReader
+except ImportError:
+    from modIndex import ModIndex
+    from metrics import Metrics
+    from zipReader import ZipReader
+
+Logger.setModule("archiveEntries")
+
+RawEntries = tuple[str, bytes, bytes] # names separated by "\n", crcs and sizes as arrays, plain data for worker processes and the index
+
+
+class ArchiveEntries:
+    """
+    Files of an archive (directories are skipped), names are kept as they are in the archive
+    """
+    __slots__ = ("names", "crcs", "sizes")
+
+    def __init__(self, names : tuple[str, ...], crcs : array, sizes : array):
+        self.names = names
+        self.crcs = crcs # array("I") of crc32
+        self.sizes = sizes # array("Q") of uncompressed sizes
+
+    @staticmethod
+    def fromReader(reader : ZipReader) -> 'ArchiveEntries':
+        return ArchiveEntries(tuple(reader.names()), reader.getCrcs(), reader.getSizes())
+
+    @staticmethod
+    def fromRaw(raw : RawEntries) -> 'ArchiveEntries':
+        names, crcs, sizes = raw
+        crcArray, sizeArray = array("I"), array("Q")
+        crcArray.frombytes(crcs)
+        sizeArray.frombytes(sizes)
+        return ArchiveEntries(tuple(names.split("\n")) if names else (), crcArray, sizeArray)
+
+    def toRaw(self) -> RawEntries:
+        return "\n".join(self.names), self.crcs.tobytes(), self.sizes.tobytes()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        """
+        (name, crc, size) of every file
+        """
+        return zip(self.names, self.crcs, self.sizes)
+
+
+def getEntries(zippath : str) -> ArchiveEntries:
+    """
+    Entries of the archive, from the mod index if it did not change since it was indexed, else from its central directory
+    """
+    stat = os.stat(zippath)
+    raw = ModIndex().getEntries(zippath, stat.st_size, stat.st_mtime_ns)
+    Metrics().count("entries.hit" if raw is not None else "entries.miss")
+    if raw is not None:
+        return ArchiveEntries.fromRaw(raw)
+    with Metrics().timer("entries.read", zippath), ZipReader(zippath) as reader:
+        entries = ArchiveEntries.fromReader(reader)
+    ModIndex().putEntries(zippath, stat.st_size, stat.st_mtime_ns, entries.toRaw())
+    return entries
@@ -0,0 +1,1034 @@
+"""
+Micro-benchmarks of the loading code
+Run with `python -m src.bench <benchmark> [--output results.json] [--compare previous.json]`
+`python -m src.bench generate --folder <folder> --count N` creates a synthetic mod library
+"""
+import io
+import os
+import gc
+import time
+import sys
+import json
+import zipfile
+import platform
+import random
+import tempfile
+import subprocess
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, Callable
+
+from gamuLogger import Logger, LEVELS
+from bs4 import BeautifulSoup as BS
+
+try:
+    from .moddesc import ModDesc, parseModDesc, parseModDescSoup
+    from .thread import Runner, Task
+    from .config import Config
+except ImportError:
+    from moddesc import ModDesc, parseModDesc, parseModDescSoup
+    from thread import Runner, Task
+    from config import Config
+
+Logger.setModule("bench")
+
+LANGUAGES = ["en", "de", "fr", "pl", "es", "it", "ru", "cz", "br", "nl"]
+
+
+def makeModDesc(index : int, languages : list[str] = LANGUAGES, l10nEntries : int = 50, iconFilename : str = None) -> str:
+    """
+    Returns a modDesc.xml looking like the ones shipped with real mods (multi-language texts, store items and translations)
+    """
+    titles = "\n".join(f"        <{lang}>Synthetic mod {index} ({lang})</{lang}>" for lang in languages)
+    descriptions = "\n".join(
+        f"        <{lang}><![CDATA[Description of the synthetic mod {index} in {lang}.\nIt adds a vehicle, a trailer and a few placeables to the game. " + "Lorem ipsum dolor sit amet. " * 10 + f"]]></{lang}>"
+        for lang in languages
+    )
+    l10n = "\n".join(
+        f'        <text name="synthetic_text_{i}">' + "".join(f"<{lang}>Text {i} ({lang})</{lang}>" for lang in languages) + "</text>"
+        for i in range(l10nEntries)
+    )
+    return f"""<?xml version="1.0" encoding="utf-8" standalone="no" ?>
+<modDesc descVersion="72">
+    <author>Author {index % 37}</author>
+    <version>1.{index % 10}.0.{index}</version>
+    <title>
+{titles}
+    </title>
+    <description>
+{descriptions}
+    </description>
+    <iconFilename>{iconFilename or f"icon_synthetic{index}.dds"}</iconFilename>
+    <multiplayer supported="{"true" if index % 2 else "false"}"/>
+    <storeItems>
+        <storeItem xmlFilename="vehicle.xml"/>
+        <storeItem xmlFilename="trailer.xml"/>
+    </storeItems>
+    <l10n>
+{l10n}
+    </l10n>
+</modDesc>
+"""
+
+
+def makeIcon(index : int, size : int = 256, iconFormat : str = "dds") -> bytes:
+    """
+    Returns a size x size icon, as a DXT5 compressed dds like the game icons, or as a png
+    (Pillow versions without a DXT encoder write an uncompressed dds, which is much slower to decode)
+    """
+    from PIL import Image
+    image = Image.linear_gradient("L").resize((size, size)).convert("RGBA")
+    image.paste((index * 37 % 256, index * 71 % 256, index * 13 % 256, 255), (size // 4, size // 4, size * 3 // 4, size * 3 // 4))
+    output = io.BytesIO()
+    if iconFormat == "png":
+        image.save(output, "PNG")
+    else:
+        image.save(output, "DDS", pixel_format="DXT5")
+    return output.getvalue()
+
+
+def writeModArchive(path : str, index : int, iconSize : int = 256, iconFormat : str = "dds", nbFiles : int = 20):
+    """
+    Write a mod archive: modDesc.xml, its icon and nbFiles xml files standing for the content of the mod
+    """
+    iconFilename = f"icons/icon_synthetic{index}.{iconFormat}"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("modDesc.xml", makeModDesc(index, iconFilename=iconFilename))
+        archive.writestr(iconFilename, makeIcon(index, iconSize, iconFormat))
+        for i in range(nbFiles):
+            archive.writestr(f"xml/part{i}.xml", f'<part name="part{i}" mod="{index}">' + '<node x="1.0" y="2.0" z="3.0"/>' * 100 + "</part>")
+
+
+def generateLibrary(folder : str, nbMods : int, nbStacks : int = 1, iconSize : int = 256, iconFormat : str = "dds") -> list[str]:
+    """
+    Create a stack folder (the same layout as the stack_folder of the config) with nbMods archives spread over nbStacks stacks
+    Returns the stack folders
+    """
+    stacks = [os.path.join(folder, f"stack{i}") for i in range(max(1, nbStacks))]
+    for stack in stacks:
+        os.makedirs(stack, exist_ok=True)
+    for index in range(nbMods):
+        writeModArchive(os.path.join(stacks[index % len(stacks)], f"FS22_Synthetic{index}.zip"), index, iconSize, iconFormat)
+    return stacks
+
+
+def timingStats(times : list[float]) -> dict[str, float]:
+    """
+    Summary of a list of durations in seconds, in milliseconds
+    """
+    times = sorted(times)
+    return {
+        "count": len(times),
+        "totalMs": sum(times) * 1000,
+        "meanMs": sum(times) / len(times) * 1000,
+        "p50Ms": times[len(times) // 2] * 1000,
+        "p95Ms": times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        "maxMs": times[-1] * 1000,
+    }
+
+
+def stackFolders(library : str) -> list[str]:
+    return sorted(entry.path for entry in os.scandir(library) if entry.is_dir())
+
+
+def archivesOf(folder : str) -> list[str]:
+    return sorted(entry.path for entry in os.scandir(folder) if entry.name.endswith(".zip"))
+
+
+def scenarioMod(library : str) -> dict[str, Any]:
+    """
+    Mod of every archive of the first stack, with an empty mod index and thumbnail cache, then again once they are filled
+    """
+    from .mod import Mod
+    paths = archivesOf(stackFolders(library)[0])
+    results = {}
+    for name in ("cold", "warm"):
+        times = []
+        for path in paths:
+            start = time.perf_counter()
+            Mod(path)
+            times.append(time.perf_counter() - start)
+        results[name] = timingStats(times)
+    return results
+
+
+def scenarioThumbnail(library : str) -> dict[str, Any]:
+    """
+    Scale down the icon of every archive of the first stack
+    """
+    from .mod import findRealIcon
+    from .moddesc import ModDesc
+    from .thumbnails import ThumbnailCache, thumbnailKey
+    icons = []
+    for path in archivesOf(stackFolders(library)[0]):
+        with zipfile.ZipFile(path) as archive:
+            iconName = findRealIcon(archive, ModDesc(archive.open("modDesc.xml")).icon)
+            info = archive.getinfo(iconName)
+            icons.append((thumbnailKey(iconName, info.CRC, info.file_size), archive.read(iconName)))
+    times = []
+    for key, data in icons:
+        start = time.perf_counter()
+        ThumbnailCache().store(key, data)
+        times.append(time.perf_counter() - start)
+    return timingStats(times) | {"iconBytes": sum(len(data) for _, data in icons) // len(icons)}
+
+
+def scenarioStack(library : str, updateRatio : float = 0.1) -> dict[str, Any]:
+    """
+    Load every stack sequentially with an empty mod index, load them again with the index filled,
+    then rewrite a part of the archives of the first stack and refresh it
+    """
+    from .modStack import ModStack
+    folders = stackFolders(library)
+    start = time.perf_counter()
+    stacks = [ModStack(folder) for folder in folders]
+    cold = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for stack in stacks:
+        stack.load()
+    warm = time.perf_counter() - start
+    
+    paths = archivesOf(folders[0])
+    updated = paths[:max(1, int(len(paths) * updateRatio))]
+    time.sleep(0.01) # make sure the modification times change
+    for path in updated:
+        index = int(os.path.basename(path)[len("FS22_Synthetic"):-len(".zip")])
+        writeModArchive(path, index)
+    start = time.perf_counter()
+    changes = stacks[0].refresh()
+    update = time.perf_counter() - start
+    assert len(changes.modified) == len(updated), f"{len(updated)} archives rewritten but refresh found {changes}"
+    
+    start = time.perf_counter()
+    stacks[0].refresh()
+    noop = time.perf_counter() - start
+    return {
+        "mods": sum(len(stack) for stack in stacks),
+        "loadColdMs": cold * 1000,
+        "loadWarmMs": warm * 1000,
+        "updatedMods": len(updated),
+        "refreshMs": update * 1000,
+        "refreshNoChangeMs": noop * 1000,
+    }
+
+
+def scenarioManager(library : str) -> dict[str, Any]:
+    """
+    Manager startup on the library, with the config, mod index and thumbnails left by the previous runs
+    """
+    from .config import Config
+    from .manager import Manager
+    Config().set("stack_folder", library)
+    Config().flush()
+    start = time.perf_counter()
+    manager = Manager()
+    elapsed = time.perf_counter() - start
+    return {"startupMs": elapsed * 1000, "stacks": len(manager.getStacksNames())}
+
+
+def scenarioSwitch(library : str, count : int = 1000) -> dict[str, Any]:
+    """
+    Switch the enabled stack count times while another thread checks that the game mods folder never disappears
+    (from the first switch on, the folder does not exist before it)
+    """
+    from threading import Thread, Event
+    from .config import Config
+    from .modStack import ModStack, getGameModsFolder
+    gameModsFolder = os.path.join(library, "game", "mods")
+    Config().set("game_mods_folder", gameModsFolder)
+    stacks = [ModStack(folder, load=False) for folder in stackFolders(library) if os.path.basename(folder) != "game"]
+    
+    stop = Event()
+    checks = [0, 0] # checks, misses
+    def check():
+        while not stop.is_set():
+            checks[0] += 1
+            if not os.path.isdir(gameModsFolder):
+                checks[1] += 1
+    stacks[0].enable() # the link has to exist before it is checked
+    checker = Thread(target=check)
+    checker.start()
+    times = []
+    try:
+        for i in range(1, count + 1):
+            stack = stacks[i % len(stacks)]
+            start = time.perf_counter()
+            stack.enable()
+            times.append(time.perf_counter() - start)
+            assert ModStack.getEnabled() is stack, f"{stack} should be enabled"
+    finally:
+        stop.set()
+        checker.join()
+    ModStack.disable()
+    assert ModStack.getEnabled() is None and not os.path.lexists(gameModsFolder), "the link should be removed"
+    assert checks[1] == 0, f"the game mods folder was missing {checks[1]} times out of {checks[0]} checks"
+    return timingStats(times) | {"checks": checks[0]}
+
+
+def scenarioMemory(library : str, nbFiles : int = 8) -> dict[str, Any]:
+    """
+    Memory retained by the stacks of the library once loaded (from the mod index, as on a normal startup), per mod,
+    and the source lines that allocated most of it
+    """
+    from . import mod as modModule
+    from .mod import Mod
+    from .modStack import ModStack
+    folders = stackFolders(library)
+    for folder in folders: # fill the mod index and the thumbnail cache
+        for path in archivesOf(folder):
+            Mod(path)
+    modModule._shared.clear()
+    
+    gc.collect()
+    tracemalloc.start(1)
+    baseline = tracemalloc.take_snapshot()
+    before = tracemalloc.get_traced_memory()[0]
+    stacks = [ModStack(folder) for folder in folders]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    statistics = tracemalloc.take_snapshot().compare_to(baseline, "lineno")
+    tracemalloc.stop()
+    
+    nbMods = sum(len(stack) for stack in stacks)
+    sources = {}
+    for stat in statistics[:nbFiles]:
+        frame = stat.traceback[0]
+        sources[f"{os.path.basename(frame.filename)}:{frame.lineno}"] = stat.size_diff / nbMods
+    return {"mods": nbMods, "bytesPerMod": retained / nbMods, "totalBytes": retained, "sources": sources}
+
+
+def scenarioVerify(library : str) -> dict[str, Any]:
+    """
+    Integrity check of every archive : zipfile's testzip, then verify sequentially, on a process pool
+    (one worker per core) and once more with the results cached in the mod index
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from .verify import verifyArchives
+    paths = [os.path.join(library, file) for file in sorted(os.listdir(library))]
+    nbBytes = sum(os.path.getsize(path) for path in paths)
+    result = {"archives": len(paths), "megabytes": nbBytes / 1024 / 1024, "cpus": os.cpu_count()}
+
+    start = time.perf_counter()
+    for path in paths:
+        with zipfile.ZipFile(path) as archive:
+            archive.testzip()
+    result["testzip"] = time.perf_counter() - start
+
+    report = verifyArchives(paths, force=True)
+    result["sequential"] = report.seconds
+    result["failed"] = len(report.failures)
+    with ProcessPoolExecutor(os.cpu_count(), mp_context=multiprocessing.get_context("spawn")) as executor:
+        executor.submit(int).result() # the workers are started, not timed
+        result["parallel"] = verifyArchives(paths, executor, force=True).seconds
+    result["cached"] = verifyArchives(paths).seconds
+    return result
+
+
+def scenarioWatcher(library : str, backend : str = "polling", interval : float = 0.1, timeout : float = 10.0) -> dict[str, Any]:
+    """
+    Create, rewrite and delete archives of a watched stack, and check after each change that the stack followed it
+    backend is "inotify" or "polling" (with a snapshot every interval seconds)
+    """
+    from .modStack import ModStack
+    from .watcher import Watcher, InotifyBackend, PollingBackend
+    folder = stackFolders(library)[0]
+    stack = ModStack(folder)
+    factory = InotifyBackend if backend == "inotify" else lambda folders: PollingBackend(folders, interval)
+    changes = [] #type: list[str]
+    watcher = Watcher([stack], lambda stack, changeSet: changes.append(str(changeSet)), 0.1, factory)
+    
+    def waitFor(condition : Callable[[], bool], what : str) -> float:
+        start = time.perf_counter()
+        while not condition():
+            if time.perf_counter() - start > timeout:
+                raise AssertionError(f"{what} not seen by the {backend} watcher after {timeout}s")
+            time.sleep(0.01)
+        return time.perf_counter() - start
+    
+    def title(file : str) -> str | None:
+        mod = stack.getMod(file)
+        return mod.title if mod is not None else None
+    
+    newIndex = len(archivesOf(folder))
+    created = f"FS22_Watched{newIndex}.zip"
+    modified = os.path.basename(archivesOf(folder)[0])
+    deleted = os.path.basename(archivesOf(folder)[1])
+    times = {}
+    watcher.start()
+    try:
+        writeModArchive(os.path.join(folder, created), newIndex, 16)
+        times["created"] = waitFor(lambda: title(created) == f"Synthetic mod {newIndex} (en)", f"{created} created")
+        writeModArchive(os.path.join(folder, modified), newIndex + 1, 16) # rewritten in place, as an editor or a download would
+        times["modified"] = waitFor(lambda: title(modified) == f"Synthetic mod {newIndex + 1} (en)", f"{modified} modified")
+        os.remove(os.path.join(folder, deleted))
+        times["deleted"] = waitFor(lambda: stack.getMod(deleted) is None, f"{deleted} deleted")
+    finally:
+        watcher.stop()
+    files = sorted(file for file, _ in stack.getItems())
+    assert files == sorted(os.path.basename(path) for path in archivesOf(folder)), "the stack should have exactly the archives of its folder"
+    return {name: seconds * 1000 for name, seconds in times.items()} | {"refreshes": len(changes), "mods": len(files)}
+
+
+SCENARIOS = {
+    "mod": scenarioMod,
+    "thumbnail": scenarioThumbnail,
+    "stack": scenarioStack,
+    "manager": scenarioManager,
+    "switch": scenarioSwitch,
+    "memory": scenarioMemory,
+    "verify": scenarioVerify,
+    "watcher": scenarioWatcher,
+}
+
+def runScenario(name : str, library : str, resultPath : str, parameters : dict[str, Any] = None):
+    """
+    Entry point of the processes started by runIsolated
+    """
+    Logger.setLevel("stdout", LEVELS.ERROR)
+    with open(resultPath, "w") as f:
+        json.dump(SCENARIOS[name](library, **(parameters or {})), f)
+
+
+def runIsolated(name : str, library : str, stateFolder : str, parameters : dict[str, Any] = None) -> dict[str, Any]:
+    """
+    Run a scenario in a new process, with its config, mod index and thumbnail cache in stateFolder
+    (these are singletons created from the environment, and the process pool of the Manager needs a real main module)
+    """
+    package = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+    tmpFolder = os.path.join(stateFolder, "tmp")
+    os.makedirs(tmpFolder, exist_ok=True)
+    resultPath = os.path.join(stateFolder, f"{name}.json")
+    process = subprocess.run(
+        [sys.executable, "-c", f"from {package}.bench import runScenario; runScenario({name!r}, {library!r}, {resultPath!r}, {parameters!r})"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=os.environ | {"APPDATA": os.path.join(stateFolder, "appdata"), "TEMP": tmpFolder, "TMP": tmpFolder, "TMPDIR": tmpFolder},
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"scenario {name} failed :\n{process.stdout[-2000:]}{process.stderr[-2000:]}")
+    with open(resultPath) as f:
+        return json.load(f)
+
+
+def benchLibrary(count : int = 1000, sizes : list[int] = None, nbStacks : int = 4, iconSize : int = 256, iconFormat : str = "dds") -> dict[str, Any]:
+    """
+    Generate synthetic libraries of several sizes (up to count mods) and time Mod, thumbnailing,
+    ModStack load and refresh, and Manager startup (cold, then with the mod index and thumbnails filled)
+    """
+    sizes = sizes or sorted({max(1, count // 100), max(1, count // 10), count})
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        for size in sizes:
+            library = os.path.join(root, f"library{size}")
+            start = time.perf_counter()
+            generateLibrary(library, size, min(nbStacks, size), iconSize, iconFormat)
+            Logger.info(f"Generated {size} mods in {time.perf_counter() - start:.2f}s")
+            
+            result = results[str(size)] = {}
+            for name in ("mod", "thumbnail", "stack"):
+                result[name] = runIsolated(name, library, os.path.join(root, f"state{size}-{name}"))
+            # same state for both runs, the second one finds the mod index and the thumbnails filled
+            managerState = os.path.join(root, f"state{size}-manager")
+            result["manager"] = {
+                "cold": runIsolated("manager", library, managerState),
+                "warm": runIsolated("manager", library, managerState),
+            }
+            Logger.info(
+                f"{size:>6} mods : Mod {result['mod']['cold']['meanMs']:.2f} ms cold / {result['mod']['warm']['meanMs']:.2f} ms warm, "
+                f"thumbnail {result['thumbnail']['meanMs']:.2f} ms, "
+                f"stacks {result['stack']['loadColdMs']:.0f} ms cold / {result['stack']['loadWarmMs']:.0f} ms warm, "
+                f"refresh of {result['stack']['updatedMods']} mods {result['stack']['refreshMs']:.0f} ms, "
+                f"Manager {result['manager']['cold']['startupMs']:.0f} ms cold / {result['manager']['warm']['startupMs']:.0f} ms warm"
+            )
+    return results
+
+
+def measure(build : Callable[[bytes], Any], inputs : list[bytes]) -> tuple[float, float]:
+    """
+    Returns (seconds per item, bytes retained per item) when building one object per input and keeping them all
+    """
+    # timed and traced separately, tracemalloc slows down allocations a lot
+    gc.collect()
+    start = time.perf_counter()
+    kept = [build(data) for data in inputs]
+    elapsed = time.perf_counter() - start
+    del kept
+    
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    kept = [build(data) for data in inputs]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del kept
+    return elapsed / len(inputs), retained / len(inputs)
+
+
+def benchModDesc(count : int = 200) -> dict[str, dict[str, float]]:
+    """
+    Compare the BeautifulSoup tree the ModDesc used to keep with the streaming lxml parser
+    """
+    inputs = [makeModDesc(i).encode() for i in range(count)]
+    candidates = {
+        "bs4 (tree kept)": lambda data: BS(io.BytesIO(data), "xml"),
+        "bs4 (fields only)": lambda data: ModDesc(io.BytesIO(data), parseModDescSoup),
+        "lxml iterparse": lambda data: ModDesc(io.BytesIO(data), parseModDesc),
+    }
+    results = {}
+    for name, build in candidates.items():
+        seconds, retained = measure(build, inputs)
+        results[name] = {"parseMs": seconds * 1000, "retainedBytes": retained}
+        Logger.info(f"{name:<20} {seconds * 1000:8.3f} ms/mod {retained / 1024:10.1f} KiB retained/mod")
+    return results
+
+
+def benchRunner(count : int = 20000, nbThreads : int = 32) -> dict[str, float]:
+    """
+    Stress the Runner with many small tasks on many threads: every task must be run exactly once,
+    failures must be captured and cancelled tasks must not run
+    """
+    ran = []
+    def work(i : int) -> int:
+        ran.append(i)
+        if i % 97 == 0:
+            raise ValueError(f"task {i} failed")
+        return i * 2
+    
+    runner = Runner()
+    tasks = [runner.addTask(Task(work, i), priority=random.randint(0, 10)) for i in range(count)]
+    cancelled = {i for i in range(0, count, 13) if tasks[i].cancel()}
+    
+    start = time.perf_counter()
+    runner.runAsync(nbThreads, wait=True)
+    elapsed = time.perf_counter() - start
+    
+    failed = 0
+    for i, task in enumerate(tasks):
+        if i in cancelled:
+            assert task.cancelled(), f"task {i} should be cancelled"
+        elif i % 97 == 0:
+            assert isinstance(task.exception(), ValueError), f"task {i} should have failed"
+            failed += 1
+        else:
+            assert task.result() == i * 2, f"task {i} returned {task.result()}"
+    assert sorted(ran) == sorted(set(range(count)) - cancelled), "some tasks were lost or ran twice"
+    
+    Logger.info(f"{count} tasks on {nbThreads} threads in {elapsed:.3f}s ({count / elapsed:.0f} tasks/s), {failed} failed, {len(cancelled)} cancelled")
+    return {"tasks": count, "seconds": elapsed, "failed": failed, "cancelled": len(cancelled)}
+
+
+def benchConfig(count : int = 10000) -> dict[str, float]:
+    """
+    Time sequential Config.set calls on a temporary config file: one write per call (the previous behaviour),
+    debounced writes, and a single batch
+    Returns the seconds per set of each mode
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        def run(name : str, setAll : Callable[[Config, int], None], nbSets : int = count):
+            config = Config.fromFile(os.path.join(folder, f"{name}.json"))
+            start = time.perf_counter()
+            setAll(config, nbSets)
+            config.flush()
+            elapsed = time.perf_counter() - start
+            results[name] = elapsed / nbSets
+            Logger.info(f"{name:<16} {nbSets} sets in {elapsed:.3f}s ({elapsed / nbSets * 1e6:.1f} us/set)")
+        
+        def writeEach(config : Config, count : int):
+            for i in range(count):
+                config.set(f"key{i}", i)
+                config.flush()
+        
+        def debounced(config : Config, count : int):
+            for i in range(count):
+                config.set(f"key{i}", i)
+                
+        def batched(config : Config, count : int):
+            with config.batch():
+                for i in range(count):
+                    config.set(f"key{i}", i)
+        
+        # the whole file is rewritten on each set, so this one only runs on a sample
+        run("write each set", writeEach, min(count, 500))
+        run("debounced", debounced)
+        run("batch", batched)
+    return results
+
+
+# modules that must not be imported by `import src.ui`, they are loaded when first needed
+DEFERRED_MODULES = ["PIL", "bs4", "lxml", "ttkthemes"]
+
+def benchImports(count : int = 5, budget : float = 0.5) -> dict[str, float]:
+    """
+    Import time regression check: import src.ui in fresh interpreters and fail if the best time
+    is above budget (in seconds) or if one of the deferred heavy modules got imported
+    """
+    package = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {package}.ui\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(elapsed, *[name for name in {DEFERRED_MODULES!r} if name in sys.modules])\n"
+    )
+    times = []
+    for _ in range(count):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True
+        ).stdout.split()
+        times.append(float(output[0]))
+        assert not output[1:], f"{', '.join(output[1:])} imported by {package}.ui"
+    best = min(times)
+    Logger.info(f"import {package}.ui : best {best * 1000:.1f} ms, worst {max(times) * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    assert best <= budget, f"importing {package}.ui took {best * 1000:.1f} ms, more than the {budget * 1000:.0f} ms budget"
+    return {"best": best, "worst": max(times)}
+
+
+def benchSwitch(count : int = 1000) -> dict[str, float]:
+    """
+    Latency of enabling a stack (replacing the game mods folder link), the folder must never be missing meanwhile
+    """
+    with tempfile.TemporaryDirectory() as root:
+        library = os.path.join(root, "library")
+        generateLibrary(library, 4, 2, 16)
+        result = runIsolated("switch", library, os.path.join(root, "state"), {"count": count})
+    Logger.info(
+        f"{result['count']} switches : mean {result['meanMs']:.3f} ms, p95 {result['p95Ms']:.3f} ms, max {result['maxMs']:.3f} ms, "
+        f"game mods folder always present ({result['checks']} checks)"
+    )
+    return result
+
+
+def benchCli(count : int = 20, nbMods : int = 2000, budget : float = 0.5) -> dict[str, Any]:
+    """
+    Latency of "python -m src enable" in fresh interpreters on a library of nbMods archives, the regression check of the headless
+    enable : fails if the best run is above budget (in seconds), if a mod was parsed or if the UI or a deferred module was imported
+    """
+    package = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as root:
+        library = os.path.join(root, "library")
+        stacks = [os.path.basename(folder) for folder in generateLibrary(library, nbMods, 4, 16)]
+        appdata = os.path.join(root, "appdata")
+        os.makedirs(os.path.join(appdata, "mod_manager"))
+        with open(os.path.join(appdata, "mod_manager", "config.json"), "w") as f:
+            json.dump({"stack_folder": library, "game_mods_folder": os.path.join(root, "game", "mods")}, f)
+        env = os.environ | {"APPDATA": appdata}
+        
+        times, inProcess = [], []
+        for i in range(count):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-m", package, "enable", stacks[i % len(stacks)], "--json"], cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+            times.append(time.perf_counter() - start)
+            inProcess.append(json.loads(output)["seconds"])
+        
+        code = (
+            "import sys\n"
+            f"from {package}.cli import main\n"
+            f"from {package}.modIndex import ModIndex\n"
+            f"main(['enable', {stacks[0]!r}, '--json'])\n"
+            f"print(len(ModIndex()), *[name for name in {DEFERRED_MODULES + ['tkinter', package + '.ui']!r} if name in sys.modules], file=sys.stderr)\n"
+        )
+        output = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True).stderr.split()
+    assert output[0] == "0", f"{output[0]} mods were parsed by enable"
+    assert not output[1:], f"{', '.join(output[1:])} imported by enable"
+    result = timingStats(times) | {"linkMs": timingStats(inProcess)["meanMs"], "bestMs": min(times) * 1000}
+    Logger.info(
+        f"python -m {package} enable ({nbMods} mods in {len(stacks)} stacks) : best {result['bestMs']:.1f} ms, p95 {result['p95Ms']:.1f} ms "
+        f"(budget {budget * 1000:.0f} ms), switching the link itself {result['linkMs']:.2f} ms"
+    )
+    assert min(times) <= budget, f"python -m {package} enable took {min(times) * 1000:.1f} ms, more than the {budget * 1000:.0f} ms budget"
+    return result
+
+
+SEARCH_WORDS = ["tractor", "trailer", "harvester", "plough", "seeder", "mower", "baler", "loader", "sprayer", "cultivator",
+                "john", "deere", "fendt", "claas", "kuhn", "krone", "lemken", "pack", "edition", "heavy", "small", "big", "farm", "silo"]
+
+def makeWords(rng : random.Random, count : int) -> list[str]:
+    """
+    Pseudo-words for the texts of the synthetic mods, with a long tail like real descriptions
+    """
+    syllables = ["ka", "ro", "mi", "te", "lo", "an", "ver", "sch", "ber", "gen", "tra", "ic", "el", "us", "dor"]
+    words = SEARCH_WORDS + ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+    rng.shuffle(words)
+    return words
+
+def benchSearch(count : int = 10000, nbQueries : int = 200) -> dict[str, Any]:
+    """
+    Build the search index over count synthetic mods, then time queries (each one after a change, so the
+    term cache is empty, and again with the cache filled) and incremental updates
+    """
+    from .moddesc import ModDesc
+    from .searchIndex import SearchIndex
+    rng = random.Random(0)
+    vocabulary = makeWords(rng, 5000)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))] # zipf-like: few frequent words, many rare ones
+    def makeMod(i : int) -> ModDesc:
+        words = lambda n: " ".join(rng.choices(vocabulary, weights, k=n))
+        return ModDesc.fromRecord({
+            "author": f"Author {i % 137}",
+            "version": f"1.{i % 10}.0.{i % 7}",
+            "titles": {lang: f"{words(3)} {i} ({lang})" for lang in LANGUAGES[:4]},
+            "descriptions": {lang: f"{words(40)} {lang}" for lang in LANGUAGES[:4]},
+            "icon": "icon.dds",
+            "multiplayer": True,
+        })
+    mods = [makeMod(i) for i in range(count)]
+    
+    index = SearchIndex()
+    start = time.perf_counter()
+    for i, mod in enumerate(mods):
+        index.update(("stack", i), mod)
+    index.flush()
+    build = time.perf_counter() - start
+    
+    queries = ["t", "tra", "tractor", "john de", '"deere"', "1.3", "author 12", "big silo pack", "zzz"]
+    cold, warm, updates = [], [], []
+    for i in range(nbQueries):
+        query = queries[i % len(queries)]
+        start = time.perf_counter()
+        index.update(("stack", i), mods[(i * 7) % count])
+        index.flush()
+        updates.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.search(query)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.search(query)
+        warm.append(time.perf_counter() - start)
+    perQuery = {}
+    for query in queries:
+        times = [cold[i] for i in range(nbQueries) if queries[i % len(queries)] == query]
+        perQuery[query] = {"results": len(index.search(query)), "meanMs": sum(times) / len(times) * 1000}
+        Logger.info(f"    {query:<16} {perQuery[query]['results']:>6} results {perQuery[query]['meanMs']:8.3f} ms")
+    results = {"buildSeconds": build, "cold": timingStats(cold), "warm": timingStats(warm), "update": timingStats(updates), "queries": perQuery}
+    Logger.info(
+        f"{count} mods indexed in {build:.2f}s, query {results['cold']['p50Ms']:.3f} ms median / {results['cold']['p95Ms']:.3f} ms p95 "
+        f"({results['warm']['p50Ms']:.4f} ms cached), update of one mod {results['update']['meanMs']:.3f} ms"
+    )
+    return results
+
+
+def benchOrder(count : int = 10000, nbPages : int = 200, pageSize : int = 18) -> dict[str, Any]:
+    """
+    Cost of drawing a page of the grid (two lookups per widget, as ModStackWidget did) with the previous
+    list(mods.values())[i] lookup and with the sorted view, plus the cost of keeping the view sorted
+    """
+    from .mod import Mod
+    from .sortedMods import SortedMods, SORT_KEYS
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(count):
+            path = os.path.join(folder, f"FS22_Synthetic{i}.zip")
+            with open(path, "wb") as f:
+                f.write(b"\0" * rng.randint(1, 256))
+            os.utime(path, ns=(0, rng.randint(0, 10**18)))
+        mods = {} #type: dict[str, Mod]
+        for entry in os.scandir(folder): # os.listdir order, the previous display order
+            mods[entry.name] = Mod(entry.path, {
+                "iconName": None, "thumbnail": None, "author": f"Author {rng.randint(0, 500)}", "version": "1.0.0.0",
+                "titles": {"en": " ".join(rng.choices(SEARCH_WORDS, k=3))}, "descriptions": {}, "icon": "icon.dds", "multiplayer": True,
+            }, lazy=True)
+        
+        view = SortedMods()
+        start = time.perf_counter()
+        for file, mod in mods.items():
+            view.set(file, mod)
+        build = time.perf_counter() - start
+        assert view.files() == sorted(mods, key=str.casefold), "mods not sorted by archive name"
+        
+        pages = [rng.randrange(0, count - pageSize) for _ in range(nbPages)]
+        def drawPages(getModByIndex : Callable[[int], Mod]) -> list[float]:
+            times = []
+            for first in pages:
+                start = time.perf_counter()
+                for index in range(first, first + pageSize):
+                    getModByIndex(index)
+                    getModByIndex(index)
+                times.append(time.perf_counter() - start)
+            return times
+        before = timingStats(drawPages(lambda index: list(mods.values())[index]))
+        after = timingStats(drawPages(lambda index: view[index]))
+        
+        slices = []
+        for first in pages:
+            start = time.perf_counter()
+            view[first:first + pageSize]
+            slices.append(time.perf_counter() - start)
+            
+        updates = []
+        files = list(mods)
+        for _ in range(nbPages):
+            file = rng.choice(files)
+            start = time.perf_counter()
+            view.remove(file)
+            view.set(file, mods[file])
+            updates.append(time.perf_counter() - start)
+            
+        sorts = {}
+        for sortKey in [*SORT_KEYS, "name"]:
+            start = time.perf_counter()
+            view.sortBy(sortKey)
+            sorts[sortKey] = (time.perf_counter() - start) * 1000
+            keys = [SORT_KEYS[sortKey](mod) for mod in view]
+            assert keys == sorted(keys), f"mods not sorted by {sortKey}"
+        view.sortBy("size", True)
+        assert [mod.size for mod in view] == sorted((mod.size for mod in mods.values()), reverse=True), "reverse order is wrong"
+            
+    results = {"buildMs": build * 1000, "pageBefore": before, "pageAfter": after, "slice": timingStats(slices), "update": timingStats(updates), "sortMs": sorts}
+    Logger.info(
+        f"{count} mods, page of {pageSize} : {before['meanMs']:.3f} ms before, {after['meanMs']:.4f} ms with the sorted view "
+        f"({before['meanMs'] / after['meanMs']:.0f}x), slice {results['slice']['meanMs']:.4f} ms"
+    )
+    Logger.info(
+        f"sorted view built in {build * 1000:.1f} ms, update of one mod {results['update']['meanMs']:.4f} ms, "
+        f"sort by " + ", ".join(f"{key} {ms:.1f} ms" for key, ms in sorts.items())
+    )
+    return results
+
+
+def benchMemory(count : int = 1000, nbStacks : int = 4) -> dict[str, Any]:
+    """
+    Bytes retained per loaded mod (traced with tracemalloc in a fresh process), use --output and --compare
+    to see the difference between two versions
+    """
+    with tempfile.TemporaryDirectory() as root:
+        library = os.path.join(root, "library")
+        generateLibrary(library, count, nbStacks, 64)
+        result = runIsolated("memory", library, os.path.join(root, "state"))
+    Logger.info(f"{result['mods']} mods loaded in {nbStacks} stacks : {result['bytesPerMod']:.0f} bytes per mod ({result['totalBytes'] / 1024 / 1024:.1f} MiB in total)")
+    for source, size in result["sources"].items():
+        Logger.info(f"    {source:<32} {size:>8.0f} bytes per mod")
+    return result
+
+
+def benchConflicts(count : int = 10000, nbFiles : int = 40) -> dict[str, Any]:
+    """
+    Conflict analysis of synthetic stacks of increasing size (a few repeated titles, shared assets and scripts),
+    the time per archive should stay about the same
+    """
+    from array import array
+    from .archiveEntries import ArchiveEntries
+    from .conflicts import analyze
+    rng = random.Random(0)
+    results = {}
+    for size in sorted({max(10, count // 100), max(10, count // 10), count}):
+        mods, entries = {}, {}
+        for i in range(size):
+            index = i if rng.random() > 0.01 else rng.randrange(max(1, i)) # ~1% of the mods are in the stack twice
+            file = f"FS22_Synthetic{i}.zip"
+            mods[file] = ModDesc.fromRecord({
+                "author": f"Author {index % 137}", "version": f"1.0.0.{rng.randrange(3)}", "titles": {"en": f"Synthetic mod {index}"},
+                "descriptions": {}, "icon": "icon.dds", "multiplayer": True,
+            })
+            names = [f"textures/asset{index}_{j}.dds" for j in range(nbFiles - 4)] + ["modDesc.xml", "icon.dds", f"textures/shared{rng.randrange(size)}.dds", "scripts/main.lua"]
+            crcs = [hash((index, j)) & 0xFFFFFFFF for j in range(nbFiles - 4)] + [i, i, 0, rng.randrange(4)]
+            entries[file] = ArchiveEntries(tuple(names), array("I", crcs), array("Q", [1024] * nbFiles))
+        start = time.perf_counter()
+        report = analyze("bench", mods, entries)
+        elapsed = time.perf_counter() - start
+        kinds = {}
+        for conflict in report.conflicts:
+            kinds[conflict.kind] = kinds.get(conflict.kind, 0) + 1
+        results[str(size)] = {"ms": elapsed * 1000, "usPerArchive": elapsed / size * 1e6, "conflicts": kinds}
+        Logger.info(f"{size:>6} archives ({size * nbFiles} files) : {elapsed * 1000:8.1f} ms, {elapsed / size * 1e6:6.1f} us per archive, {kinds}")
+    return results
+
+
+def benchZipReader(sizes : list[int] = None, repeat : int = 5) -> dict[str, Any]:
+    """
+    Metadata of one archive (central directory, modDesc.xml, icon lookup and icon bytes) with zipfile and findRealIcon,
+    then with zipReader, for archives of 10 to 50k entries; the icon name differs in case from modDesc.xml,
+    as in many real mods, so findRealIcon needs a second scan of the names
+    """
+    from .mod import findRealIcon, findIcon
+    from .zipReader import ZipReader
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes or [10, 100, 1000, 10000, 50000]:
+            path = os.path.join(folder, f"FS22_Map{size}.zip")
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("modDesc.xml", makeModDesc(size, iconFilename="icon_map.dds"))
+                for i in range(size - 2):
+                    archive.writestr(f"maps/data/tile{i}.i3d", b"", zipfile.ZIP_STORED)
+                archive.writestr("Icon_Map.dds", makeIcon(size, 64))
+                
+            def withZipFile() -> bytes:
+                with zipfile.ZipFile(path) as archive:
+                    iconName = findRealIcon(archive, ModDesc(archive.open("modDesc.xml")).icon)
+                    archive.getinfo(iconName)
+                    return archive.read(iconName)
+            def withZipReader() -> bytes:
+                with ZipReader(path) as reader:
+                    iconName = findIcon(reader, ModDesc(reader.open("modDesc.xml")).icon)
+                    reader.getInfo(iconName)
+                    return reader.read(iconName)
+            assert withZipFile() == withZipReader(), "both readers should return the same icon"
+            
+            times = {}
+            for name, read in (("zipfile", withZipFile), ("zipReader", withZipReader)):
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    read()
+                    samples.append(time.perf_counter() - start)
+                times[name] = min(samples) * 1000
+            results[str(size)] = times | {"speedup": times["zipfile"] / times["zipReader"]}
+            Logger.info(f"{size:>6} entries : zipfile {times['zipfile']:8.2f} ms, zipReader {times['zipReader']:8.2f} ms ({results[str(size)]['speedup']:.1f}x)")
+    return results
+
+
+def benchWatcher(count : int = 100, interval : float = 0.1) -> dict[str, Any]:
+    """
+    Archives created, modified and deleted in a watched stack of count mods, with each backend (inotify on linux,
+    polling every interval seconds), the stack must follow every change; times are from the change to the updated stack
+    """
+    backends = (["inotify"] if sys.platform.startswith("linux") else []) + ["polling"]
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        for backend in backends:
+            library = os.path.join(root, backend)
+            generateLibrary(library, count, 1, 16)
+            result = results[backend] = runIsolated("watcher", library, os.path.join(root, f"state-{backend}"), {"backend": backend, "interval": interval})
+            Logger.info(
+                f"{backend:<8} : created {result['created']:7.1f} ms, modified {result['modified']:7.1f} ms, deleted {result['deleted']:7.1f} ms "
+                f"({result['refreshes']} refreshes, {result['mods']} mods in the stack)"
+            )
+    return results
+
+
+def benchVerify(count : int = 40, megabytes : int = 8) -> dict[str, Any]:
+    """
+    Integrity check of count archives of about megabytes each (compressible and random data, a few corrupted archives),
+    the parallel time should go down with the number of cores and the cached time stay near zero
+    """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as root:
+        library = os.path.join(root, "library")
+        os.makedirs(library)
+        for i in range(count):
+            path = os.path.join(library, f"FS22_Verify{i}.zip")
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("modDesc.xml", makeModDesc(i))
+                for j in range(8):
+                    data = rng.randbytes(megabytes * 1024 * 1024 // 16) * 2 # half of it compresses
+                    archive.writestr(f"textures/texture{j}.dds", data, zipfile.ZIP_STORED if j == 0 else zipfile.ZIP_DEFLATED)
+            if i % 10 == 9: # a flipped byte in the data
+                with open(path, "r+b") as f:
+                    f.seek(os.path.getsize(path) // 2)
+                    byte = f.read(1)
+                    f.seek(-1, os.SEEK_CUR)
+                    f.write(bytes([byte[0] ^ 0xFF]))
+        result = runIsolated("verify", library, os.path.join(root, "state"))
+    Logger.info(f"{result['archives']} archives ({result['megabytes']:.0f} MiB, {result['failed']} corrupted) on {result['cpus']} cores :")
+    for name in ("testzip", "sequential", "parallel", "cached"):
+        Logger.info(f"    {name:<12} {result[name]:8.3f} s ({result['megabytes'] / max(result[name], 1e-9):8.0f} MiB/s)")
+    return result
+
+
+def flatten(results : Any, prefix : str = "") -> dict[str, float]:
+    """
+    {"a": {"b": 1}} -> {"a.b": 1}, only numbers are kept
+    """
+    if isinstance(results, dict):
+        flat = {}
+        for key, value in results.items():
+            flat |= flatten(value, f"{prefix}{key}.")
+        return flat
+    if isinstance(results, (int, float)) and not isinstance(results, bool):
+        return {prefix[:-1]: results}
+    return {}
+
+
+def writeResults(path : str, benchmark : str, parameters : dict[str, Any], results : Any):
+    """
+    Write the results with enough context to compare them with a run of another version
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    with open(path, "w") as f:
+        json.dump({
+            "benchmark": benchmark,
+            "parameters": parameters,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, f, indent=4)
+    Logger.info(f"Results written to {path}")
+
+
+def compareResults(path : str, results : Any):
+    """
+    Log the ratio between each value of a previous results file and the current results
+    """
+    with open(path) as f:
+        previous = flatten(json.load(f)["results"])
+    current = flatten(results)
+    Logger.info(f"Compared to {path} :")
+    for key, value in current.items():
+        if key in previous and previous[key]:
+            Logger.info(f"    {key:<48} {previous[key]:>12.3f} -> {value:>12.3f} ({value / previous[key]:6.2f}x)")
+
+
+BENCHMARKS = {
+    "moddesc": benchModDesc,
+    "runner": benchRunner,
+    "config": benchConfig,
+    "imports": benchImports,
+    "library": benchLibrary,
+    "switch": benchSwitch,
+    "search": benchSearch,
+    "order": benchOrder,
+    "memory": benchMemory,
+    "conflicts": benchConflicts,
+    "zipreader": benchZipReader,
+    "verify": benchVerify,
+    "cli": benchCli,
+    "watcher": benchWatcher,
+}
+
+if __name__ == "__main__":
+    Logger.setLevel("stdout", LEVELS.INFO)
+    
+    parser = ArgumentParser(description="Run a benchmark")
+    parser.add_argument("benchmark", choices=[*BENCHMARKS.keys(), "generate"])
+    parser.add_argument("--count", type=int, help="number of items to process (largest library size for library and generate)")
+    parser.add_argument("--sizes", type=int, nargs="+", help="library sizes (library), numbers of entries (zipreader)")
+    parser.add_argument("--stacks", type=int, default=4, help="number of stacks the mods are spread over (library, generate)")
+    parser.add_argument("--icon-size", type=int, default=256, help="icon width and height in pixels (library, generate)")
+    parser.add_argument("--icon-format", choices=["dds", "png"], default="dds", help="icon format (library, generate)")
+    parser.add_argument("--folder", help="where to create the library (generate)")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="compare the results with a file written by --output")
+    args = parser.parse_args()
+    
+    if args.benchmark == "generate":
+        if args.folder is None:
+            parser.error("generate needs --folder")
+        stacks = generateLibrary(args.folder, args.count or 100, args.stacks, args.icon_size, args.icon_format)
+        Logger.info(f"Generated {args.count or 100} mods in {len(stacks)} stacks in {args.folder}")
+        sys.exit(0)
+    
+    parameters = {} #type: dict[str, Any]
+    if args.count is not None:
+        parameters["count"] = args.count
+    if args.benchmark == "library":
+        parameters |= {"sizes": args.sizes, "nbStacks": args.stacks, "iconSize": args.icon_size, "iconFormat": args.icon_format}
+    if args.benchmark == "zipreader":
+        parameters["sizes"] = args.sizes
+    results = BENCHMARKS[args.benchmark](**parameters)
+    
+    if args.output:
+        writeResults(args.output, args.benchmark, parameters, results)
+    if args.compare:
+        compareResults(args.compare, results)
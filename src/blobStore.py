@@ -0,0 +1,289 @@
+"""
+Content-addressed store of the archives present in several stacks
+Identical archives are replaced by hard links to a single blob, so they are stored once and parsed once
+(a deduplicated archive must not be modified in place, ModStack.updateMod replaces the file instead)
+"""
+import os
+import time
+from typing import Any
+
+from gamuLogger import Logger, LEVELS
+
+try:
+    from .config import Config
+    from .modImport import contentHash
+    from .modIndex import ModIndex
+    from .modStack import ModStack, snapshot
+    from .moddesc import ModDesc
+    from .zipReader import ZipReader
+except ImportError:
+    from config import Config
+    from modImport import contentHash
+    from modIndex import ModIndex
+    from modStack import ModStack, snapshot
+    from moddesc import ModDesc
+    from zipReader import ZipReader
+
+Logger.setModule("blobStore")
+
+BLOB_FOLDER_NAME = ".blobs"
+
+
+def getBlobFolder() -> str:
+    """
+    Blobs must be on the same filesystem as the stacks, so they live in the stack folder (hidden from the stack list)
+    """
+    return Config().get("blob_folder", os.path.join(Config().get("stack_folder"), BLOB_FOLDER_NAME), True)
+
+
+class DuplicateGroup:
+    """
+    Archives of the stacks having the same content
+    """
+    def __init__(self, digest : str, size : int, paths : list[str], nbInodes : int):
+        self.digest = digest
+        self.size = size
+        self.paths = paths
+        self.nbInodes = nbInodes # distinct files on disk before deduplication
+
+    def toDict(self) -> dict[str, Any]:
+        return {"sha256": self.digest, "size": self.size, "paths": self.paths, "copiesOnDisk": self.nbInodes}
+
+
+class DedupeReport:
+    def __init__(self, dryRun : bool):
+        self.dryRun = dryRun
+        self.nbArchives = 0
+        self.totalBytes = 0
+        self.groups = [] #type: list[DuplicateGroup]
+        self.bytesSaved = 0 # freed by this run (or that would be freed, for a dry run)
+        self.bytesShared = 0 # already saved by previous runs
+        self.linked = 0 # archives replaced by a link to their blob
+        self.blobsRemoved = 0
+        self.parseSeconds = 0.0 # mean time to parse one archive, measured on a sample
+        self.errors = [] #type: list[str]
+        self.seconds = 0.0
+
+    @property
+    def parsesSaved(self) -> int:
+        """Archives that do not have to be parsed at load time, as their metadata is shared with an identical one"""
+        return sum(len(group.paths) - 1 for group in self.groups)
+
+    @property
+    def loadSecondsSaved(self) -> float:
+        """Estimated load time saved when the mod index is cold"""
+        return self.parsesSaved * self.parseSeconds
+
+    def toDict(self) -> dict[str, Any]:
+        return {
+            "dryRun": self.dryRun,
+            "archives": self.nbArchives,
+            "totalBytes": self.totalBytes,
+            "duplicateGroups": len(self.groups),
+            "bytesSaved": self.bytesSaved,
+            "bytesAlreadyShared": self.bytesShared,
+            "linked": self.linked,
+            "blobsRemoved": self.blobsRemoved,
+            "parsesSaved": self.parsesSaved,
+            "parseSeconds": self.parseSeconds,
+            "loadSecondsSaved": self.loadSecondsSaved,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "groups": [group.toDict() for group in self.groups],
+        }
+
+    def __str__(self) -> str:
+        freed = "can be freed" if self.dryRun else "freed"
+        return "\n".join([
+            f"{self.nbArchives} archives ({formatSize(self.totalBytes)}), {len(self.groups)} contents found in several places",
+            f"disk : {formatSize(self.bytesSaved)} {freed}, {formatSize(self.bytesShared)} already shared",
+            f"load : {self.parsesSaved} archives not parsed, about {self.loadSecondsSaved:.2f}s saved on a cold start",
+            f"{self.linked} archives {'to link' if self.dryRun else 'linked'}, {self.blobsRemoved} unused blobs removed, {len(self.errors)} errors",
+        ])
+
+
+def formatSize(size : int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+
+
+def collectGarbage(blobFolder : str, dryRun : bool = False) -> int:
+    """
+    Remove the blobs no stack links to anymore, returns how many were removed
+    """
+    removed = 0
+    if not os.path.isdir(blobFolder):
+        return 0
+    with os.scandir(blobFolder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".zip") and entry.stat().st_nlink <= 1:
+                if not dryRun:
+                    os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+def linkTo(blob : str, path : str):
+    """
+    Replace path by a hard link to blob, path is never missing meanwhile
+    """
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    os.link(blob, tmpPath)
+    try:
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+
+
+def measureParse(paths : list[str], sampleSize : int = 10) -> float:
+    """
+    Mean time to read the modDesc.xml of an archive, on a sample of paths
+    """
+    sample = paths[:sampleSize]
+    if not sample:
+        return 0.0
+    start = time.perf_counter()
+    parsed = 0
+    for path in sample:
+        try:
+            with ZipReader(path) as reader:
+                ModDesc(reader.open("modDesc.xml"))
+            parsed += 1
+        except OSError: # removed meanwhile
+            continue
+    return (time.perf_counter() - start) / max(1, parsed)
+
+
+def indexLink(source : str, path : str, blobStat : os.stat_result):
+    """
+    Index an archive just linked to a blob with the record of the archive the blob was made from,
+    so it is not parsed again even if its stack is not loaded
+    """
+    record = ModIndex().get(source, blobStat.st_size, blobStat.st_mtime_ns)
+    if record is not None:
+        ModIndex().put(path, blobStat.st_size, blobStat.st_mtime_ns, record)
+
+
+def dedupe(folders : list[str], blobFolder : str, dryRun : bool = False) -> DedupeReport:
+    """
+    Replace the archives having the same content in the given stack folders by hard links to a blob of the store
+    Only archives of the same size are hashed, and each file (inode) is hashed once
+    """
+    report = DedupeReport(dryRun)
+    start = time.perf_counter()
+    report.blobsRemoved = collectGarbage(blobFolder, dryRun)
+
+    def skip(path : str, error : Exception):
+        report.errors.append(f"{path} : {error}")
+        Logger.warning(f"{path} skipped : {error}")
+
+    bySize = {} #type: dict[int, list[str]]
+    inodeOf = {} #type: dict[str, tuple[int, int]] # inode each archive had when it was hashed
+    for folder in folders:
+        for name, (size, _) in snapshot(folder).items():
+            bySize.setdefault(size, []).append(os.path.join(folder, name))
+            report.nbArchives += 1
+            report.totalBytes += size
+
+    for size, paths in bySize.items():
+        if len(paths) < 2:
+            continue
+        byInode = {} #type: dict[tuple[int, int], list[str]]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as e: # removed or replaced meanwhile (by the watcher, an import...)
+                skip(path, e)
+                continue
+            inodeOf[path] = (stat.st_dev, stat.st_ino)
+            byInode.setdefault(inodeOf[path], []).append(path)
+        byDigest = {} #type: dict[str, list[list[str]]]
+        for inodePaths in byInode.values():
+            try:
+                byDigest.setdefault(contentHash(inodePaths[0]), []).append(inodePaths)
+            except OSError as e:
+                skip(inodePaths[0], e)
+
+        for digest, inodes in byDigest.items():
+            group = DuplicateGroup(digest, size, [path for inodePaths in inodes for path in inodePaths], len(inodes))
+            if len(group.paths) < 2:
+                continue
+            report.groups.append(group)
+            report.bytesShared += size * (len(group.paths) - len(inodes))
+            if len(inodes) < 2:
+                continue
+            report.bytesSaved += size * (len(inodes) - 1)
+            blob = os.path.join(blobFolder, digest + ".zip")
+            if dryRun:
+                report.linked += sum(len(inodePaths) for inodePaths in inodes[1:])
+                continue
+            try:
+                if not os.path.exists(blob):
+                    os.makedirs(blobFolder, exist_ok=True)
+                    os.link(inodes[0][0], blob)
+                    blobStat = os.stat(blob)
+                    if (blobStat.st_dev, blobStat.st_ino) != inodeOf[inodes[0][0]]: # replaced since it was hashed
+                        os.remove(blob)
+                        raise FileExistsError(f"{inodes[0][0]} changed during the deduplication")
+                blobStat = os.stat(blob)
+            except OSError as e:
+                report.errors.append(f"{blob} : {e}")
+                Logger.error(f"Could not deduplicate {group.paths} : {e}")
+                continue
+            for inodePaths in inodes:
+                for path in inodePaths:
+                    try:
+                        stat = os.stat(path)
+                        if (stat.st_dev, stat.st_ino) == (blobStat.st_dev, blobStat.st_ino):
+                            continue
+                        if (stat.st_dev, stat.st_ino) != inodeOf[path]:
+                            # replaced since it was hashed, its content may differ from the blob
+                            raise FileExistsError(f"{path} changed during the deduplication")
+                        linkTo(blob, path)
+                        report.linked += 1
+                        indexLink(inodes[0][0], path, blobStat)
+                    except OSError as e:
+                        skip(path, e)
+
+    report.parseSeconds = measureParse([group.paths[0] for group in report.groups])
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def dedupeStacks(stacks : list[ModStack], dryRun : bool = False) -> DedupeReport:
+    """
+    Deduplicate the archives of the stacks, then refresh them (the linked archives are found
+    in the shared metadata of the identical ones, so they are not parsed again)
+    """
+    report = dedupe([stack.getFolder() for stack in stacks], getBlobFolder(), dryRun)
+    if report.linked and not dryRun:
+        for stack in stacks:
+            stack.refresh()
+    Logger.info(f"Deduplication {'(dry run) ' if dryRun else ''}done in {report.seconds:.2f}s\n{report}")
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    from argparse import ArgumentParser
+    try:
+        from .manager import Manager
+    except ImportError:
+        from manager import Manager
+
+    parser = ArgumentParser(description="Store the archives present in several stacks only once")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be done")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    Logger.setLevel("stdout", LEVELS.CRITICAL if args.json else LEVELS.INFO) # stdout is kept for the json report
+    manager = Manager(load=False) # the archives are hashed, the stacks do not have to be loaded
+    manager.findStacks()
+    report = manager.dedupe(args.dry_run)
+    if args.json:
+        print(json.dumps(report.toDict(), indent=4))
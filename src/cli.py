@@ -0,0 +1,176 @@
+"""
+Headless commands (python -m src <command>), for scripts and scheduled tasks : the stacks are used without the UI
+and without parsing their mods, only import parses the archives it adds
+Every command can print its result as json, the exit code is 1 when it failed
+"""
+import os
+import json
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Any, Callable
+
+from gamuLogger import Logger, LEVELS
+
+try:
+    from .manager import Manager
+    from .modStack import ModStack, getEnabledFolder
+    from .modIndex import ModIndex
+    from .modImport import ImportResult
+    from .moddesc import ModDesc
+except ImportError:
+    from manager import Manager
+    from modStack import ModStack, getEnabledFolder
+    from modIndex import ModIndex
+    from modImport import ImportResult
+    from moddesc import ModDesc
+
+Logger.setModule("cli")
+
+CommandResult = tuple[Any, str, bool] # (json data, text, success)
+
+
+def getStack(manager : Manager, name : str) -> ModStack:
+    """
+    The stack, found without looking at the other stacks
+    """
+    manager.findStacks([name])
+    return manager.getStack(name)
+
+
+def stackInfo(stack : ModStack) -> dict[str, Any]:
+    return {"name": stack.getName(), "folder": stack.getFolder(), "archives": stack.getArchiveCount(), "enabled": stack.isEnabled()}
+
+
+def archiveInfo(path : str) -> dict[str, Any]:
+    """
+    Size and modification time of an archive, with its title, author and version if it is in the mod index (it is never parsed)
+    """
+    stat = os.stat(path)
+    info = {"name": os.path.basename(path), "size": stat.st_size, "mtime": stat.st_mtime_ns, "indexed": False}
+    record = ModIndex().get(path, stat.st_size, stat.st_mtime_ns)
+    if record is not None:
+        moddesc = ModDesc.fromRecord(record)
+        info |= {"indexed": True, "title": moddesc.title, "author": moddesc.author, "version": moddesc.version}
+    return info
+
+
+def commandList(manager : Manager, args : Namespace) -> CommandResult:
+    if args.stack is None:
+        stacks = [stackInfo(stack) for stack in sorted(manager.findStacks(), key=ModStack.getName)]
+        text = "\n".join(f"{'*' if stack['enabled'] else ' '} {stack['name']:<32} {stack['archives']:>6} archives" for stack in stacks)
+        return stacks, text, True
+    stack = getStack(manager, args.stack)
+    archives = [archiveInfo(path) for path in sorted(stack.getArchivePaths())]
+    text = "\n".join(
+        f"{archive['name']:<48} {archive.get('title', '?'):<40} {archive.get('version', '')}" for archive in archives
+    )
+    return {"stack": stackInfo(stack), "mods": archives}, text, True
+
+
+def commandEnable(manager : Manager, args : Namespace) -> CommandResult:
+    stack = getStack(manager, args.stack)
+    start = time.perf_counter()
+    stack.enable()
+    seconds = time.perf_counter() - start
+    return {"stack": stack.getName(), "folder": stack.getFolder(), "seconds": seconds}, f"Enabled {stack} ({seconds * 1000:.2f} ms)", True
+
+
+def commandDisable(manager : Manager, args : Namespace) -> CommandResult:
+    folder = getEnabledFolder()
+    ModStack.disable()
+    return {"disabled": folder}, f"Disabled {folder}" if folder is not None else "No stack was enabled", True
+
+
+def commandImport(manager : Manager, args : Namespace) -> CommandResult:
+    results = manager.importInto(getStack(manager, args.stack), [os.path.abspath(path) for path in args.archives])
+    ok = all(result.status != ImportResult.FAILED for result in results)
+    return [result.toDict() for result in results], "\n".join(str(result) for result in results), ok
+
+
+def commandVerify(manager : Manager, args : Namespace) -> CommandResult:
+    manager.findStacks(args.stacks or None)
+    report = manager.verify(args.stacks or None, args.force)
+    return report.toDict(), str(report), report.ok
+
+
+def commandStats(manager : Manager, args : Namespace) -> CommandResult:
+    """
+    Archives, bytes, indexed and checked archives of each stack, from the snapshots and the mod index only
+    """
+    stacks = [getStack(manager, args.stack)] if args.stack is not None else sorted(manager.findStacks(), key=ModStack.getName)
+    result = []
+    for stack in stacks:
+        stats = stackInfo(stack) | {"bytes": 0, "indexed": 0, "verified": 0, "corrupted": 0}
+        for path in stack.getArchivePaths():
+            stat = os.stat(path)
+            stats["bytes"] += stat.st_size
+            stats["indexed"] += ModIndex().get(path, stat.st_size, stat.st_mtime_ns) is not None
+            check = ModIndex().getCheck(path, stat.st_size, stat.st_mtime_ns)
+            if check is not None:
+                stats["verified"] += 1
+                stats["corrupted"] += not check["ok"]
+        result.append(stats)
+    text = "\n".join(
+        f"{'*' if stats['enabled'] else ' '} {stats['name']:<32} {stats['archives']:>6} archives {stats['bytes'] / 1024 / 1024:>10.1f} MiB"
+        f" {stats['indexed']:>6} indexed {stats['verified']:>6} verified {stats['corrupted']:>4} corrupted"
+        for stats in result
+    )
+    return result, text, True
+
+
+COMMANDS = {
+    "list": commandList,
+    "enable": commandEnable,
+    "disable": commandDisable,
+    "import": commandImport,
+    "verify": commandVerify,
+    "stats": commandStats,
+} #type: dict[str, Callable[[Manager, Namespace], CommandResult]]
+
+
+def getParser() -> ArgumentParser:
+    common = ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="print the result as json")
+    common.add_argument("-v", "--verbose", action="store_true", help="log what is done")
+
+    parser = ArgumentParser(prog="python -m src", description="Farming Simulator mods manager, without the UI")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("list", parents=[common], help="list the stacks, or the mods of a stack")
+    command.add_argument("stack", nargs="?", help="list the mods of this stack (from the mod index, archives are not parsed)")
+    command = commands.add_parser("enable", parents=[common], help="link the game mods folder to a stack")
+    command.add_argument("stack")
+    commands.add_parser("disable", parents=[common], help="remove the link to the enabled stack")
+    command = commands.add_parser("import", parents=[common], help="add archives to a stack")
+    command.add_argument("stack")
+    command.add_argument("archives", nargs="+")
+    command = commands.add_parser("verify", parents=[common], help="check the integrity of the archives of the stacks (every stack by default)")
+    command.add_argument("stacks", nargs="*")
+    command.add_argument("--force", action="store_true", help="check again the archives that did not change since their last check")
+    command = commands.add_parser("stats", parents=[common], help="size, indexed and verified archives of the stacks")
+    command.add_argument("stack", nargs="?")
+    return parser
+
+
+def main(argv : list[str] = None) -> int:
+    """
+    Run a command, returns the exit code
+    """
+    args = getParser().parse_args(argv)
+    # stdout is kept for the result
+    Logger.setLevel("stdout", LEVELS.CRITICAL if args.json else LEVELS.INFO if args.verbose else LEVELS.WARNING)
+
+    manager = Manager(load=False) # the commands find the stacks they use
+    error = None
+    try:
+        data, text, ok = COMMANDS[args.command](manager, args)
+    except KeyError as e: # unknown stack
+        error = e.args[0]
+    except (OSError, ValueError) as e: # e.g. the game mods folder is a real folder
+        error = str(e)
+    if error is not None:
+        data, text, ok = {"error": error}, f"Error : {error}", False
+    if args.json:
+        print(json.dumps(data, indent=4, ensure_ascii=False))
+    elif text:
+        print(text)
+    return 0 if ok else 1
@@ -1,15 +1,36 @@
 import sys
 import os
+import time
+import atexit
+from contextlib import contextmanager
+from multiprocessing import parent_process
+from threading import RLock, Timer, get_ident
 
-from json5 import load, dump
+from json5 import load, dumps
 
 from gamuLogger import Logger
 
-# CONFIG_FILE_PATH = os.environ["APPDATA"] + "\\mod_manager\\config.txt" if sys.platform == "win32" else os.environ["HOME"] + "/.config/mod_manager/config.txt"
-CONFIG_FILE_PATH = os.environ["APPDATA"] + "\\mod_manager\\config.json"
+try:
+    from .profiling import StartupProfiler
+except ImportError:
+    from profiling import StartupProfiler
+
+# %APPDATA% on Windows (or wherever APPDATA points to, e.g. for the benchmarks), ~/.config elsewhere
+CONFIG_FOLDER = os.environ.get("APPDATA") or os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+CONFIG_FILE_PATH = os.path.join(CONFIG_FOLDER, "mod_manager", "config.json")
+
+FLUSH_DELAY = 0.5 # seconds without any change before the config is written
 
 Logger.setModule("config")
 
+
+def isMainProcess() -> bool:
+    """
+    False in the worker processes of a process pool
+    """
+    return parent_process() is None
+
+
 class Config:
     __instance = None
     
@@ -22,30 +43,54 @@ class Config:
     def __init__(self):
         if self.__initialized: return
         self.__initialized = True
+        with StartupProfiler().phase("config"):
+            self.__setup(CONFIG_FILE_PATH)
+        
+        Logger.info("Config initialized")
+        
+    @staticmethod
+    def fromFile(path : str) -> 'Config':
+        """
+        Returns a config bound to another file, independent from the application config (Config())
+        """
+        config = super(Config, Config).__new__(Config)
+        config.__initialized = True
+        config.__setup(path)
+        return config
         
+    def __setup(self, path : str):
+        self.__path = path
         self.__config = {}
+        self.__lock = RLock()
+        self.__dirty = False
+        self.__batchDepth = 0
+        self.__timer = None #type: Timer
+        self.__lastChange = 0.0
         self.__load()
-        
-        Logger.info("Config initialized")
+        atexit.register(self.flush)
         
         
     def __load(self):
         """Load the config from the config file"""
         try:
-            with open(CONFIG_FILE_PATH) as file:
+            with open(self.__path) as file:
                 self.__config = load(file)
         except FileNotFoundError:
             Logger.warning("Config file not found, creating a new one")
-            os.makedirs(os.path.dirname(CONFIG_FILE_PATH), exist_ok=True)
-            self.__save()
+            if isMainProcess():
+                os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+                self.__save()
         except Exception as e:
             Logger.error(f"Could not load config file : {e}")
     
     
     def __save(self):
-        """Write the config to the config file in json format"""
-        with open(CONFIG_FILE_PATH, "w") as file:
-            dump(self.__config, file,
+        """
+        Write the config to the config file in json format
+        The file is written next to the config and then moved over it, so a crash never leaves a half-written config
+        """
+        with self.__lock:
+            content = dumps(self.__config,
                     indent=4,
                     sort_keys=True,
                     ensure_ascii=False,
@@ -53,24 +98,86 @@ class Config:
                     trailing_commas=False,
                     allow_duplicate_keys=False
                 )
+            self.__dirty = False
+            tmpPath = f"{self.__path}.{os.getpid()}.{get_ident()}.tmp" # the timer thread and the main thread can both save
+            with open(tmpPath, "w") as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmpPath, self.__path)
+        Logger.deepDebug("Config saved")
+            
+    def flush(self):
+        """Write the pending changes now"""
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if self.__dirty:
+                self.__save()
+                
+    def __scheduleFlush(self):
+        """Write the config once it stopped changing for FLUSH_DELAY seconds"""
+        self.__lastChange = time.monotonic()
+        if self.__timer is None:
+            self.__startTimer(FLUSH_DELAY)
+            
+    def __startTimer(self, delay : float):
+        self.__timer = Timer(delay, self.__onTimer)
+        self.__timer.daemon = True
+        self.__timer.start()
+        
+    def __onTimer(self):
+        with self.__lock:
+            self.__timer = None
+            remaining = self.__lastChange + FLUSH_DELAY - time.monotonic()
+            if remaining > 0: # changed again since the timer was started
+                self.__startTimer(remaining)
+            elif self.__batchDepth == 0 and self.__dirty:
+                self.__save()
+        
+    @contextmanager
+    def batch(self):
+        """
+        Group several changes in a single write, done when the outermost batch ends
+        with Config().batch():
+            Config().set("a", 1)
+            Config().set("b", 2)
+        """
+        with self.__lock:
+            self.__batchDepth += 1
+        try:
+            yield self
+        finally:
+            with self.__lock:
+                self.__batchDepth -= 1
+                if self.__batchDepth == 0:
+                    self.flush()
             
                 
     def get(self, key : str, default = None, setDefault = False):
         """
         Get a value from the config file, if the key is not found, return the default value
-        Write the default value to the config file if setDefault is True
+        Write the default value to the config file if setDefault is True, only from the main process : a worker process
+        has its own copy of the config, saving it could overwrite the changes of the main process
         """
         if key not in self.__config:
-            if setDefault:
+            if setDefault and isMainProcess():
                 self.set(key, default)
             return default
         return self.__config[key]
     
     
     def set(self, key : str, value):
-        """Set a value in the config file"""
-        self.__config[key] = value
-        self.__save()
+        """
+        Set a value in the config file
+        The file is written after FLUSH_DELAY seconds without changes, or at the end of the current batch
+        """
+        with self.__lock:
+            self.__config[key] = value
+            self.__dirty = True
+            if self.__batchDepth == 0:
+                self.__scheduleFlush()
         
         
     def __contains__(self, key : str):
@@ -78,4 +185,4 @@ class Config:
     
     
     def keys(self):
-        return self.__config.keys()
\ No newline at end of file
+        return self.__config.keys()
@@ -0,0 +1,223 @@
+"""
+Problems between the mods of a stack that the game does not report well :
+the same mod in several versions or twice, two mods with the same title, archives shipping the same files,
+and scripts with the same path but a different content (they may define the same global classes)
+Every check goes through hash maps over the titles and the archive entries, so the analysis is near-linear
+"""
+import os
+import time
+from typing import Any
+
+from gamuLogger import Logger, LEVELS
+
+try:
+    from .archiveEntries import ArchiveEntries, getEntries
+    from .mod import Mod
+except ImportError:
+    from archiveEntries import ArchiveEntries, getEntries
+    from mod import Mod
+
+Logger.setModule("conflicts")
+
+IGNORED_FILES = {"moddesc.xml"} # every mod has one
+SCRIPT_EXTENSIONS = (".lua",)
+MAX_SHARING = 16 # a file shipped by more archives is a common asset, it is not compared pair by pair
+MAX_EXAMPLES = 5 # file names kept in each conflict
+
+
+class Conflict:
+    """
+    A problem involving several archives of a stack
+    """
+    VERSIONS = "versions" # same title and author, different versions
+    DUPLICATE = "duplicate" # same title, author and version
+    TITLE = "title" # same title, different authors
+    OVERLAP = "overlap" # identical files (same name, crc and size) in several archives
+    SCRIPT = "script" # same script path, different content
+
+    def __init__(self, kind : str, archives : list[str], detail : str, files : list[str] = None):
+        self.kind = kind
+        self.archives = archives
+        self.detail = detail
+        self.files = files or [] # a few of the files involved
+
+    def toDict(self) -> dict[str, Any]:
+        return {"kind": self.kind, "archives": self.archives, "detail": self.detail, "files": self.files}
+
+    def __str__(self) -> str:
+        return f"[{self.kind}] {', '.join(self.archives)} : {self.detail}"
+
+
+class ConflictReport:
+    def __init__(self, stack : str, conflicts : list[Conflict], nbArchives : int, nbEntries : int, seconds : float):
+        self.stack = stack
+        self.conflicts = conflicts
+        self.nbArchives = nbArchives
+        self.nbEntries = nbEntries
+        self.seconds = seconds
+
+    def byArchive(self) -> dict[str, list[Conflict]]:
+        """
+        Conflicts involving each archive
+        """
+        result = {} #type: dict[str, list[Conflict]]
+        for conflict in self.conflicts:
+            for archive in conflict.archives:
+                result.setdefault(archive, []).append(conflict)
+        return result
+
+    def toDict(self) -> dict[str, Any]:
+        return {
+            "stack": self.stack,
+            "archives": self.nbArchives,
+            "entries": self.nbEntries,
+            "seconds": self.seconds,
+            "conflicts": [conflict.toDict() for conflict in self.conflicts],
+        }
+
+    def __str__(self) -> str:
+        lines = [f"{len(self.conflicts)} conflicts between the {self.nbArchives} archives of {self.stack} ({self.nbEntries} files checked)"]
+        lines.extend(str(conflict) for conflict in self.conflicts)
+        return "\n".join(lines)
+
+
+def _text(mod : Mod, attr : str) -> str | None:
+    try:
+        return getattr(mod, attr).strip()
+    except Exception: # a lazy mod that cannot be loaded
+        return None
+
+
+def findTitleConflicts(mods : dict[str, Mod]) -> tuple[list[Conflict], list[list[str]]]:
+    """
+    Conflicts between mods having the same title, and the groups of archives that are the same mod
+    """
+    byTitle = {} #type: dict[str, list[str]]
+    for file, mod in mods.items():
+        title = _text(mod, "title")
+        if title:
+            byTitle.setdefault(title.casefold(), []).append(file)
+
+    conflicts = [] #type: list[Conflict]
+    sameMod = [] #type: list[list[str]]
+    for files in byTitle.values():
+        if len(files) < 2:
+            continue
+        byAuthor = {} #type: dict[str, list[str]]
+        for file in files:
+            byAuthor.setdefault((_text(mods[file], "author") or "").casefold(), []).append(file)
+        title = _text(mods[files[0]], "title")
+        if len(byAuthor) > 1:
+            authors = [_text(mods[group[0]], "author") or "?" for group in byAuthor.values()]
+            conflicts.append(Conflict(Conflict.TITLE, sorted(files), f"\"{title}\" by {', '.join(authors)}"))
+        for group in byAuthor.values():
+            if len(group) < 2:
+                continue
+            sameMod.append(group)
+            versions = {} #type: dict[str, list[str]]
+            for file in group:
+                versions.setdefault(_text(mods[file], "version") or "", []).append(file)
+            if len(versions) > 1:
+                detail = f"\"{title}\" in versions " + ", ".join(f"{version} ({', '.join(sorted(files))})" for version, files in sorted(versions.items()))
+                conflicts.append(Conflict(Conflict.VERSIONS, sorted(group), detail))
+            for version, files in versions.items():
+                if len(files) > 1:
+                    conflicts.append(Conflict(Conflict.DUPLICATE, sorted(files), f"\"{title}\" {version} is in the stack {len(files)} times"))
+    return conflicts, sameMod
+
+
+def findFileConflicts(entries : dict[str, ArchiveEntries], sameMod : list[list[str]] = ()) -> list[Conflict]:
+    """
+    Archives sharing identical files, and scripts with the same path and different contents
+    Archives known to be the same mod (in sameMod) are expected to share files and are not reported
+    """
+    byContent = {} #type: dict[tuple[str, int, int], list[str]]
+    scripts = {} #type: dict[str, dict[int, list[str]]] # script path -> crc -> archives
+    for file, archiveEntries in entries.items():
+        for name, crc, size in archiveEntries:
+            key = name.replace("\\", "/").casefold()
+            if key in IGNORED_FILES:
+                continue
+            byContent.setdefault((key, crc, size), []).append(file)
+            if key.endswith(SCRIPT_EXTENSIONS):
+                scripts.setdefault(key, {}).setdefault(crc, []).append(file)
+
+    modOf = {file: i for i, group in enumerate(sameMod) for file in group}
+    isSameMod = lambda files: len({modOf.get(file, file) for file in files}) == 1
+
+    shared = {} #type: dict[tuple[str, str], list[str]] # pair of archives -> files they both ship
+    for (name, _, _), files in byContent.items():
+        if len(files) < 2 or len(files) > MAX_SHARING:
+            continue
+        files = sorted(set(files))
+        for i, first in enumerate(files):
+            for second in files[i + 1:]:
+                shared.setdefault((first, second), []).append(name)
+
+    overlaps = [] #type: list[tuple[float, Conflict]]
+    for (first, second), names in shared.items():
+        if isSameMod((first, second)):
+            continue
+        ratio = len(names) / max(1, min(len(entries[first]), len(entries[second])))
+        overlaps.append((ratio, Conflict(Conflict.OVERLAP, [first, second], f"{len(names)} identical files ({ratio:.0%} of the smallest archive)", sorted(names)[:MAX_EXAMPLES])))
+    overlaps.sort(key=lambda overlap: overlap[0], reverse=True) # repackaged mods first
+    conflicts = [conflict for _, conflict in overlaps]
+
+    for name, versions in scripts.items():
+        if len(versions) < 2:
+            continue
+        files = sorted({file for files in versions.values() for file in files})
+        if len(files) > MAX_SHARING or isSameMod(files): # a generic name (main.lua...) used by many mods
+            continue
+        conflicts.append(Conflict(Conflict.SCRIPT, files, f"{name} has {len(versions)} different contents", [name]))
+    return conflicts
+
+
+def analyze(stack : str, mods : dict[str, Mod], entries : dict[str, ArchiveEntries]) -> ConflictReport:
+    """
+    Every conflict between the mods (archive name -> mod) of a stack, entries are the files of each archive
+    """
+    start = time.perf_counter()
+    conflicts, sameMod = findTitleConflicts(mods)
+    conflicts += findFileConflicts(entries, sameMod)
+    report = ConflictReport(stack, conflicts, len(mods), sum(len(archiveEntries) for archiveEntries in entries.values()), 0.0)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def readEntries(folder : str, files : list[str]) -> dict[str, ArchiveEntries]:
+    """
+    Entries of the archives of a folder, an archive that cannot be read is skipped
+    """
+    entries = {} #type: dict[str, ArchiveEntries]
+    for file in files:
+        try:
+            entries[file] = getEntries(os.path.join(folder, file))
+        except Exception as e:
+            Logger.warning(f"Could not read the files of {file} : {e}")
+    return entries
+
+
+if __name__ == "__main__":
+    import json
+    from argparse import ArgumentParser
+    try:
+        from .manager import Manager
+    except ImportError:
+        from manager import Manager
+
+    parser = ArgumentParser(description="Find the conflicts between the mods of a stack")
+    parser.add_argument("stack", help="name of the stack")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    Logger.setLevel("stdout", LEVELS.CRITICAL if args.json else LEVELS.INFO) # stdout is kept for the json report
+    manager = Manager(load=False) # only the stack analyzed is loaded
+    manager.findStacks([args.stack])
+    stack = manager.getStack(args.stack)
+    stack.load()
+    report = stack.getConflicts()
+    if args.json:
+        print(json.dumps(report.toDict(), indent=4))
+    else:
+        Logger.info(str(report))
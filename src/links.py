@@ -0,0 +1,75 @@
+"""
+Directory links used to enable a stack: symlinks, or junctions on Windows (they do not need admin rights)
+"""
+import os
+import sys
+import threading
+
+from gamuLogger import Logger
+
+Logger.setModule("links")
+
+IS_WINDOWS = sys.platform == "win32"
+
+
+def normalizePath(path : str) -> str:
+    if path.startswith("\\\\?\\"): # os.readlink returns junction targets with the extended-length prefix
+        path = path[4:]
+    return os.path.normcase(os.path.abspath(path))
+
+
+def createLink(target : str, link : str):
+    """
+    Create link, a directory link to target
+    """
+    if IS_WINDOWS:
+        import _winapi
+        _winapi.CreateJunction(os.path.abspath(target), os.path.abspath(link))
+    else:
+        os.symlink(os.path.abspath(target), link, target_is_directory=True)
+
+
+def readLink(path : str) -> str | None:
+    """
+    Returns the folder the link points to, or None if path is not a link (single system call, so it never sees a half-done switch)
+    """
+    try:
+        return normalizePath(os.path.join(os.path.dirname(path), os.readlink(path)))
+    except (OSError, ValueError): # missing, or not a link
+        return None
+
+
+def removeLink(path : str):
+    """
+    Remove the link, never the folder it points to; raise IsADirectoryError if path is a real folder
+    """
+    if readLink(path) is None:
+        if os.path.isdir(path):
+            raise IsADirectoryError(f"{path} is a real folder, not a link")
+        if not os.path.lexists(path):
+            return
+        raise FileExistsError(f"{path} is not a link")
+    if IS_WINDOWS:
+        os.rmdir(path) # removes the junction itself
+    else:
+        os.unlink(path)
+
+
+def replaceLink(target : str, link : str):
+    """
+    Point link to target; link can already be a link to another folder, but not a real file or folder
+    On POSIX the new link is created next to it and renamed over it, so link always exists
+    Windows cannot rename over a directory, the old junction is removed just before the rename
+    """
+    if os.path.lexists(link) and readLink(link) is None:
+        raise FileExistsError(f"{link} exists and is not a link, move its content to a stack first")
+    os.makedirs(os.path.dirname(os.path.abspath(link)), exist_ok=True)
+    tmpLink = f"{link}.{os.getpid()}.{threading.get_ident()}.tmp"
+    createLink(target, tmpLink)
+    try:
+        if IS_WINDOWS and os.path.lexists(link):
+            removeLink(link)
+        os.replace(tmpLink, link)
+    except BaseException:
+        removeLink(tmpLink)
+        raise
@@ -1,11 +1,30 @@
 try:
-    from .modStack import ModStack
+    from .modStack import ModStack, ChangeSet, isLazyLoadEnabled
     from .config import Config
+    from .watcher import Watcher
+    from .mod import Mod
+    from .profiling import StartupProfiler
+    from .modImport import ImportResult
+    from .blobStore import DedupeReport, dedupeStacks
+    from .searchIndex import SearchIndex
+    from .verify import VerifyReport, verifyArchives
 except ImportError:
-    from modStack import ModStack
+    from modStack import ModStack, ChangeSet, isLazyLoadEnabled
     from config import Config
+    from watcher import Watcher
+    from mod import Mod
+    from profiling import StartupProfiler
+    from modImport import ImportResult
+    from blobStore import DedupeReport, dedupeStacks
+    from searchIndex import SearchIndex
+    from verify import VerifyReport, verifyArchives
     
-import os   
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Any
 from gamuLogger import Logger, LEVELS
 
 Logger.setModule("manager")
@@ -16,31 +35,143 @@ class Manager:
     """
     __instance = None #type: Manager
     
-    def __new__(cls):
+    def __new__(cls, *args, **kwargs):
         if cls.__instance is None:
             cls.__instance = super(Manager, cls).__new__(cls)
             cls.__instance.__initialized = False
         return cls.__instance
     
-    def __init__(self):
+    def __init__(self, load : bool = True):
+        """
+        Find and load every stack of the stack folder
+        If load is False, nothing is loaded until load() is called (e.g. from a background thread)
+        """
         if self.__initialized: return
         self.__initialized = True
         
         self.__stack_folder = Config().get("stack_folder")
-        self.__stacks = {}
+        self.__stacks = {} #type: dict[str, ModStack]
+        self.__watcher = None #type: Watcher
+        self.__searchIndex = SearchIndex()
         
         Logger.info("Manager initialized")
         
-        self.__load()
+        if load:
+            self.load()
         
-    def __load(self):
+    def load(self, onStackCreated : Callable[[ModStack], Any] = None, onModLoaded : Callable[[ModStack, str, Mod | None], Any] = None):
+        """
+        Load every stack of the stack folder
+        onStackCreated(stack) is called for each stack before its mods are loaded,
+        onModLoaded(stack, file, mod) for each archive once it is loaded (mod is None if it could not be loaded)
+        Callbacks are called from worker threads when the process pool is used
+        """
+        with StartupProfiler().phase("manager load"):
+            self.__load(onStackCreated, onModLoaded)
+            
+    def __load(self, onStackCreated : Callable[[ModStack], Any], onModLoaded : Callable[[ModStack, str, Mod | None], Any]):
         Logger.info(f"Loading stacks from {self.__stack_folder}")
-        for folder in os.listdir(self.__stack_folder):
-            if os.path.isdir(os.path.join(self.__stack_folder, folder)):
-                stack = ModStack(os.path.join(self.__stack_folder, folder))
-                self.__stacks[stack.getName()] = stack
-        Logger.info(f"{len(self.__stacks)} stacks loaded")
+        start = time.perf_counter()
+        stacks = self.findStacks()
+        if onStackCreated is not None:
+            for stack in stacks:
+                onStackCreated(stack)
+                
+        def loadStack(stack : ModStack, executor : ProcessPoolExecutor = None):
+            callback = None
+            if onModLoaded is not None:
+                callback = lambda file, mod: onModLoaded(stack, file, mod)
+            stack.load(executor, callback)
         
+        executor = self.__processPool() if stacks else None
+        if executor is None:
+            for stack in stacks:
+                loadStack(stack)
+        else:
+            # stacks are loaded in threads so that every stack feeds the same process pool at the same time
+            with executor, ThreadPoolExecutor(len(stacks)) as threads:
+                for _ in threads.map(lambda stack: loadStack(stack, executor), stacks):
+                    pass
+        
+        Logger.info(f"{len(self.__stacks)} stacks loaded in {time.perf_counter() - start:.2f}s")
+        if not isLazyLoadEnabled(): # lazy mods are parsed by the first search instead
+            self.__searchIndex.flush()
+        
+    def findStacks(self, names : list[str] = None) -> list[ModStack]:
+        """
+        Every stack of the stack folder (or only the ones named), the stacks not known yet are created without loading their mods
+        """
+        for folder in os.listdir(self.__stack_folder) if names is None else names:
+            path = os.path.join(self.__stack_folder, folder)
+            if folder in self.__stacks or folder.startswith(".") or os.path.basename(folder) != folder or not os.path.isdir(path): # e.g. the blob store
+                continue
+            stack = ModStack(path, load=False)
+            self.__stacks[stack.getName()] = stack
+            stack.addListener(self.__indexer(stack))
+        return list(self.__stacks.values()) if names is None else [self.__stacks[name] for name in names if name in self.__stacks]
+        
+    def __indexer(self, stack : ModStack) -> Callable[[str, Mod | None], Any]:
+        name = stack.getName()
+        def onModChanged(file : str, mod : Mod | None):
+            if mod is None:
+                self.__searchIndex.remove((name, file))
+            else:
+                self.__searchIndex.update((name, file), mod)
+        return onModChanged
+    
+    def search(self, query : str) -> dict[str, set[str]]:
+        """
+        Mods whose title, description (in any language), author or version contain every term of the query, as {stack name: archive names}
+        A term matches the words starting with it, a term between double quotes only matches whole words
+        """
+        result = {} #type: dict[str, set[str]]
+        for stack, file in self.__searchIndex.search(query):
+            result.setdefault(stack, set()).add(file)
+        return result
+        
+    
+    def __processPool(self) -> ProcessPoolExecutor | None:
+        """
+        A pool of processes to parse archives on, or None if the config disables it
+        """
+        # 0 means one worker per core, 1 disable the process pool
+        workers = Config().get("load_workers", 0, True) or os.cpu_count()
+        if workers <= 1:
+            return None
+        Logger.debug(f"Parsing mods on {workers} processes")
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    
+    def importInto(self, stack : ModStack | str, archivePaths : list[str]) -> list[ImportResult]:
+        """
+        Add the archives to the stack (a stack or its name), see ModStack.addMods
+        """
+        if isinstance(stack, str):
+            stack = self.getStack(stack)
+        # starting the worker processes costs more than parsing a few archives
+        executor = self.__processPool() if len(archivePaths) >= 8 else None
+        if executor is None:
+            return stack.addMods(archivePaths)
+        with executor:
+            return stack.addMods(archivePaths, executor)
+    
+    def dedupe(self, dryRun : bool = False) -> DedupeReport:
+        """
+        Store the archives present in several stacks only once, see blobStore
+        """
+        return dedupeStacks(list(self.__stacks.values()), dryRun)
+    
+    def verify(self, stackNames : list[str] = None, force : bool = False) -> VerifyReport:
+        """
+        Check the integrity of the archives of the stacks (every stack by default) on the process pool, see verify
+        The stacks do not have to be loaded
+        """
+        stacks = [self.getStack(name) for name in stackNames] if stackNames is not None else list(self.__stacks.values())
+        paths = [path for stack in stacks for path in stack.getArchivePaths()]
+        executor = self.__processPool() if len(paths) >= 8 else None
+        if executor is None:
+            return verifyArchives(paths, force=force)
+        with executor:
+            return verifyArchives(paths, executor, force)
     
     def getStack(self, name : str) -> ModStack:
         if name not in self.__stacks:
@@ -51,11 +182,27 @@ class Manager:
     def getStacksNames(self) -> list[str]:
         return [str(stack) for stack in self.__stacks.keys()]
     
+    def startWatching(self, onChange : Callable[[ModStack, ChangeSet], Any] = None):
+        """
+        Keep every stack in sync with its folder in the background, the stacks created in the stack folder are loaded and watched too
+        onChange is called from a worker thread each time a stack changed (or was created)
+        """
+        if self.__watcher is not None:
+            return
+        self.__watcher = Watcher(list(self.__stacks.values()), onChange, root=self.__stack_folder, discover=self.findStacks)
+        self.__watcher.start()
+        
+    def stopWatching(self):
+        if self.__watcher is None:
+            return
+        self.__watcher.stop()
+        self.__watcher = None
+    
     
 if __name__ == "__main__":
     Logger.setLevel("stdout", LEVELS.INFO)
     manager = Manager()
-    stack = manager.getStack("mods_old")
+    stack = manager.getStack(sys.argv[1] if len(sys.argv) > 1 else "mods_old")
     stack.enable()
     stacks = manager.getStacksNames()
     Logger.info(f"Got stacks {stacks}")
\ No newline at end of file
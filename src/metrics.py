@@ -0,0 +1,230 @@
+"""
+Named timers, counters and histograms for the loading code (python -m src --metrics [file])
+Nothing is recorded until Metrics().enable() is called, so the instrumentation can stay in the hot paths
+"""
+import os
+import csv
+import json
+import time
+import atexit
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from typing import Any, Callable
+
+from gamuLogger import Logger
+
+Logger.setModule("metrics")
+
+Sample = tuple[str, str, float, str | None] # (kind, name, value, key)
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+TIMER = "timer"
+
+
+class Histogram:
+    """
+    Every value recorded under a name, and the total of the values recorded for each key (e.g. each mod)
+    """
+    def __init__(self, kind : str):
+        self.kind = kind
+        self.values = [] #type: list[float]
+        self.keys = {} #type: dict[str, float]
+
+    def add(self, value : float, key : str = None):
+        self.values.append(value)
+        if key is not None:
+            self.keys[key] = self.keys.get(key, 0) + value
+
+    def summary(self, nbKeys : int = 10) -> dict[str, Any]:
+        values = sorted(self.values)
+        total = sum(values)
+        return {
+            "kind": self.kind,
+            "count": len(values),
+            "total": total,
+            "min": values[0],
+            "mean": total / len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+            "top": dict(sorted(self.keys.items(), key=lambda item: item[1], reverse=True)[:nbKeys])
+        }
+
+
+class Metrics:
+    """
+    Collects the metrics of the application, and reports them at exit
+    Timers are in seconds; a key (mod path, stack name...) can be given to find which ones are slow
+    """
+    __instance = None #type: Metrics
+
+    def __new__(cls):
+        if cls.__instance is None:
+            cls.__instance = super(Metrics, cls).__new__(cls)
+            cls.__instance.__initialized = False
+        return cls.__instance
+
+    def __init__(self):
+        if self.__initialized: return
+        self.__initialized = True
+
+        self.__enabled = False
+        self.__lock = Lock()
+        self.__counters = {} #type: dict[str, float]
+        self.__histograms = {} #type: dict[str, Histogram]
+        self.__capture = local()
+        self.__dumpPath = None #type: str | None
+
+    def enable(self, dumpPath : str = None):
+        """
+        Start recording, the metrics are logged at exit and written to dumpPath (json, or csv if it ends with .csv)
+        """
+        if not self.__enabled:
+            atexit.register(self.__atExit)
+        self.__enabled = True
+        self.__dumpPath = dumpPath
+
+    def isEnabled(self) -> bool:
+        return self.__enabled
+
+    def __record(self, kind : str, name : str, value : float, key : str = None):
+        samples = getattr(self.__capture, "samples", None)
+        if samples is not None:
+            samples.append((kind, name, value, key))
+            return
+        with self.__lock:
+            if kind == COUNTER:
+                self.__counters[name] = self.__counters.get(name, 0) + value
+            else:
+                if name not in self.__histograms:
+                    self.__histograms[name] = Histogram(kind)
+                self.__histograms[name].add(value, key)
+
+    def count(self, name : str, value : float = 1):
+        """
+        Increase a counter
+        """
+        if self.__enabled or hasattr(self.__capture, "samples"):
+            self.__record(COUNTER, name, value)
+
+    def observe(self, name : str, value : float, key : str = None):
+        """
+        Add a value to a histogram (e.g. a size in bytes)
+        """
+        if self.__enabled or hasattr(self.__capture, "samples"):
+            self.__record(HISTOGRAM, name, value, key)
+
+    @contextmanager
+    def timer(self, name : str, key : str = None):
+        """
+        Time the block, the duration is recorded even if it raises
+        """
+        if not (self.__enabled or hasattr(self.__capture, "samples")):
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__record(TIMER, name, time.perf_counter() - start, key)
+
+    def timed(self, name : str = None) -> Callable[[Callable], Callable]:
+        """
+        Decorator timing every call of the function (under its qualified name by default)
+        """
+        def decorator(func : Callable) -> Callable:
+            timerName = name or f"{func.__module__}.{func.__qualname__}"
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(timerName):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def capture(self):
+        """
+        Collect the samples recorded by the current thread in a list instead of recording them
+        Used in worker processes, the list is sent back to the main process and passed to merge()
+        """
+        previous = getattr(self.__capture, "samples", None)
+        samples = self.__capture.samples = [] #type: list[Sample]
+        try:
+            yield samples
+        finally:
+            if previous is None:
+                del self.__capture.samples
+            else:
+                self.__capture.samples = previous
+
+    def merge(self, samples : list[Sample]):
+        """
+        Record samples collected with capture()
+        """
+        if self.__enabled:
+            for kind, name, value, key in samples:
+                self.__record(kind, name, value, key)
+
+    def summary(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "counters": dict(sorted(self.__counters.items())),
+                "histograms": {name: histogram.summary() for name, histogram in sorted(self.__histograms.items())}
+            }
+
+    def reset(self):
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+    def report(self):
+        """
+        Log a summary of every metric
+        """
+        summary = self.summary()
+        Logger.info("Counters :")
+        for name, value in summary["counters"].items():
+            Logger.info(f"    {name:<32} {value:>10g}")
+        Logger.info("Timers and histograms (count, total, mean, p95, max) :")
+        for name, stats in summary["histograms"].items():
+            scale, unit = (1000, "ms") if stats["kind"] == TIMER else (1, "")
+            Logger.info(
+                f"    {name:<32} {stats['count']:>6} {stats['total'] * scale:>10.1f}{unit} {stats['mean'] * scale:>8.2f}{unit} "
+                f"{stats['p95'] * scale:>8.2f}{unit} {stats['max'] * scale:>8.2f}{unit}"
+            )
+            for key, value in list(stats["top"].items())[:3]:
+                Logger.debug(f"        {key} : {value * scale:.2f}{unit}")
+
+    def dump(self, path : str):
+        """
+        Write the summary to a json file, or to a csv file (one row per metric and per key) if path ends with .csv
+        """
+        summary = self.summary()
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w", newline="") as f:
+            if path.lower().endswith(".csv"):
+                fields = ["kind", "name", "key", "count", "total", "min", "mean", "p50", "p95", "max"]
+                writer = csv.DictWriter(f, fields)
+                writer.writeheader()
+                for name, value in summary["counters"].items():
+                    writer.writerow({"kind": COUNTER, "name": name, "total": value})
+                for name, stats in summary["histograms"].items():
+                    writer.writerow({field: stats.get(field) for field in fields} | {"name": name})
+                    for key, value in stats["top"].items():
+                        writer.writerow({"kind": stats["kind"], "name": name, "key": key, "total": value})
+            else:
+                json.dump(summary, f, indent=4)
+        os.replace(tmpPath, path)
+        Logger.info(f"Metrics written to {path}")
+
+    def __atExit(self):
+        if not self.__enabled:
+            return
+        self.report()
+        if self.__dumpPath:
+            try:
+                self.dump(self.__dumpPath)
+            except OSError as e:
+                Logger.error(f"Could not write the metrics to {self.__dumpPath} : {e}")
@@ -1,68 +1,292 @@
 from zipfile import ZipFile
 import os
+from threading import RLock, Lock
+from typing import Any
 
 from gamuLogger import Logger
 
 try:
     from .moddesc import ModDesc
+    from .modIndex import ModIndex
+    from .thumbnails import ThumbnailCache, thumbnailKey
+    from .metrics import Metrics
+    from .archiveEntries import ArchiveEntries
+    from .zipReader import ZipReader
 except ImportError:
     from moddesc import ModDesc
-    
-TEMP_FOLDER = os.path.join(os.environ["TEMP"], "mod_manager")
-os.makedirs(TEMP_FOLDER, exist_ok=True)
+    from modIndex import ModIndex
+    from thumbnails import ThumbnailCache, thumbnailKey
+    from metrics import Metrics
+    from archiveEntries import ArchiveEntries
+    from zipReader import ZipReader
     
 Logger.setModule("mod")
 
+
+def saveIcon(zipfile : ZipFile | ZipReader, iconName : str, key : str) -> str:
+    # store a thumbnail of the icon in the thumbnail cache and return its path
+    with Metrics().timer("icon.extract", zipfile.filename):
+        data = zipfile.read(iconName)
+        Metrics().observe("icon.bytes", len(data), zipfile.filename)
+        iconPath = ThumbnailCache().store(key, data)
+    Logger.debug(f"Icon saved to {iconPath}")
+    return iconPath
+    
+
+def findRealIcon(zipfile : ZipFile, icon : str) -> str:
+    Logger.deepDebug(f"Finding real icon for mod {zipfile.filename}")
+    if icon in zipfile.namelist():
+        Logger.deepDebug(f"Icon found (exact match)")
+        return icon
+    Logger.deepDebug(f"No exact match for icon {icon}, trying case insensitive")
+    
+    #try without case sensitivity
+    for file in zipfile.namelist():
+        if file.lower() == icon.lower():
+            Logger.deepDebug(f"Icon found (case insensitive) : {file}")
+            return file
+    Logger.deepDebug(f"No case insensitive match for icon {icon}, trying with the same name")
+        
+    #try with the same name, but with a different extension (dds, png, jpg, jpeg, ...)
+    for file in zipfile.namelist():
+        if file.split(".")[0] == icon.split(".")[0]:
+            Logger.deepDebug(f"Icon found (same name) : {file}")
+            return file
+
+    Logger.error(f"Could not find icon {icon} for mod {zipfile.filename}")
+    raise FileNotFoundError(f"Could not find icon {icon} for mod {zipfile.filename}")
+
+
+def findIcon(reader : ZipReader, icon : str) -> str:
+    """
+    Same as findRealIcon, with the lookup tables of the reader instead of three scans of the names
+    """
+    iconName = reader.find(icon)
+    if iconName is None:
+        Logger.error(f"Could not find icon {icon} for mod {reader.filename}")
+        raise FileNotFoundError(f"Could not find icon {icon} for mod {reader.filename}")
+    return iconName
+
+
+def readModRecord(zippath : str, extractIcon : bool = True) -> dict[str, Any]:
+    """
+    Parse the archive and extract its icon (unless extractIcon is False), without using the mod index
+    Only plain data is returned, so this can run in a worker process
+    Only the central directory, modDesc.xml and the icon are read (see zipReader), the entries of the archive
+    are stored in the index with the record
+    """
+    stat = os.stat(zippath)
+    with Metrics().timer("mod.parse", zippath), ZipReader(zippath) as reader:
+        Logger.deepDebug(f"Central directory read ({len(reader)} entries)")
+        moddesc = ModDesc(reader.open("modDesc.xml"))
+        Logger.deepDebug(f"ModDesc loaded")
+        entries = ArchiveEntries.fromReader(reader)
+        iconName = findIcon(reader, moddesc.icon)
+        thumbnail = thumbnailKey(iconName, *reader.getInfo(iconName))
+        if extractIcon and ThumbnailCache().get(thumbnail) is None:
+            try:
+                saveIcon(reader, iconName, thumbnail)
+            except Exception as e:
+                # the mod is still usable without its icon, Mod.iconPath will report it
+                Logger.warning(f"Could not create the thumbnail of {zippath} : {e}")
+    return moddesc.toRecord() | {
+        "iconName": iconName,
+        "thumbnail": thumbnail,
+        "entries": entries.toRaw(),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns
+    }
+    
+
+def readModRecordWithMetrics(zippath : str) -> tuple[dict[str, Any], list]:
+    """
+    readModRecord for worker processes, also returns the metrics recorded meanwhile (see Metrics.merge)
+    """
+    with Metrics().capture() as samples:
+        record = readModRecord(zippath)
+    return record, samples
+
+
+_shared = {} #type: dict[tuple[int, int, int, int], tuple[str, str, ModDesc]] # (iconName, thumbnail, ModDesc), the record itself is not kept
+_sharedLock = Lock()
+
+def fileIdentity(stat : os.stat_result) -> tuple[int, int, int, int] | None:
+    """
+    Identifies the content of a file: hard links to the same file (e.g. deduplicated archives of several stacks) have the same identity
+    """
+    if not stat.st_ino: # not supported by the filesystem
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def compactIconName(iconName : str, moddesc : ModDesc) -> str:
+    """
+    The icon file is usually the one named in modDesc.xml, its name is then not stored twice
+    """
+    return moddesc.icon if iconName == moddesc.icon else iconName
+
+def shareRecord(identity : tuple[int, int, int, int] | None, record : dict[str, Any]):
+    if identity is not None:
+        with _sharedLock:
+            if identity not in _shared:
+                moddesc = ModDesc.fromRecord(record)
+                _shared[identity] = (compactIconName(record["iconName"], moddesc), record["thumbnail"], moddesc)
+
+def sharedModDesc(identity : tuple[int, int, int, int] | None, record : dict[str, Any]) -> ModDesc:
+    """
+    The ModDesc of the record, a single instance is shared by every Mod of the same file
+    """
+    if identity is None:
+        return ModDesc.fromRecord(record)
+    shareRecord(identity, record)
+    return _shared[identity][2]
+
+
+def getIndexedRecord(zippath : str) -> dict[str, Any] | None:
+    """
+    Returns the record of the archive stored in the mod index, or None if it needs to be parsed
+    Records of files already loaded through another path (hard links) are rebuilt from memory
+    """
+    stat = os.stat(zippath)
+    identity = fileIdentity(stat)
+    shared = _shared.get(identity) if identity is not None else None
+    if shared is not None:
+        Metrics().count("index.shared")
+        iconName, thumbnail, moddesc = shared
+        record = moddesc.toRecord() | {"iconName": iconName, "thumbnail": thumbnail, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+        if ModIndex().get(zippath, stat.st_size, stat.st_mtime_ns) is None: # e.g. relinked by the deduplication, its key changed
+            ModIndex().put(zippath, stat.st_size, stat.st_mtime_ns, record)
+        return record
+    record = ModIndex().get(zippath, stat.st_size, stat.st_mtime_ns)
+    Metrics().count("index.hit" if record is not None else "index.miss")
+    if record is not None:
+        shareRecord(identity, record)
+    return record
+
+
+def indexRecord(zippath : str, record : dict[str, Any]):
+    """
+    Store a record returned by readModRecord in the mod index
+    """
+    ModIndex().put(zippath, record["size"], record["mtime"], record)
+    ThumbnailCache().track(record["thumbnail"]) # it may have been stored by a worker process
+    shareRecord(fileIdentity(os.stat(zippath)), record)
+
+
+LOCK_STRIPES = 64
+_modLocks = [RLock() for _ in range(LOCK_STRIPES)] # shared by the mods instead of one lock each
+
+
 class Mod:
-    def __init__(self, zippath : str):
-        Logger.debug(f"Loading mod {zippath}")
+    """
+    A mod archive, its descriptor is shared with the other Mods of the same file and the archive is not kept open
+    """
+    __slots__ = ("zippath", "__moddesc", "__iconName", "__thumbnail", "__iconPath", "__iconLoaded", "__error", "__lazy", "__size", "__mtime")
+    
+    def __init__(self, zippath : str, record : dict[str, Any] = None, lazy : bool = False):
+        """
+        Load the mod from the given record (as returned by readModRecord or getIndexedRecord)
+        If no record is given, the mod index is used, and the archive is parsed only if it changed
+        
+        A lazy mod only reads the archive size and modification time here, the descriptor is loaded
+        on the first access to one of its attributes, and the icon on the first access to iconPath
+        Errors are then raised (and logged) by that first access
+        """
         self.zippath = zippath
-        self.__zipfile = ZipFile(zippath)
-        Logger.deepDebug(f"Zipfile opened")
-        self.__moddesc = ModDesc(self.__zipfile.open("modDesc.xml"))
-        Logger.deepDebug(f"ModDesc loaded")
-        self.__iconPath = self.saveIcon()
-
-        self.__zipfile.close() # Close the zipfile after we're done with it
-        Logger.debug(f"Mod {zippath} loaded")
-
-    def saveIcon(self):
-        # copy the icon to the temp folder and return the path
-        iconName = self.findRealIcon()
-        iconPath = os.path.join(TEMP_FOLDER, iconName)
-        os.makedirs(os.path.dirname(iconPath), exist_ok=True)
-        with open(iconPath, "w+b") as file:
-            file.write(self.__zipfile.open(iconName).read())
-        Logger.debug(f"Icon saved to {iconPath}")
-        return iconPath
+        self.__moddesc = None #type: ModDesc
+        self.__iconName = None #type: str
+        self.__thumbnail = None #type: str
+        self.__iconPath = None #type: str
+        self.__iconLoaded = False
+        self.__error = None #type: Exception
+        self.__lazy = lazy
+        stat = os.stat(zippath)
+        self.__size = stat.st_size
+        self.__mtime = stat.st_mtime_ns
         
-
-    def findRealIcon(self):
-        Logger.deepDebug(f"Finding real icon for mod {self.zippath}")
-        if self.__moddesc.icon in self.__zipfile.namelist():
-            Logger.deepDebug(f"Icon found (exact match)")
-            return self.__moddesc.icon
-        Logger.deepDebug(f"No exact match for icon {self.__moddesc.icon}, trying case insensitive")
+        if record is not None:
+            self.__setRecord(record, fileIdentity(stat))
+        if not lazy:
+            Logger.debug(f"Loading mod {zippath}")
+            with Metrics().timer("mod.load", zippath):
+                self.__loadIcon()
+            Logger.debug(f"Mod {zippath} loaded")
+        
+    def __setRecord(self, record : dict[str, Any], identity : tuple[int, int, int, int] | None):
+        self.__moddesc = sharedModDesc(identity, record)
+        self.__iconName = compactIconName(record["iconName"], self.__moddesc)
+        self.__thumbnail = record["thumbnail"]
+        
+    @property
+    def __lock(self) -> RLock:
+        return _modLocks[hash(self.zippath) % LOCK_STRIPES]
+        
+    def __loadModDesc(self, extractIcon : bool = False) -> ModDesc:
+        moddesc = self.__moddesc
+        if moddesc is not None:
+            return moddesc
+        with self.__lock:
+            if self.__moddesc is None:
+                if self.__error is not None:
+                    raise self.__error
+                try:
+                    record = getIndexedRecord(self.zippath)
+                    if record is None:
+                        record = readModRecord(self.zippath, extractIcon)
+                        indexRecord(self.zippath, record)
+                    else:
+                        Logger.deepDebug(f"Mod found in the index")
+                    self.__setRecord(record, fileIdentity(os.stat(self.zippath)))
+                except Exception as e:
+                    self.__error = e
+                    if self.__lazy: # otherwise the caller of __init__ reports it
+                        Logger.error(f"Could not load mod {self.zippath} : {e}")
+                    raise
+            return self.__moddesc
         
-        #try without case sensitivity
-        for file in self.__zipfile.namelist():
-            if file.lower() == self.__moddesc.icon.lower():
-                Logger.deepDebug(f"Icon found (case insensitive) : {file}")
-                return file
-        Logger.deepDebug(f"No case insensitive match for icon {self.__moddesc.icon}, trying with the same name")
-            
-        #try with the same name, but with a different extension (dds, png, jpg, jpeg, ...)
-        for file in self.__zipfile.namelist():
-            if file.split(".")[0] == self.__moddesc.icon.split(".")[0]:
-                Logger.deepDebug(f"Icon found (same name) : {file}")
-                return file
-
-        Logger.error(f"Could not find icon {self.__moddesc.icon} for mod {self.zippath}")
-        raise FileNotFoundError(f"Could not find icon {self.__moddesc.icon} for mod {self.zippath}")
+    def __iconMissing(self) -> bool:
+        """
+        The icon was not loaded yet, or its thumbnail was evicted from the cache since
+        """
+        return not self.__iconLoaded or (self.__iconPath is not None and not os.path.exists(self.__iconPath))
         
+    def __loadIcon(self) -> str | None:
+        if not self.__iconMissing():
+            return self.__iconPath
+        with self.__lock:
+            if self.__iconMissing():
+                self.__loadModDesc(extractIcon=True)
+                iconPath = ThumbnailCache().get(self.__thumbnail)
+                if iconPath is None:
+                    # not extracted yet, or evicted from the cache
+                    try:
+                        with ZipReader(self.zippath) as reader:
+                            iconPath = saveIcon(reader, self.__iconName, self.__thumbnail)
+                    except Exception as e:
+                        Logger.warning(f"Could not create the thumbnail of {self.zippath} : {e}")
+                self.__iconPath = iconPath
+                self.__iconLoaded = True
+            return self.__iconPath
+        
+    @property
+    def iconPath(self) -> str | None:
+        """
+        Path of the thumbnail of the icon (a png of at most 128x128 pixels), or None if the icon could not be read
+        The thumbnail is extracted again if the cache evicted it
+        """
+        return self.__loadIcon()
+    
+    @property
+    def size(self) -> int:
+        """Size of the archive in bytes"""
+        return self.__size
+    
     @property
-    def iconPath(self):
-        return self.__iconPath
+    def mtime(self) -> int:
+        """Modification time of the archive in nanoseconds"""
+        return self.__mtime
         
     def __getattr__(self, attr):
-        return getattr(self.__moddesc, attr)
\ No newline at end of file
+        if attr.startswith("_Mod__"):
+            # private attribute not set yet (e.g. during __init__), do not try to load the descriptor
+            raise AttributeError(attr)
+        return getattr(self.__loadModDesc(), attr)
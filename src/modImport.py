@@ -0,0 +1,159 @@
+"""
+Copy of mod archives into a stack folder, without going through python buffers when possible
+"""
+import os
+import hashlib
+from threading import Lock
+
+from gamuLogger import Logger
+
+try:
+    from .config import Config
+except ImportError:
+    from config import Config
+
+Logger.setModule("modImport")
+
+CHUNK_SIZE = 1024 * 1024
+
+LINK = "link"
+COPY_FILE_RANGE = "copy_file_range"
+STREAM = "stream"
+
+
+def useLinks() -> bool:
+    """
+    Imported archives are hard links to the source when both are on the same filesystem
+    (so the source must not be modified in place afterwards)
+    """
+    return Config().get("import_hardlink", True, True)
+
+
+class ImportResult:
+    """
+    What happened to one archive given to ModStack.addMod or updateMod
+    """
+    ADDED = "added"
+    UPDATED = "updated"
+    DUPLICATE = "duplicate" # byte-identical to an archive already in the stack, nothing copied
+    FAILED = "failed"
+
+    def __init__(self, source : str, name : str):
+        self.source = source
+        self.name = name # archive name in the stack
+        self.status = None #type: str
+        self.method = None #type: str
+        self.duplicateOf = None #type: str
+        self.error = None #type: Exception
+        self.seconds = 0.0
+
+    def toDict(self) -> dict[str, str | float | None]:
+        return {
+            "source": self.source,
+            "name": self.name,
+            "status": self.status,
+            "method": self.method,
+            "duplicateOf": self.duplicateOf,
+            "error": str(self.error) if self.error is not None else None,
+            "seconds": self.seconds,
+        }
+
+    def __str__(self) -> str:
+        if self.status == ImportResult.FAILED:
+            return f"{self.source} : failed ({self.error})"
+        if self.status == ImportResult.DUPLICATE:
+            return f"{self.source} : skipped, same content as {self.duplicateOf}"
+        return f"{self.source} : {self.status} as {self.name} ({self.method}, {self.seconds * 1000:.1f} ms)"
+
+
+_hashCache = {} #type: dict[tuple[str, int, int], str]
+_hashLock = Lock()
+
+def contentHash(path : str) -> str:
+    """
+    sha256 of the file, cached for as long as its size and modification time do not change
+    """
+    stat = os.stat(path)
+    key = (os.path.normcase(os.path.abspath(path)), stat.st_size, stat.st_mtime_ns)
+    with _hashLock:
+        if key in _hashCache:
+            return _hashCache[key]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    with _hashLock:
+        _hashCache[key] = digest.hexdigest()
+    return digest.hexdigest()
+
+
+def findDuplicateIn(source : str, paths : list[str]) -> str | None:
+    """
+    The first of paths with the same content as source, only files of the same size are hashed
+    """
+    size = os.path.getsize(source)
+    sourceHash = None
+    for path in paths:
+        try:
+            if os.path.getsize(path) != size:
+                continue
+            sourceHash = sourceHash or contentHash(source)
+            if contentHash(path) == sourceHash:
+                return path
+        except OSError: # removed meanwhile
+            continue
+    return None
+
+
+def findDuplicate(source : str, folder : str, archives : dict[str, tuple[int, int]]) -> str | None:
+    """
+    Name of an archive of the folder with the same content as source, archives is the snapshot of the folder
+    """
+    size = os.path.getsize(source)
+    candidates = [os.path.join(folder, name) for name, (archiveSize, _) in archives.items() if archiveSize == size]
+    duplicate = findDuplicateIn(source, candidates)
+    return os.path.basename(duplicate) if duplicate is not None else None
+
+
+def _copyFileRange(source : int, destination : int, size : int):
+    copied = 0
+    while copied < size:
+        done = os.copy_file_range(source, destination, size - copied)
+        if done == 0:
+            break
+        copied += done
+
+
+def _stream(source : int, destination : int):
+    while chunk := os.read(source, CHUNK_SIZE):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(destination, view):]
+
+
+def transfer(source : str, destination : str) -> str:
+    """
+    Create destination with the content of source, returns the method used :
+    a hard link if allowed and on the same filesystem, else os.copy_file_range (copied by the kernel,
+    or shared extents on filesystems supporting reflinks), else a streaming copy
+    """
+    if useLinks():
+        try:
+            os.link(source, destination)
+            return LINK
+        except OSError as e:
+            Logger.deepDebug(f"Cannot link {source} to {destination} : {e}")
+
+    size = os.path.getsize(source)
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        if hasattr(os, "copy_file_range"):
+            try:
+                _copyFileRange(src.fileno(), dst.fileno(), size)
+                return COPY_FILE_RANGE
+            except OSError as e: # not supported by the kernel or between these filesystems
+                Logger.deepDebug(f"copy_file_range failed for {source} : {e}")
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        _stream(src.fileno(), dst.fileno())
+    return STREAM
@@ -0,0 +1,211 @@
+import os
+import json
+import sqlite3
+from threading import Lock
+from typing import Any
+
+from gamuLogger import Logger
+
+try:
+    from .config import CONFIG_FILE_PATH
+except ImportError:
+    from config import CONFIG_FILE_PATH
+
+INDEX_FILE_PATH = os.path.join(os.path.dirname(CONFIG_FILE_PATH), "index.sqlite")
+
+# bump this when the content of a record changes, every entry will then be parsed again
+INDEX_VERSION = 2
+
+Logger.setModule("modIndex")
+
+class ModIndex:
+    """
+    Persistent cache of the parsed metadata of every mod, keyed by (path, size, mtime)
+    An archive whose size or modification time changed is considered as a new one and parsed again
+    """
+    __instance = None #type: ModIndex
+    __creationLock = Lock() # the index is first used by several loading threads at once
+    
+    def __new__(cls):
+        with cls.__creationLock:
+            if cls.__instance is None:
+                cls.__instance = super(ModIndex, cls).__new__(cls)
+                cls.__instance.__initialized = False
+        return cls.__instance
+    
+    def __init__(self):
+        if self.__initialized: return
+        with ModIndex.__creationLock:
+            if self.__initialized: return
+            self.__lock = Lock()
+            self.__connection = self.__open()
+            self.__initialized = True # only once it can be used by the other threads
+        
+        Logger.info("Mod index initialized")
+        
+    def __open(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(INDEX_FILE_PATH), exist_ok=True)
+        connection = sqlite3.connect(INDEX_FILE_PATH, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            Logger.info(f"Mod index format changed ({version} -> {INDEX_VERSION}), rebuilding it")
+            connection.execute("DROP TABLE IF EXISTS mods")
+            connection.execute("DROP TABLE IF EXISTS entries")
+            connection.execute("DROP TABLE IF EXISTS checks")
+            connection.execute(f"PRAGMA user_version={INDEX_VERSION}")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS mods (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                author TEXT NOT NULL,
+                version TEXT NOT NULL,
+                titles TEXT NOT NULL,
+                descriptions TEXT NOT NULL,
+                icon TEXT NOT NULL,
+                iconName TEXT NOT NULL,
+                thumbnail TEXT NOT NULL,
+                multiplayer INTEGER NOT NULL
+            )
+        """)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                names TEXT NOT NULL,
+                crcs BLOB NOT NULL,
+                sizes BLOB NOT NULL
+            )
+        """)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS checks (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                ok INTEGER NOT NULL,
+                errors TEXT NOT NULL,
+                entries INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                checkedAt REAL NOT NULL
+            )
+        """)
+        connection.commit()
+        return connection
+    
+    @staticmethod
+    def __key(path : str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+    
+    def get(self, path : str, size : int, mtime : int) -> dict[str, Any] | None:
+        """
+        Returns the record stored for this archive, or None if the archive is not indexed or has changed since it was indexed
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT size, mtime, author, version, titles, descriptions, icon, iconName, thumbnail, multiplayer FROM mods WHERE path = ?",
+                (self.__key(path),)
+            ).fetchone()
+        if row is None:
+            Logger.deepDebug(f"{path} is not indexed")
+            return None
+        if row[0] != size or row[1] != mtime:
+            Logger.deepDebug(f"{path} changed since it was indexed")
+            return None
+        return {
+            "author": row[2],
+            "version": row[3],
+            "titles": json.loads(row[4]),
+            "descriptions": json.loads(row[5]),
+            "icon": row[6],
+            "iconName": row[7],
+            "thumbnail": row[8],
+            "multiplayer": bool(row[9]),
+            "size": size,
+            "mtime": mtime
+        }
+        
+    def put(self, path : str, size : int, mtime : int, record : dict[str, Any]):
+        """
+        Store (or replace) the record of an archive, and its entries if the record has some (see archiveEntries)
+        """
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO mods VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.__key(path), size, mtime,
+                    record["author"],
+                    record["version"],
+                    json.dumps(record["titles"], ensure_ascii=False),
+                    json.dumps(record["descriptions"], ensure_ascii=False),
+                    record["icon"],
+                    record["iconName"],
+                    record["thumbnail"],
+                    int(record["multiplayer"])
+                )
+            )
+            if record.get("entries") is not None:
+                self.__connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", (self.__key(path), size, mtime, *record["entries"]))
+            self.__connection.commit()
+        Logger.deepDebug(f"{path} indexed")
+        
+    def getEntries(self, path : str, size : int, mtime : int) -> tuple[str, bytes, bytes] | None:
+        """
+        Returns the raw entries stored for this archive (see archiveEntries), or None if they are missing or outdated
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT size, mtime, names, crcs, sizes FROM entries WHERE path = ?", (self.__key(path),)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        return row[2], row[3], row[4]
+    
+    def putEntries(self, path : str, size : int, mtime : int, entries : tuple[str, bytes, bytes]):
+        with self.__lock:
+            self.__connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", (self.__key(path), size, mtime, *entries))
+            self.__connection.commit()
+            
+    def getCheck(self, path : str, size : int, mtime : int) -> dict[str, Any] | None:
+        """
+        Returns the result of the last integrity check of this archive (see verify), or None if it was not checked since it changed
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT size, mtime, ok, errors, entries, bytes, checkedAt FROM checks WHERE path = ?", (self.__key(path),)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        return {"ok": bool(row[2]), "errors": json.loads(row[3]), "entries": row[4], "bytes": row[5], "checkedAt": row[6]}
+    
+    def putCheck(self, path : str, size : int, mtime : int, record : dict[str, Any]):
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.__key(path), size, mtime, int(record["ok"]), json.dumps(record["errors"], ensure_ascii=False), record["entries"], record["bytes"], record["checkedAt"])
+            )
+            self.__connection.commit()
+            
+    def invalidate(self, path : str):
+        """
+        Remove an archive from the index, it will be parsed again the next time it is loaded
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM mods WHERE path = ?", (self.__key(path),))
+            self.__connection.execute("DELETE FROM entries WHERE path = ?", (self.__key(path),))
+            self.__connection.execute("DELETE FROM checks WHERE path = ?", (self.__key(path),))
+            self.__connection.commit()
+        Logger.deepDebug(f"{path} removed from the index")
+        
+    def clear(self):
+        """
+        Remove every entry from the index
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM mods")
+            self.__connection.execute("DELETE FROM entries")
+            self.__connection.execute("DELETE FROM checks")
+            self.__connection.commit()
+        Logger.info("Mod index cleared")
+        
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM mods").fetchone()[0]
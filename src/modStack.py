@@ -1,101 +1,364 @@
 import sys, os
-import shutil
+import time
+from threading import RLock
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Any
 
 from gamuLogger import Logger, LEVELS
 
 try:
     from .config import Config
-    from .mod import Mod
+    from .mod import Mod, readModRecord, readModRecordWithMetrics, getIndexedRecord, indexRecord
+    from .modIndex import ModIndex
+    from .profiling import StartupProfiler
+    from .metrics import Metrics
+    from .links import readLink, replaceLink, removeLink, normalizePath
+    from .modImport import ImportResult, findDuplicate, findDuplicateIn, transfer
+    from .sortedMods import SortedMods, SORT_KEYS
+    from .conflicts import ConflictReport, analyze, readEntries
+    from .verify import VerifyReport, verifyArchives
 except ImportError:
     from config import Config
-    from mod import Mod
+    from mod import Mod, readModRecord, readModRecordWithMetrics, getIndexedRecord, indexRecord
+    from modIndex import ModIndex
+    from profiling import StartupProfiler
+    from metrics import Metrics
+    from links import readLink, replaceLink, removeLink, normalizePath
+    from modImport import ImportResult, findDuplicate, findDuplicateIn, transfer
+    from sortedMods import SortedMods, SORT_KEYS
+    from conflicts import ConflictReport, analyze, readEntries
+    from verify import VerifyReport, verifyArchives
 
 Logger.setModule("modStack")
 
-# C:\Users\antoi\Documents\My Games\FarmingSimulator2022
-GAME_MODS_FOLDER = Config().get("game_mods_folder", os.path.expanduser("~") + "/Documents/My Games/FarmingSimulator2022/mods", True)
-
-Logger.debug(f"Game mods folder: {GAME_MODS_FOLDER}")
-
-def runCommand(command : str, cwd : str = None) -> int:
-    if cwd is not None:
-        Logger.debug(f"Running command {command} in {cwd}")
-        currentDir = os.getcwd()
-        os.chdir(cwd)
-    else:
-        Logger.debug(f"Running command {command}")
-    returnCode = os.system(f"{command} > nul 2>&1")
-    if cwd is not None:
-        os.chdir(currentDir)
-    
-    if returnCode != 0:
-        Logger.error(f"Command {command} in {cwd} returned {returnCode}")
+def getGameModsFolder() -> str:
+    """
+    The folder the game loads its mods from (it is replaced by a link to the enabled stack)
+    """
+    # C:\Users\antoi\Documents\My Games\FarmingSimulator2022
+    return Config().get("game_mods_folder", os.path.expanduser("~") + "/Documents/My Games/FarmingSimulator2022/mods", True)
+
+def isLazyLoadEnabled() -> bool:
+    """
+    Lazy mods are parsed when they are displayed instead of when the stack is loaded
+    """
+    return Config().get("lazy_load", False, True)
+
+def getDefaultSortKey() -> str:
+    """
+    Order of the mods of a new stack, one of sortedMods.SORT_KEYS ("title" and "author" load lazy mods)
+    """
+    sortKey = Config().get("sort_by", "name", True)
+    if sortKey not in SORT_KEYS:
+        Logger.warning(f"Unknown sort_by {sortKey!r} in the config, mods are sorted by name")
+        return "name"
+    return sortKey
+
+ModCallback = Callable[[str, Mod | None], Any]
+
+def getEnabledFolder() -> str | None:
+    """
+    The stack folder the game mods folder currently links to (normalized), or None if no stack is enabled
+    """
+    return readLink(getGameModsFolder())
+
+def snapshot(folder : str) -> dict[str, tuple[int, int]]:
+    """
+    Returns {archive name: (size, mtime)} for every archive of the folder, in a single pass over the directory
+    """
+    result = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".zip") and entry.is_file():
+                stat = entry.stat()
+                result[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return result
+
+
+class ChangeSet:
+    """
+    Archives added, removed and modified between two snapshots of a stack folder
+    """
+    def __init__(self, added : list[str] = None, removed : list[str] = None, modified : list[str] = None):
+        self.added = added or []
+        self.removed = removed or []
+        self.modified = modified or []
         
-    return returnCode
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+    
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.modified)} modified"
+
+
+def diffSnapshots(previous : dict[str, tuple[int, int]], current : dict[str, tuple[int, int]]) -> ChangeSet:
+    changes = ChangeSet()
+    for name, stat in current.items():
+        if name not in previous:
+            changes.added.append(name)
+        elif previous[name] != stat:
+            changes.modified.append(name)
+    changes.removed = [name for name in previous if name not in current]
+    return changes
+
 
 class ModStack:
     """
     A collection of mods that can be enabled or disabled without having to move files around
     """
     __instances = {} #type: dict[str, ModStack]
-    def __init__(self, folder : str):
+    def __init__(self, folder : str, executor : Executor = None, load : bool = True):
+        """
+        Load every mod of the folder (unless load is False, then call load() later)
+        If an executor is given, archives missing from the mod index are parsed on it (it can be a process pool)
+        """
         if folder in ModStack.__instances:
             raise Exception("ModStack already exists for this folder")
         self.__folder = folder
         self.__mods = {} #type: dict[str, Mod]
+        self.__sorted = SortedMods(getDefaultSortKey())
+        self.__conflicts = None #type: ConflictReport | None # until the stack changes
+        self.__snapshot = snapshot(folder) #type: dict[str, tuple[int, int]]
+        self.__lock = RLock() # mods can be loaded from other threads while the UI reads them
+        self.__refreshLock = RLock()
+        self.__listeners = [] #type: list[ModCallback]
         self.__name = os.path.basename(folder)
-        self.__load()
+        if load:
+            self.load(executor)
         
         ModStack.__instances[folder] = self
         
-    def __loadMod(self, file : str, failedMods : list[str]):
-        if file.endswith(".zip"):
+    def __setMod(self, file : str, mod : Mod, onModLoaded : ModCallback = None):
+        with self.__lock:
+            self.__mods[file] = mod
+            self.__sorted.set(file, mod)
+            self.__conflicts = None
+        self.__notify(file, mod)
+        if onModLoaded is not None:
+            onModLoaded(file, mod)
+            
+    def __removeMod(self, file : str):
+        with self.__lock:
+            if self.__mods.pop(file, None) is None:
+                return
+            self.__sorted.remove(file)
+            self.__conflicts = None
+        self.__notify(file, None)
+            
+    def __notify(self, file : str, mod : Mod | None):
+        for listener in self.__listeners:
+            try:
+                listener(file, mod)
+            except Exception as e:
+                Logger.error(f"Error in a listener of {self} : {e}")
+            
+    def addListener(self, listener : ModCallback):
+        """
+        listener(file, mod) is called each time a mod of the stack is added or replaced, and with None when one is removed,
+        whatever the cause (load, refresh, import...), from the thread doing it
+        """
+        self.__listeners.append(listener)
+        
+    def getMod(self, file : str) -> Mod | None:
+        with self.__lock:
+            return self.__mods.get(file)
+        
+    def getItems(self) -> list[tuple[str, Mod]]:
+        """
+        (archive name, mod) of every loaded mod, in display order
+        """
+        with self.__lock:
+            return self.__sorted.items()
+        
+    def sortBy(self, sortKey : str, reverse : bool = False):
+        """
+        Change the order of the mods, sortKey is one of sortedMods.SORT_KEYS (ValueError otherwise)
+        """
+        with self.__lock:
+            self.__sorted.sortBy(sortKey, reverse)
+            
+    def getSortKey(self) -> tuple[str, bool]:
+        """
+        (sort key, reverse)
+        """
+        with self.__lock:
+            return self.__sorted.getSortKey()
+        
+    def indexOf(self, file : str) -> int | None:
+        """
+        Position of the mod of the archive in display order, or None if it is not loaded
+        """
+        with self.__lock:
+            return self.__sorted.indexOf(file)
+            
+    def __failMod(self, file : str, error : Exception, failedMods : list[str], onModLoaded : ModCallback = None):
+        failedMods.append(file)
+        Metrics().count("mod.failures")
+        self.__removeMod(file)
+        Logger.error(f"Could not load mod {file} : {error}")
+        if onModLoaded is not None:
+            onModLoaded(file, None)
+        
+    def __loadMod(self, file : str, failedMods : list[str], onModLoaded : ModCallback = None):
+        try:
+            mod = Mod(os.path.join(self.__folder, file), lazy=isLazyLoadEnabled())
+        except Exception as e:
+            self.__failMod(file, e, failedMods, onModLoaded)
+        else:
+            self.__setMod(file, mod, onModLoaded)
+        
+    def __loadModsParallel(self, files : list[str], executor : Executor, failedMods : list[str], onModLoaded : ModCallback = None):
+        futures = {}
+        for file in files:
+            path = os.path.join(self.__folder, file)
+            try:
+                record = getIndexedRecord(path)
+                if record is not None:
+                    self.__setMod(file, Mod(path, record), onModLoaded)
+                else:
+                    futures[file] = executor.submit(readModRecordWithMetrics, path)
+            except Exception as e:
+                self.__failMod(file, e, failedMods, onModLoaded)
+        
+        Logger.debug(f"{len(futures)} mods to parse in {self.__folder}")
+        for file, future in futures.items():
+            path = os.path.join(self.__folder, file)
             try:
-                self.__mods[file] = Mod(os.path.join(self.__folder, file))
+                record, samples = future.result()
+                Metrics().merge(samples)
+                indexRecord(path, record)
+                mod = Mod(path, record)
             except Exception as e:
-                failedMods.append(file)
-                Logger.error(f"Could not load mod {file} : {e}")
+                self.__failMod(file, e, failedMods, onModLoaded)
+            else:
+                self.__setMod(file, mod, onModLoaded)
+                
+    def __loadMods(self, files : list[str], executor : Executor, failedMods : list[str], onModLoaded : ModCallback = None):
+        """
+        Load (or reload) the given archives, a mod that fails to load is removed from the stack
+        """
+        if executor is None or isLazyLoadEnabled():
+            for file in files:
+                self.__loadMod(file, failedMods, onModLoaded)
+        else:
+            self.__loadModsParallel(files, executor, failedMods, onModLoaded)
         
-    def __load(self):
+    def load(self, executor : Executor = None, onModLoaded : ModCallback = None):
+        """
+        Load the mods of the folder
+        onModLoaded(file, mod) is called for each archive as soon as it is loaded (mod is None if it could not be loaded)
+        """
         Logger.info(f"Loading mods from {self.__folder} (this may take a while)")
-        nbMods = len(os.listdir(self.__folder))
-        failedMods = []
-        for file in os.listdir(self.__folder):
-            self.__loadMod(file, failedMods)
+        with self.__refreshLock, StartupProfiler().phase(f"load stack {self.__name}"), Metrics().timer("stack.load", self.__name):
+            nbMods = len(self.__snapshot)
+            failedMods = []
+            self.__loadMods(list(self.__snapshot), executor, failedMods, onModLoaded)
 
         Logger.info(f"Loaded {nbMods - len(failedMods)}/{nbMods} mods from {self.__folder}")
         if failedMods:
             Logger.debug(f"Failed mods : {failedMods}")
             
+    def getConflicts(self) -> ConflictReport:
+        """
+        Conflicts between the mods of the stack (see conflicts), computed again only after the stack changed
+        The files of each archive come from the mod index, an archive missing from it is read once
+        """
+        with self.__lock:
+            report = self.__conflicts
+            mods = dict(self.__mods)
+        if report is not None:
+            return report
+        start = time.perf_counter()
+        entries = readEntries(self.__folder, list(mods))
+        report = analyze(self.__name, mods, entries)
+        report.seconds = time.perf_counter() - start
+        with self.__lock:
+            if self.__mods == mods: # not changed meanwhile
+                self.__conflicts = report
+        Logger.info(f"{len(report.conflicts)} conflicts found in {self} in {report.seconds * 1000:.1f} ms")
+        return report
+            
+    def getArchiveCount(self) -> int:
+        """
+        Number of archives found in the folder (loaded or not)
+        """
+        return len(self.__snapshot)
+    
+    def getArchivePaths(self) -> list[str]:
+        """
+        Paths of the archives found in the folder (loaded or not)
+        """
+        with self.__lock:
+            return [os.path.join(self.__folder, file) for file in self.__snapshot]
+    
+    def verify(self, executor : Executor = None, force : bool = False) -> VerifyReport:
+        """
+        Check the integrity of every archive of the folder (see verify), the mods do not have to be loaded
+        Archives already checked are skipped until they change, unless force is True
+        """
+        report = verifyArchives(self.getArchivePaths(), executor, force)
+        Logger.info(f"{len(report.failures)} corrupted archives in {self}")
+        return report
             
-    def __update(self):
+            
+    def refresh(self, executor : Executor = None) -> ChangeSet:
         """
-        Update the mod stack (check if mods have been added or removed)
-        Load new mods and remove deleted ones
+        Update the mod stack from a new snapshot of its folder
+        Load new and modified archives and remove deleted ones, unchanged mods are not touched
+        Returns the archives that changed since the previous snapshot
         """
-        Logger.info(f"Updating {self.__folder}")
-        nbMods = len(os.listdir(self.__folder))
-        failedMods = []
-        for file in os.listdir(self.__folder):
-            if file in self.__mods.keys():
-                continue # Mod already loaded
-            self.__loadMod(file, failedMods)
-        for file in self.__mods.keys():
-            if file not in os.listdir(self.__folder):
-                del self.__mods[file]
-        Logger.info(f"Updated {self.__folder} : {nbMods - len(failedMods)}/{nbMods} mods")
+        with self.__refreshLock:
+            current = snapshot(self.__folder)
+            changes = diffSnapshots(self.__snapshot, current)
+            self.__snapshot = current
+            if not changes:
+                Logger.debug(f"{self.__folder} is up to date")
+                return changes
+            
+            for file in changes.removed:
+                self.__removeMod(file)
+                ModIndex().invalidate(os.path.join(self.__folder, file))
+            failedMods = []
+            with Metrics().timer("stack.refresh", self.__name):
+                self.__loadMods(changes.added + changes.modified, executor, failedMods)
+            
+        Logger.info(f"Updated {self.__folder} : {changes}")
+        if failedMods:
+            Logger.debug(f"Failed mods : {failedMods}")
+        return changes
             
             
     def enable(self):
-        ModStack.disable()
-        runCommand(f'mklink /J "{GAME_MODS_FOLDER}" "{self.__folder}"', os.path.dirname(self.__folder))
-        Logger.info(f"Enabled {self.__folder}")
+        """
+        Link the game mods folder to this stack, replacing the link to the previous one (the folder is never missing meanwhile)
+        """
+        start = time.perf_counter()
+        with Metrics().timer("stack.switch", self.__name):
+            replaceLink(self.__folder, getGameModsFolder())
+        Logger.info(f"Enabled {self.__folder} in {(time.perf_counter() - start) * 1000:.2f} ms")
+        
+    def isEnabled(self) -> bool:
+        return getEnabledFolder() == normalizePath(self.__folder)
+    
+    @staticmethod
+    def getEnabled() -> 'ModStack | None':
+        """
+        The stack the game mods folder links to, or None if no stack is enabled (or if it is not a loaded stack)
+        """
+        folder = getEnabledFolder()
+        if folder is None:
+            return None
+        for stack in list(ModStack.__instances.values()):
+            if normalizePath(stack.getFolder()) == folder:
+                return stack
+        return None
         
     @staticmethod
     def disable():
-        if os.path.exists(GAME_MODS_FOLDER):
-            os.unlink(GAME_MODS_FOLDER)
-        # runCommand(f'rmdir "{GAME_MODS_FOLDER}"')
+        """
+        Remove the link to the enabled stack, a real mods folder is never deleted
+        """
+        removeLink(getGameModsFolder())
         Logger.info(f"Disabled current mod stack")
         
     def __str__(self) -> str:
@@ -104,41 +367,192 @@ class ModStack:
     def getName(self) -> str:
         return self.__name
     
-    def addMod(self, archivePath : str):
-        """
-        Add a mod to the stack (copy it into the folder)
-        """
+    def getFolder(self) -> str:
+        return self.__folder
+    
+    def __checkArchive(self, archivePath : str):
         if not archivePath.endswith(".zip"):
             raise ValueError("Only zip archives are supported")
-        if not os.path.exists(archivePath):
+        if not os.path.isfile(archivePath):
             raise FileNotFoundError(f"Archive {archivePath} not found")
-        if archivePath in self.__mods:
-            raise ValueError(f"Mod {archivePath} is already in the stack (use updateMod instead if you want to update it)")
-        shutil.copy(archivePath, self.__folder)
-        self.__update()
         
-    def updateMod(self, archivePath : str):
+    def __checkName(self, name : str, update : bool):
+        if update and name not in self.__snapshot:
+            raise ValueError(f"Mod {name} is not in the stack (use addMod instead if you want to add it)")
+        if not update and name in self.__snapshot:
+            raise ValueError(f"Mod {name} is already in the stack (use updateMod instead if you want to update it)")
+        
+    def __tmpPath(self, name : str) -> str:
+        # not a .zip, so ignored by snapshots and the watcher
+        return os.path.join(self.__folder, f"{name}.{os.getpid()}.tmp")
+        
+    def __importArchive(self, archivePath : str, update : bool) -> ImportResult:
         """
-        Update a mod in the stack
+        Bring the archive into the folder under a temporary name, parse it there and only then give it its real name,
+        so a broken archive never appears in the folder; only its own entry of the stack is updated
         """
-        if not archivePath.endswith(".zip"):
-            raise ValueError("Only zip archives are supported")
-        if not os.path.exists(archivePath):
-            raise FileNotFoundError(f"Archive {archivePath} not found")
-        if archivePath in self.__mods:
-            raise ValueError(f"Mod {archivePath} is not in the stack (use addMod instead if you want to add it)")
-        shutil.copy(archivePath, self.__folder)
-        self.__update()
+        name = os.path.basename(archivePath)
+        result = ImportResult(archivePath, name)
+        start = time.perf_counter()
+        with self.__refreshLock:
+            self.__checkArchive(archivePath)
+            duplicate = findDuplicate(archivePath, self.__folder, self.__snapshot)
+            if duplicate is not None:
+                result.status = ImportResult.DUPLICATE
+                result.duplicateOf = duplicate
+                Logger.info(f"{archivePath} is identical to {duplicate}, skipped")
+                return result
+            self.__checkName(name, update)
+            
+            path = os.path.join(self.__folder, name)
+            tmpPath = self.__tmpPath(name)
+            try:
+                with Metrics().timer("import.transfer", archivePath):
+                    result.method = transfer(archivePath, tmpPath)
+                record = readModRecord(tmpPath)
+                if update and os.path.samestat(os.stat(tmpPath), os.stat(path)):
+                    # the source is a hard link to the archive of the stack, rewritten in place : renaming a link
+                    # over another link to the same file does nothing, the new content is already there
+                    os.remove(tmpPath)
+                else:
+                    os.replace(tmpPath, path)
+            except BaseException:
+                if os.path.lexists(tmpPath):
+                    os.remove(tmpPath)
+                raise
+            
+            indexRecord(path, record)
+            self.__snapshot[name] = (record["size"], record["mtime"])
+            self.__setMod(name, Mod(path, record))
+        
+        result.status = ImportResult.UPDATED if update else ImportResult.ADDED
+        result.seconds = time.perf_counter() - start
+        Metrics().count(f"import.{result.method}")
+        Logger.info(str(result))
+        return result
+    
+    def addMod(self, archivePath : str) -> ImportResult:
+        """
+        Add a mod to the stack (link or copy it into the folder)
+        Nothing is copied if an archive of the stack has the same content
+        """
+        return self.__importArchive(archivePath, False)
+        
+    def addMods(self, archivePaths : list[str], executor : Executor = None) -> list[ImportResult]:
+        """
+        Add many archives at once, returns one result per archive (in the same order), a failure does not stop the others
+        Archives are copied on a few threads (config key import_copies), parsed on the executor as soon as they are
+        copied (on the copy threads if no executor is given), and the stack is refreshed once at the end
+        """
+        results = [ImportResult(path, os.path.basename(path)) for path in archivePaths]
+        start = time.perf_counter()
+        with self.__refreshLock:
+            pending = self.__checkBatch(results)
+            with ThreadPoolExecutor(max(1, Config().get("import_copies", 4, True))) as copies:
+                parser = executor or copies
+                
+                def copy(result : ImportResult) -> str:
+                    tmpPath = self.__tmpPath(result.name)
+                    with Metrics().timer("import.transfer", result.source):
+                        result.method = transfer(result.source, tmpPath)
+                    return tmpPath
+                
+                copyFutures = {copies.submit(copy, result): result for result in pending}
+                parseFutures = {} #type: dict[Future, tuple[ImportResult, str]]
+                for future in as_completed(copyFutures):
+                    result = copyFutures[future]
+                    try:
+                        tmpPath = future.result()
+                        parseFutures[parser.submit(readModRecordWithMetrics, tmpPath)] = (result, tmpPath)
+                    except Exception as e:
+                        self.__failImport(result, e, self.__tmpPath(result.name))
+                        
+                for future in as_completed(parseFutures):
+                    result, tmpPath = parseFutures[future]
+                    try:
+                        record, samples = future.result()
+                        Metrics().merge(samples)
+                        path = os.path.join(self.__folder, result.name)
+                        os.replace(tmpPath, path)
+                        indexRecord(path, record)
+                    except Exception as e:
+                        self.__failImport(result, e, tmpPath)
+                    else:
+                        result.status = ImportResult.ADDED
+                        result.seconds = time.perf_counter() - start
+                        Metrics().count(f"import.{result.method}")
+            
+            # the new archives are in the mod index already, so the refresh does not parse them again
+            self.refresh()
+            
+        counts = {status: sum(result.status == status for result in results) for status in (ImportResult.ADDED, ImportResult.DUPLICATE, ImportResult.FAILED)}
+        Logger.info(f"Imported {len(results)} archives into {self} in {time.perf_counter() - start:.2f}s : " + ", ".join(f"{count} {status}" for status, count in counts.items()))
+        for result in results:
+            Logger.debug(str(result))
+        return results
+    
+    def __checkBatch(self, results : list[ImportResult]) -> list[ImportResult]:
+        """
+        Returns the archives that have to be copied, the others are marked as failed or duplicate
+        """
+        accepted = {} #type: dict[str, ImportResult]
+        for result in results:
+            try:
+                self.__checkArchive(result.source)
+                duplicate = findDuplicate(result.source, self.__folder, self.__snapshot) \
+                         or findDuplicateIn(result.source, [other.source for other in accepted.values()])
+                if duplicate is None:
+                    self.__checkName(result.name, False)
+                    if result.name in accepted:
+                        raise ValueError(f"Mod {result.name} is given twice")
+            except Exception as e:
+                self.__failImport(result, e)
+                continue
+            if duplicate is not None:
+                result.status = ImportResult.DUPLICATE
+                result.duplicateOf = duplicate
+            else:
+                accepted[result.name] = result
+        return list(accepted.values())
+    
+    def __failImport(self, result : ImportResult, error : Exception, tmpPath : str = None):
+        result.status = ImportResult.FAILED
+        result.error = error
+        Metrics().count("import.failures")
+        Logger.error(f"Could not import {result.source} : {error}")
+        if tmpPath is not None and os.path.lexists(tmpPath):
+            os.remove(tmpPath)
+        
+    def updateMod(self, archivePath : str) -> ImportResult:
+        """
+        Replace the archive of the stack having the same name
+        """
+        return self.__importArchive(archivePath, True)
         
     def removeMod(self, modName : str):
         """
         Remove a mod from the stack
         """
-        os.remove(os.path.join(self.__folder, modName))
-        self.__update()
+        path = os.path.join(self.__folder, modName)
+        with self.__refreshLock:
+            os.remove(path)
+            self.__snapshot.pop(modName, None)
+            self.__removeMod(modName)
+            ModIndex().invalidate(path)
         
     def getModByIndex(self, index : int) -> Mod:
-        return list(self.__mods.values())[index]
+        """
+        The mod at this position in display order, in O(1)
+        """
+        with self.__lock:
+            return self.__sorted[index]
+        
+    def __getitem__(self, index : int | slice) -> Mod | list[Mod]:
+        """
+        stack[i] is the i-th mod in display order, stack[start:stop] a page of mods
+        """
+        with self.__lock:
+            return self.__sorted[index]
         
     def __len__(self):
         return len(self.__mods)
@@ -146,10 +560,12 @@ class ModStack:
 if __name__ == "__main__":
     Logger.setLevel("stdout", LEVELS.INFO)
     
+    if len(sys.argv) < 2:
+        Logger.critical("Usage : python -m src.modStack <stack folder> [<stack folder>...] (the first one is enabled)")
+        sys.exit(1)
     try:
-        old = ModStack(r"C:\Users\antoi\Games\mods\mods_old")
-        crane = ModStack(r"C:\Users\antoi\Games\mods\mods crane")
-        old.enable()
+        stacks = [ModStack(folder) for folder in sys.argv[1:]]
+        stacks[0].enable()
     except Exception as e:
         Logger.critical(' '.join(e.args))
         sys.exit(1)
\ No newline at end of file
@@ -1,84 +1,245 @@
 from zipfile import ZipFile, ZipExtFile
 from os import path
-from typing import IO
+from sys import intern
+from typing import IO, Any, Callable
 # from xml.etree import ElementTree as ET
 from gamuLogger import Logger, LEVELS
-from bs4 import BeautifulSoup as BS
 
 Logger.setModule("moddesc")
 
 try:
     from .config import Config
+    from .metrics import Metrics
 except ImportError:
     from config import Config
+    from metrics import Metrics
     
 
+def _localizedTexts(element) -> dict[str, str]:
+    """
+    Returns a dict {language: text} from an element like <title><en>...</en><de>...</de></title>
+    If the element has no language children, its text is stored under the empty key
+    """
+    if element is None:
+        return {}
+    texts = {}
+    for child in element.find_all(recursive=False):
+        texts.setdefault(child.name, child.text)
+    if not texts:
+        texts[""] = element.text
+    return texts
+
+
+def parseModDescSoup(file : IO[bytes]) -> dict[str, Any]:
+    """
+    Parse modDesc.xml with BeautifulSoup (builds the whole tree, kept for comparison with parseModDesc)
+    """
+    from bs4 import BeautifulSoup as BS
+    modDesc = BS(file, "xml").modDesc
+    return {
+        "author": modDesc.author.text if modDesc.author else "",
+        "version": modDesc.version.text if modDesc.version else "",
+        "titles": _localizedTexts(modDesc.title),
+        "descriptions": _localizedTexts(modDesc.description),
+        "icon": modDesc.iconFilename.text,
+        "multiplayer": modDesc.multiplayer is not None and modDesc.multiplayer.get("supported") == "true"
+    }
+
+
+def _elementText(element) -> str:
+    return "".join(element.itertext())
+
+
+def _elementLocalizedTexts(element) -> dict[str, str]:
+    texts = {}
+    for child in element:
+        if isinstance(child.tag, str): # skip comments
+            texts.setdefault(child.tag, _elementText(child))
+    if not texts:
+        texts[""] = _elementText(element)
+    return texts
+
+
+def parseModDesc(file : IO[bytes]) -> dict[str, Any]:
+    """
+    Stream-parse modDesc.xml with lxml, only the fields used by the manager are kept
+    Parsing stops as soon as every field has been found, and each element is dropped once read
+    """
+    from lxml import etree # only needed when an archive is missing from the mod index
+    record = {
+        "author": "",
+        "version": "",
+        "titles": {},
+        "descriptions": {},
+        "icon": None,
+        "multiplayer": False
+    }
+    remaining = {"author", "version", "title", "description", "iconFilename", "multiplayer"}
+    depth = 0
+    for event, element in etree.iterparse(file, events=("start", "end"), recover=True):
+        if event == "start":
+            if depth == 0 and element.tag != "modDesc":
+                raise ValueError(f"Unexpected root element <{element.tag}> in modDesc.xml")
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue # not a direct child of <modDesc>, it will be read (or dropped) with its parent
+        
+        tag = element.tag
+        if tag == "author":
+            record["author"] = _elementText(element)
+        elif tag == "version":
+            record["version"] = _elementText(element)
+        elif tag == "title":
+            record["titles"] = _elementLocalizedTexts(element)
+        elif tag == "description":
+            record["descriptions"] = _elementLocalizedTexts(element)
+        elif tag == "iconFilename":
+            record["icon"] = _elementText(element)
+        elif tag == "multiplayer":
+            record["multiplayer"] = element.get("supported") == "true"
+        remaining.discard(tag)
+        if not remaining:
+            break
+        
+        # free the elements already read
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    
+    if record["icon"] is None:
+        raise ValueError("No iconFilename in modDesc.xml")
+    return record
+
+
+_mainLanguageCache = None
+
+def _mainLanguage() -> str:
+    """
+    The language read from the config, cached so that reading a title does not go through the config each time
+    """
+    global _mainLanguageCache
+    if _mainLanguageCache is None:
+        _mainLanguageCache = Config().get("language", "en")
+    return _mainLanguageCache
+
+
+def _compactTexts(texts : dict[str, str]) -> dict[str, str]:
+    """
+    Same texts with interned language codes, a text repeated in several languages is stored once
+    """
+    seen = {} #type: dict[str, str]
+    return {intern(language): seen.setdefault(text, text) for language, text in texts.items()}
+
+
 class ModDesc:
-    def __init__(self, file : IO[bytes]):
-        self.__soup = BS(file, "xml")
+    __slots__ = ("__author", "__version", "__titles", "__descriptions", "__icon", "__supportMultiplayer")
+    
+    def __init__(self, file : IO[bytes], parser : Callable[[IO[bytes]], dict[str, Any]] = parseModDesc):
+        with Metrics().timer("moddesc.parse"):
+            record = parser(file)
+        self.__setRecord(record)
         Logger.deepDebug("Loaded modDesc.xml")
         
+    def __setRecord(self, record : dict[str, Any]):
+        self.__author = intern(record["author"]) # shared by the mods of the same author
+        self.__version = intern(record["version"])
+        self.__titles = _compactTexts(record["titles"])
+        self.__descriptions = _compactTexts(record["descriptions"])
+        self.__icon = record["icon"]
+        self.__supportMultiplayer = bool(record["multiplayer"])
+        
+    @staticmethod
+    def fromRecord(record : dict[str, Any]) -> 'ModDesc':
+        """
+        Build a ModDesc from a record created by toRecord (e.g. read from the mod index), without parsing any xml
+        """
+        modDesc = ModDesc.__new__(ModDesc)
+        modDesc.__setRecord(record)
+        return modDesc
+    
+    def toRecord(self) -> dict[str, Any]:
+        """
+        Returns every parsed field as a plain dict, suitable for storing in the mod index
+        """
+        return {
+            "author": self.__author,
+            "version": self.__version,
+            "titles": dict(self.__titles),
+            "descriptions": dict(self.__descriptions),
+            "icon": self.__icon,
+            "multiplayer": self.__supportMultiplayer
+        }
+    
+    @staticmethod
+    def __localized(texts : dict[str, str]) -> str:
+        """
+        Returns the text in the main language, or english if the main language is not found, or the first text if english is not found
+        """
+        if not texts:
+            return ""
+        mainLanguage = _mainLanguage()
+        if mainLanguage in texts:
+            return texts[mainLanguage]
+        if "en" in texts:
+            return texts["en"]
+        return next(iter(texts.values()))
+    
     
     @property
     def author(self) -> str:
-        return self.__soup.modDesc.author.text
+        return self.__author
         
         
     @property
     def version(self) -> str:
-        return self.__soup.modDesc.version.text
+        return self.__version
     
     @property
     def title(self) -> str:
         """
         Returns the title of the mod in the main language, or english if the main language is not found, or the first title if english is not found
         """        
-        mainLanguage = Config().get("language", "en")
-        titles = self.__soup.modDesc.title
-        contents = titles.contents
-        if "\n" in contents:
-            contents.remove("\n")
-        for titleElement in contents:
-            if titleElement.name == mainLanguage:
-                return titleElement.text
-        for titleElement in contents:
-            if titleElement.name == "en":
-                return titleElement.text
-        return contents[0].text
+        return self.__localized(self.__titles)
     
     @property
     def description(self) -> str:
         """
         Returns the description of the mod in the main language, or english if the main language is not found, or the first description if english is not found
         """        
-        mainLanguage = Config().get("language", "en")
-        descriptions = self.__soup.modDesc.description
-        contents = descriptions.contents
-        if "\n" in contents:
-            contents.remove("\n")
-        for descriptionElement in contents:
-            if descriptionElement.name == mainLanguage:
-                return descriptionElement.text.strip()
-        for descriptionElement in contents:
-            if descriptionElement.name == "en":
-                return descriptionElement.text.strip()
-        return contents[0].text.strip()
+        return self.__localized(self.__descriptions).strip()
+    
+    @property
+    def titles(self) -> dict[str, str]:
+        """
+        Returns the title of the mod in every language
+        """
+        return dict(self.__titles)
+    
+    @property
+    def descriptions(self) -> dict[str, str]:
+        """
+        Returns the description of the mod in every language
+        """
+        return dict(self.__descriptions)
         
     @property
     def icon(self) -> str:
-        return self.__soup.modDesc.iconFilename.text
+        return self.__icon
     
     @property
     def supportMultiplayer(self) -> bool:
-        return self.__soup.modDesc.multiplayer["supported"] == "true"
+        return self.__supportMultiplayer
     
 if __name__ == "__main__":
     Logger.setLevel("stdout", LEVELS.DEBUG)
-    with open("mods/modDesc.xml", "r") as f:
+    import sys
+    with open(sys.argv[1] if len(sys.argv) > 1 else "mods/modDesc.xml", "rb") as f:
         modDesc = ModDesc(f)
         print(modDesc.author)
         print(modDesc.version)
         print(modDesc.title)
         print(modDesc.description)
         print(modDesc.icon)
-        print(modDesc.supportMultiplayer)
\ No newline at end of file
+        print(modDesc.supportMultiplayer)
@@ -0,0 +1,131 @@
+"""
+Startup instrumentation (python -m src --profile-startup)
+Only the standard library is imported here, so the import hook can be installed before anything else is imported
+"""
+import sys
+import time
+import builtins
+import importlib.util
+from contextlib import contextmanager
+from threading import Lock
+
+
+class StartupProfiler:
+    """
+    Records the time spent importing each module and in each startup phase
+    Does nothing until enable() is called
+    """
+    __instance = None #type: StartupProfiler
+    
+    def __new__(cls):
+        if cls.__instance is None:
+            cls.__instance = super(StartupProfiler, cls).__new__(cls)
+            cls.__instance.__initialized = False
+        return cls.__instance
+    
+    def __init__(self):
+        if self.__initialized: return
+        self.__initialized = True
+        
+        self.__enabled = False
+        self.__start = time.perf_counter()
+        self.__lock = Lock()
+        self.__imports = {} #type: dict[str, tuple[float, float]] # module -> (self time, cumulative time)
+        self.__phases = [] #type: list[tuple[str, float, float]] # (name, start, duration)
+        self.__marks = [] #type: list[tuple[str, float]]
+        self.__originalImport = None
+        
+    def enable(self, start : float = None):
+        """
+        Start recording, start (from time.perf_counter) is the time the application started
+        """
+        if start is not None:
+            self.__start = start
+        self.__enabled = True
+        self.__installImportHook()
+        
+    def isEnabled(self) -> bool:
+        return self.__enabled
+        
+    def __installImportHook(self):
+        if self.__originalImport is not None:
+            return
+        originalImport = self.__originalImport = builtins.__import__
+        imports = self.__imports
+        nested = [] #type: list[float] # time spent in the imports done by each import in progress
+        
+        def timedImport(name, globals = None, locals = None, fromlist = (), level = 0):
+            try:
+                fullName = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__")) if level else name
+            except (ImportError, ValueError):
+                fullName = name
+            if fullName in sys.modules:
+                return originalImport(name, globals, locals, fromlist, level)
+            
+            nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                return originalImport(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = nested.pop()
+                if nested:
+                    nested[-1] += elapsed
+                imports.setdefault(fullName, (elapsed - children, elapsed))
+                
+        builtins.__import__ = timedImport
+        
+    def stopImports(self):
+        """
+        Stop timing imports
+        """
+        if self.__originalImport is not None:
+            builtins.__import__ = self.__originalImport
+            self.__originalImport = None
+        
+    @contextmanager
+    def phase(self, name : str):
+        """
+        Time a startup phase (can be used from several threads)
+        """
+        if not self.__enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__phases.append((name, start - self.__start, time.perf_counter() - start))
+                
+    def mark(self, name : str):
+        """
+        Record that something happened now (e.g. the first paint of the window)
+        """
+        if self.__enabled:
+            with self.__lock:
+                self.__marks.append((name, time.perf_counter() - self.__start))
+                
+    def report(self, nbImports : int = 25):
+        """
+        Log the slowest imports, then every phase and mark in chronological order
+        """
+        if not self.__enabled:
+            return
+        from gamuLogger import Logger
+        Logger.setModule("profiling")
+        
+        self.stopImports()
+        with self.__lock:
+            imports = sorted(self.__imports.items(), key=lambda item: item[1][0], reverse=True)
+            events = sorted(
+                [(start, f"{name:<40} started at {start * 1000:8.1f} ms, took {duration * 1000:8.1f} ms") for name, start, duration in self.__phases] +
+                [(at, f"{name:<40} at {at * 1000:8.1f} ms") for name, at in self.__marks]
+            )
+        
+        Logger.info(f"Slowest imports ({len(imports)} modules, self / cumulative) :")
+        for module, (selfTime, cumulative) in imports[:nbImports]:
+            Logger.info(f"    {module:<40} {selfTime * 1000:8.1f} ms {cumulative * 1000:8.1f} ms")
+        Logger.info("Startup phases :")
+        for _, line in events:
+            Logger.info(f"    {line}")
@@ -0,0 +1,199 @@
+"""
+In-memory inverted index over the texts of the mods (titles and descriptions in every language, author, version)
+"""
+import re
+import unicodedata
+from bisect import bisect_left
+from threading import Lock
+from typing import Hashable, Iterable
+
+from gamuLogger import Logger
+
+try:
+    from .mod import Mod
+except ImportError:
+    from mod import Mod
+
+Logger.setModule("searchIndex")
+
+WORD = re.compile(r"\w+(?:[.\-']\w+)*") # "1.0.2.0" and "john-deere" are kept as a whole, their parts are indexed too
+PART = re.compile(r"\w+")
+TERM = re.compile(r'"([^"]*)"|(\S+)')
+TERM_CACHE_SIZE = 64
+CACHE_UPDATE_LIMIT = 64 # above this number of changes, the term cache is cleared instead of being updated
+
+
+def normalize(text : str) -> str:
+    """
+    Lowercase, without accents
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text : str) -> set[str]:
+    tokens = set()
+    for word in WORD.findall(normalize(text)):
+        tokens.add(word)
+        tokens.update(PART.findall(word))
+    return tokens
+
+
+def modTokens(mod : Mod) -> set[str]:
+    tokens = tokenize(mod.author) | tokenize(mod.version)
+    for text in mod.titles.values():
+        tokens |= tokenize(text)
+    for text in mod.descriptions.values():
+        tokens |= tokenize(text)
+    return tokens
+
+
+def intersect(sets : list[set[Hashable] | frozenset[Hashable]]) -> frozenset[Hashable]:
+    """
+    Intersection of the sets, starting from the smallest one
+    """
+    sets = sorted(sets, key=len)
+    result = set(sets[0])
+    for keys in sets[1:]:
+        if not result:
+            break
+        result &= keys
+    return frozenset(result)
+
+
+class SearchIndex:
+    """
+    Maps every token to the keys of the mods containing it
+    Changes are queued by update/remove (cheap, any thread) and applied on the next search or flush,
+    so a lazy mod is only parsed when the index is actually used
+    """
+    def __init__(self):
+        self.__lock = Lock()
+        self.__postings = {} #type: dict[str, set[Hashable]]
+        self.__docs = {} #type: dict[Hashable, set[str]] # tokens of each key, to remove it
+        self.__tokens = [] #type: list[str] # sorted, for prefix queries
+        self.__newTokens = False
+        self.__pending = {} #type: dict[Hashable, Mod | None]
+        self.__termCache = {} #type: dict[tuple[str, bool], set[Hashable]] # kept up to date by small changes
+        self.__queryCache = {} #type: dict[str, frozenset[Hashable]] # cleared by any change
+
+    def update(self, key : Hashable, mod : Mod):
+        """
+        Index (or index again) the mod under key
+        """
+        with self.__lock:
+            self.__pending[key] = mod
+
+    def remove(self, key : Hashable):
+        with self.__lock:
+            self.__pending[key] = None
+
+    def flush(self):
+        """
+        Apply the queued changes
+        """
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+        if not pending:
+            return
+        changes = {} #type: dict[Hashable, set[str] | None]
+        for key, mod in pending.items():
+            try:
+                changes[key] = modTokens(mod) if mod is not None else None
+            except Exception as e: # a lazy mod that cannot be loaded
+                Logger.debug(f"Could not index {key} : {e}")
+                changes[key] = None
+        with self.__lock:
+            self.__queryCache.clear()
+            if len(changes) > CACHE_UPDATE_LIMIT:
+                self.__termCache.clear()
+            for key, tokens in changes.items():
+                self.__removeDoc(key)
+                if tokens is not None:
+                    self.__addDoc(key, tokens)
+        Logger.debug(f"{len(changes)} mods indexed, {len(self.__docs)} mods and {len(self.__postings)} tokens in the index")
+
+    def __addDoc(self, key : Hashable, tokens : set[str]):
+        self.__docs[key] = tokens
+        for token in tokens:
+            keys = self.__postings.get(token)
+            if keys is None:
+                keys = self.__postings[token] = set()
+                self.__newTokens = True
+            keys.add(key)
+        for (term, prefix), keys in self.__termCache.items():
+            if term in tokens or (prefix and any(token.startswith(term) for token in tokens)):
+                keys.add(key)
+
+    def __removeDoc(self, key : Hashable):
+        tokens = self.__docs.pop(key, None)
+        if tokens is None:
+            return
+        for token in tokens:
+            keys = self.__postings[token]
+            keys.discard(key)
+            if not keys:
+                del self.__postings[token] # left in __tokens, skipped by prefix queries
+        for keys in self.__termCache.values():
+            keys.discard(key)
+
+    def __matchTerm(self, term : str, prefix : bool) -> set[Hashable]:
+        """
+        Keys of the mods having the token (or a token starting with it), must not be modified by the caller
+        """
+        cached = self.__termCache.get((term, prefix))
+        if cached is not None:
+            return cached
+        if not prefix:
+            result = set(self.__postings.get(term, ()))
+        else:
+            if self.__newTokens:
+                self.__tokens = sorted(self.__postings)
+                self.__newTokens = False
+            matches = set()
+            for i in range(bisect_left(self.__tokens, term), len(self.__tokens)):
+                token = self.__tokens[i]
+                if not token.startswith(term):
+                    break
+                matches.update(self.__postings.get(token, ()))
+            result = matches
+        if len(self.__termCache) >= TERM_CACHE_SIZE:
+            self.__termCache.clear()
+        self.__termCache[(term, prefix)] = result
+        return result
+
+    def search(self, query : str) -> frozenset[Hashable]:
+        """
+        Keys of the mods matching every term of the query
+        A term matches the tokens starting with it, a term between double quotes only matches whole tokens
+        An empty query matches every mod
+        """
+        self.flush()
+        terms = [] #type: list[tuple[str, bool]]
+        for quoted, word in TERM.findall(query):
+            terms.extend((token, not quoted) for token in WORD.findall(normalize(quoted or word)))
+        with self.__lock:
+            result = self.__queryCache.get(query)
+            if result is None:
+                if not terms:
+                    result = frozenset(self.__docs)
+                else:
+                    result = intersect([self.__matchWord(term, prefix) for term, prefix in terms])
+                if len(self.__queryCache) >= TERM_CACHE_SIZE:
+                    self.__queryCache.clear()
+                self.__queryCache[query] = result
+            return result
+            
+    def __matchWord(self, word : str, prefix : bool) -> set[Hashable] | frozenset[Hashable]:
+        # compound tokens are indexed whole ("1.0.2" matches "1.0.2.0"), and made of their parts ("john-de" matches "John Deere")
+        result = self.__matchTerm(word, prefix)
+        parts = PART.findall(word)
+        if len(parts) > 1:
+            result = result | intersect([self.__matchTerm(part, prefix) for part in parts])
+        return result
+
+    def __len__(self) -> int:
+        return len(self.__docs)
+
+    def keys(self) -> Iterable[Hashable]:
+        return list(self.__docs)
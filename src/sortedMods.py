@@ -0,0 +1,126 @@
+"""
+Mods of a stack kept sorted, so the n-th mod (what the grid displays) is found in O(1)
+"""
+import os
+from bisect import bisect_left
+from typing import Any, Callable
+
+try:
+    from .mod import Mod
+except ImportError:
+    from mod import Mod
+
+SortKey = Callable[[Mod], Any]
+
+
+def _text(attr : str) -> SortKey:
+    def key(mod : Mod) -> str:
+        try:
+            return getattr(mod, attr).casefold()
+        except Exception: # a lazy mod that cannot be loaded, sorted first
+            return ""
+    return key
+
+SORT_KEYS = {
+    "name": lambda mod: os.path.basename(mod.zippath).casefold(), # archive name, does not load lazy mods
+    "title": _text("title"), # in the main language, loads lazy mods
+    "author": _text("author"),
+    "size": lambda mod: mod.size,
+    "mtime": lambda mod: mod.mtime,
+} #type: dict[str, SortKey]
+
+
+class SortedMods:
+    """
+    Sequence of mods sorted by one of SORT_KEYS (ties sorted by archive name)
+    Adding, replacing or removing a mod costs a binary search and a list insertion (a memmove), indexing is O(1)
+    Not thread-safe, ModStack calls it under its lock
+    """
+    def __init__(self, sortKey : str = "name", reverse : bool = False):
+        self.__entries = [] #type: list[tuple[Any, str]] # (key, file), sorted
+        self.__mods = [] #type: list[Mod] # same order as __entries
+        self.__keys = {} #type: dict[str, tuple[Any, str]] # entry of each file, to find it again when it is removed
+        self.__sortKey = sortKey
+        self.__keyFunc = self.__checkKey(sortKey)
+        self.__reverse = reverse
+
+    @staticmethod
+    def __checkKey(sortKey : str) -> SortKey:
+        if sortKey not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sortKey!r}, expected one of {', '.join(SORT_KEYS)}")
+        return SORT_KEYS[sortKey]
+
+    def set(self, file : str, mod : Mod):
+        """
+        Add the mod, or move it to its new place if the file is already there
+        """
+        self.remove(file)
+        entry = (self.__keyFunc(mod), file)
+        index = bisect_left(self.__entries, entry)
+        self.__entries.insert(index, entry)
+        self.__mods.insert(index, mod)
+        self.__keys[file] = entry
+
+    def remove(self, file : str):
+        entry = self.__keys.pop(file, None)
+        if entry is None:
+            return
+        index = bisect_left(self.__entries, entry)
+        del self.__entries[index]
+        del self.__mods[index]
+
+    def sortBy(self, sortKey : str, reverse : bool = False):
+        """
+        Sort again with another key (a full sort), changing only the direction is free
+        """
+        keyFunc = self.__checkKey(sortKey)
+        if sortKey != self.__sortKey:
+            items = [(keyFunc(mod), file, mod) for file, mod in zip(self.files(), self.__mods)]
+            items.sort(key=lambda item: item[:2])
+            self.__entries = [(key, file) for key, file, _ in items]
+            self.__mods = [mod for _, _, mod in items]
+            self.__keys = dict(zip((file for _, file in self.__entries), self.__entries))
+            self.__sortKey = sortKey
+            self.__keyFunc = keyFunc
+        self.__reverse = reverse
+
+    def getSortKey(self) -> tuple[str, bool]:
+        """
+        (sort key, reverse)
+        """
+        return self.__sortKey, self.__reverse
+
+    def indexOf(self, file : str) -> int | None:
+        """
+        Position of the mod of the archive, or None if it is not there
+        """
+        entry = self.__keys.get(file)
+        if entry is None:
+            return None
+        index = bisect_left(self.__entries, entry)
+        return len(self.__entries) - 1 - index if self.__reverse else index
+
+    def files(self) -> list[str]:
+        """
+        Archive names, in ascending order
+        """
+        return [file for _, file in self.__entries]
+
+    def items(self) -> list[tuple[str, Mod]]:
+        """
+        (archive name, mod) in display order
+        """
+        items = list(zip(self.files(), self.__mods))
+        return items[::-1] if self.__reverse else items
+
+    def __getitem__(self, index : int | slice) -> Mod | list[Mod]:
+        if not self.__reverse:
+            return self.__mods[index]
+        if isinstance(index, slice):
+            return [self.__mods[-1 - i] for i in range(*index.indices(len(self.__mods)))]
+        if not -len(self.__mods) <= index < len(self.__mods):
+            raise IndexError("mod index out of range")
+        return self.__mods[-1 - index if index >= 0 else -len(self.__mods) - 1 - index]
+
+    def __len__(self) -> int:
+        return len(self.__mods)
@@ -1,108 +1,288 @@
-from threading import Thread, Lock
+from threading import Thread, Lock, Event, local, current_thread
+from queue import PriorityQueue, Empty
+from itertools import count
 from typing import Callable, Any
 from enum import Enum
 
-def chrono(func):
-    def wrapper(*args, **kwargs):
-        import time
-        start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        print(f"Function {func.__name__} took {end - start} seconds")
-        return result
-    return wrapper
+from gamuLogger import Logger
+
+Logger.setModule("thread")
+
+class CancelledError(Exception):
+    """Raised by Task.result when the task has been cancelled"""
+
 
 class Task:
+    """
+    A function call to run on a Runner, with a future-like interface
+    """
     class STATE(Enum):
         PENDING = 0
         RUNNING = 1
         FINISHED = 2
+        FAILED = 3
+        CANCELLED = 4
+        
+    __current = local()
+        
     def __init__(self, func : Callable[[Any], Any], *args, **kwargs):
         self.__func = func
         self.__args = args
         self.__kwargs = kwargs
         self.__state = Task.STATE.PENDING
         self.__result = None
+        self.__exception = None #type: BaseException
+        self.__cancelRequested = False
+        self.__lock = Lock()
+        self.__done = Event()
+        self.__callbacks = [] #type: list[Callable[[Task], Any]]
+        
+    @staticmethod
+    def current() -> 'Task | None':
+        """
+        Returns the task running in the current thread, if any
+        """
+        return getattr(Task.__current, "task", None)
+    
+    @staticmethod
+    def checkCancelled():
+        """
+        To be called from a long running function: raise CancelledError if the task running it has been cancelled
+        """
+        task = Task.current()
+        if task is not None and task.__cancelRequested:
+            raise CancelledError(f"Task {task} cancelled")
         
     def run(self):
-        if self.__state != Task.STATE.PENDING:
-            raise Exception("Task already running")
-        self.__state = Task.STATE.RUNNING
-        self.__result = self.__func(*self.__args, **self.__kwargs)
-        self.__state = Task.STATE.FINISHED
+        with self.__lock:
+            if self.__state == Task.STATE.CANCELLED:
+                return
+            if self.__state != Task.STATE.PENDING:
+                raise Exception("Task already running")
+            self.__state = Task.STATE.RUNNING
+        
+        Task.__current.task = self
+        try:
+            result = self.__func(*self.__args, **self.__kwargs)
+        except CancelledError as e:
+            self.__finish(Task.STATE.CANCELLED, exception=e)
+        except BaseException as e:
+            Logger.debug(f"Task {self} raised {type(e).__name__} : {e}")
+            self.__finish(Task.STATE.FAILED, exception=e)
+        else:
+            self.__finish(Task.STATE.FINISHED, result=result)
+        finally:
+            Task.__current.task = None
         
     def __call__(self):
         self.run()
         
+    def __finish(self, state : 'Task.STATE', result : Any = None, exception : BaseException = None):
+        with self.__lock:
+            self.__state = state
+            self.__result = result
+            self.__exception = exception
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        self.__done.set()
+        for callback in callbacks:
+            self.__runCallback(callback)
+            
+    def __runCallback(self, callback : Callable[['Task'], Any]):
+        try:
+            callback(self)
+        except Exception as e:
+            Logger.error(f"Error in done callback of task {self} : {e}")
+        
+    def cancel(self) -> bool:
+        """
+        Cancel the task, returns True if it will not run
+        A running task can only stop by itself, by calling Task.checkCancelled; False is returned in that case
+        """
+        with self.__lock:
+            if self.__state == Task.STATE.RUNNING:
+                self.__cancelRequested = True
+                return False
+            if self.__state != Task.STATE.PENDING:
+                return self.__state == Task.STATE.CANCELLED
+        self.__finish(Task.STATE.CANCELLED, exception=CancelledError(f"Task {self} cancelled"))
+        return True
+    
+    def addDoneCallback(self, callback : Callable[['Task'], Any]):
+        """
+        Call callback(task) when the task is done (finished, failed or cancelled)
+        The callback is called immediately if the task is already done, otherwise in the thread that ran the task
+        """
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        self.__runCallback(callback)
+        
+    def done(self) -> bool:
+        return self.__done.is_set()
+    
+    def running(self) -> bool:
+        return self.__state == Task.STATE.RUNNING
+    
+    def cancelled(self) -> bool:
+        return self.__state == Task.STATE.CANCELLED
+    
+    def result(self, timeout : float = None) -> Any:
+        """
+        Wait for the task and return its result, or raise the exception it raised
+        """
+        if not self.__done.wait(timeout):
+            raise TimeoutError(f"Task {self} not done after {timeout}s")
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+    
+    def exception(self, timeout : float = None) -> BaseException | None:
+        """
+        Wait for the task and return the exception it raised (None if it succeeded)
+        """
+        if not self.__done.wait(timeout):
+            raise TimeoutError(f"Task {self} not done after {timeout}s")
+        return self.__exception
+        
     def getState(self) -> 'Task.STATE':
         return self.__state
     
     def getResult(self) -> Any:
-        if self.__state != Task.STATE.FINISHED:
+        if not self.__done.is_set():
             raise Exception("Task not finished")
         
-        return self.__result
+        return self.result()
     
     def __str__(self):
         args = ", ".join([str(arg) for arg in self.__args]+[f"{key}={value}" for key, value in self.__kwargs.items()])
-        return f"{self.__func.__name__}({args})"
+        return f"{getattr(self.__func, '__name__', self.__func)}({args})"
     
     
     
 class Runner:
+    """
+    Run tasks on worker threads, tasks with the lowest priority value run first (FIFO for equal priorities)
+    """
+    __STOP = float("-inf") # priority of the sentinels that stop the workers, before any task
+    
     def __init__(self, onTaskFinished : Callable[[Task], Any] = None):
-        self.__tasksToRun = [] #type: list[Task]
+        self.__queue = PriorityQueue() #type: PriorityQueue[tuple[float, int, Task | None]]
+        self.__counter = count()
         self.__taskDone = [] #type: list[Task]
+        self.__runningTasks = set() #type: set[Task]
+        self.__lock = Lock()
         self.__onTaskFinished = onTaskFinished
         self.__threads = [] #type: list[Thread]
         self.__running = False
+        self.__keepAlive = False
         
-    def addTask(self, task : Task):
-        self.__tasksToRun.append(task)
+    def addTask(self, task : Task, priority : float = 0) -> Task:
+        self.__queue.put((priority, next(self.__counter), task))
+        return task
+    
+    def submit(self, func : Callable[[Any], Any], *args, **kwargs) -> Task:
+        """
+        Create a task with the default priority and add it to the queue
+        """
+        return self.addTask(Task(func, *args, **kwargs))
             
     def __run(self, threadID : str = None):
-        print(f"Thread {threadID} started")
-        while self.__running and self.__tasksToRun:
-            task = self.__tasksToRun.pop(0)
+        Logger.debug(f"Thread {threadID} started")
+        while self.__running:
+            try:
+                _, _, task = self.__queue.get(block=self.__keepAlive)
+            except Empty:
+                break
+            if task is None: # stop sentinel
+                break
+            
+            with self.__lock:
+                self.__runningTasks.add(task)
             task.run()
-            self.__taskDone.append(task)
-            if self.__onTaskFinished is not None:
-                self.__onTaskFinished(task)
+            with self.__lock:
+                self.__runningTasks.discard(task)
+                self.__taskDone.append(task)
+            if self.__onTaskFinished is not None and not task.cancelled():
+                try:
+                    self.__onTaskFinished(task)
+                except Exception as e:
+                    Logger.error(f"Error in onTaskFinished for task {task} : {e}")
         
-        if threadID is not None:
-            print(f"Thread {threadID} finished")
+        Logger.debug(f"Thread {threadID} finished")
         
     def runSync(self):
+        """
+        Run every queued task in the current thread
+        """
         self.__running = True
+        self.__keepAlive = False
         self.__run()
                 
-    def runAsync(self, nbThreads = 1, wait = False):
+    def runAsync(self, nbThreads = 1, wait = False, keepAlive = False):
+        """
+        Start nbThreads workers
+        Without keepAlive, workers stop when the queue is empty; otherwise they wait for new tasks until stop is called
+        """
         self.__running = True
+        self.__keepAlive = keepAlive
         for i in range(nbThreads):
-            thread = Thread(target=self.__run, args=(i,), name=f"Thread-{i}")
+            thread = Thread(target=self.__run, args=(i,), name=f"Runner-{i}", daemon=keepAlive)
             thread.start()
             self.__threads.append(thread)
             
         if wait:
-            for thread in self.__threads:
+            self.join()
+            
+    def join(self):
+        """
+        Wait for the workers to stop
+        """
+        for thread in self.__threads:
+            if thread is not current_thread():
                 thread.join()
-        
+        self.__threads = [thread for thread in self.__threads if thread.is_alive()]
             
     def getTasks(self) -> list[Task]:
-        return self.__taskDone
+        with self.__lock:
+            return list(self.__taskDone)
     
-    def stop(self):
-        """force stop all threads"""
+    def stop(self, wait = True):
+        """
+        Stop all workers: pending tasks are cancelled, running tasks are asked to cancel (see Task.checkCancelled)
+        """
         self.__running = False
-        print("Stopping all threads")
-        for thread in self.__threads:
-            print(f"Stopping thread {thread}")
-            thread.join()
+        Logger.debug("Stopping all threads")
+        cancelled = 0
+        while True:
+            try:
+                _, _, task = self.__queue.get_nowait()
+            except Empty:
+                break
+            if task is not None and task.cancel():
+                cancelled += 1
+        with self.__lock:
+            for task in self.__runningTasks:
+                task.cancel()
+        if self.__keepAlive: # otherwise the workers stop by themselves when the queue is empty
+            for _ in self.__threads:
+                self.__queue.put((Runner.__STOP, next(self.__counter), None))
+        if cancelled:
+            Logger.debug(f"{cancelled} pending tasks cancelled")
+        if wait:
+            self.join()
+            
+    def pending(self) -> int:
+        """
+        Number of tasks waiting in the queue
+        """
+        return self.__queue.qsize()
         
     
-
 if __name__ == "__main__":
     from time import sleep
+    from queue import Queue
     import tkinter as tk
     from tkinter import ttk
     
@@ -116,12 +296,19 @@ if __name__ == "__main__":
         sleep(0.5)
         return a + b
     
+    # tk widgets can only be used from the main thread, workers send the finished tasks through a queue
+    finished = Queue() #type: Queue[Task]
+    
     def onDone(task : Task):
-        print(f"Task {task} finished and returned {task.getResult()}")
-        progress.step(100/50)
-        progress.update()
+        finished.put(task)
+        
+    def processFinished():
+        while not finished.empty():
+            task = finished.get()
+            print(f"Task {task} finished and returned {task.getResult()}")
+            progress.step(100/50)
+        root.after(50, processFinished)
     
-    @chrono
     def main():
         runner = Runner(onDone)
         
@@ -137,4 +324,5 @@ if __name__ == "__main__":
         root.protocol("WM_DELETE_WINDOW", lambda: stop())
         
     main()
+    root.after(50, processFinished)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,172 @@
+import os
+import io
+import hashlib
+import tempfile
+from collections import OrderedDict
+from multiprocessing import parent_process
+from threading import Lock, get_ident
+
+from gamuLogger import Logger
+
+try:
+    from .config import Config
+    from .metrics import Metrics
+except ImportError:
+    from config import Config
+    from metrics import Metrics
+
+TEMP_FOLDER = os.path.join(tempfile.gettempdir(), "mod_manager") # uses TEMP, TMPDIR... like the rest of the system
+THUMBNAIL_FOLDER = os.path.join(TEMP_FOLDER, "thumbnails")
+THUMBNAIL_SIZE = (128, 128)
+
+Logger.setModule("thumbnails")
+
+
+def thumbnailKey(iconName : str, crc : int, size : int) -> str:
+    """
+    Content address of an icon, computed from the icon entry of the archive (name, crc and uncompressed size)
+    Two mods shipping the same icon share the same thumbnail, two different icons with the same name do not collide
+    """
+    return hashlib.sha1(f"{iconName}\0{crc:08x}\0{size}".encode()).hexdigest()
+
+
+class ThumbnailCache:
+    """
+    Pre-scaled icons stored as png files in the temp folder, with a size cap on disk
+    and an in-memory LRU of images ready to be displayed by tkinter
+    """
+    __instance = None #type: ThumbnailCache
+    __creationLock = Lock() # the cache is first used by several loading or import threads at once
+    
+    def __new__(cls):
+        with cls.__creationLock:
+            if cls.__instance is None:
+                cls.__instance = super(ThumbnailCache, cls).__new__(cls)
+                cls.__instance.__initialized = False
+        return cls.__instance
+    
+    def __init__(self):
+        if self.__initialized: return
+        with ThumbnailCache.__creationLock:
+            if self.__initialized: return
+            self.__lock = Lock()
+            self.__maxDiskSize = Config().get("thumbnail_cache_size_mb", 64, True) * 1024 * 1024
+            self.__maxImages = Config().get("thumbnail_memory_cache", 256, True)
+            self.__files = OrderedDict() #type: OrderedDict[str, int] # path -> size, least recently used first
+            self.__diskSize = 0
+            self.__images = OrderedDict() #type: OrderedDict[str, ImageTk.PhotoImage] # PIL is imported when first needed
+            
+            os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+            self.__scan()
+            self.__initialized = True # only once it can be used by the other threads
+        
+        Logger.debug(f"Thumbnail cache initialized ({len(self.__files)} files, {self.__diskSize // 1024} KiB)")
+        
+    def __scan(self):
+        entries = []
+        with os.scandir(THUMBNAIL_FOLDER) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self.__files[path] = size
+            self.__diskSize += size
+    
+    @staticmethod
+    def pathOf(key : str) -> str:
+        return os.path.join(THUMBNAIL_FOLDER, key + ".png")
+        
+    def get(self, key : str) -> str | None:
+        """
+        Returns the path of the thumbnail, or None if it is not cached
+        """
+        path = self.pathOf(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            Metrics().count("thumbnail.miss")
+            return None
+        Metrics().count("thumbnail.hit")
+        self.__use(path, size)
+        try:
+            os.utime(path) # keep the LRU order across runs
+        except OSError:
+            pass
+        return path
+    
+    def track(self, key : str):
+        """
+        Count a thumbnail stored by a worker process in the size of the cache (see get)
+        """
+        path = self.pathOf(key)
+        try:
+            self.__use(path, os.path.getsize(path))
+        except OSError:
+            pass
+    
+    def __use(self, path : str, size : int):
+        with self.__lock:
+            if path in self.__files:
+                self.__files.move_to_end(path)
+            else: # stored by a worker process
+                self.__add(path, size)
+    
+    def __add(self, path : str, size : int):
+        self.__diskSize += size - self.__files.pop(path, 0)
+        self.__files[path] = size
+        # a worker only knows part of the cache and could remove thumbnails the main process already handed out,
+        # so only the main process evicts
+        if parent_process() is None:
+            self.__evict()
+    
+    def store(self, key : str, data : bytes) -> str:
+        """
+        Scale down the image and store it, returns the path of the thumbnail
+        """
+        from PIL import Image
+        path = self.pathOf(key)
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        tmpPath = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        image.save(tmpPath, "PNG")
+        os.replace(tmpPath, path) # several processes and threads can store the same thumbnail at the same time
+        size = os.path.getsize(path)
+        with self.__lock:
+            self.__add(path, size)
+        Logger.deepDebug(f"Thumbnail {key} stored")
+        return path
+    
+    def __evict(self):
+        while self.__diskSize > self.__maxDiskSize and len(self.__files) > 1:
+            path, size = self.__files.popitem(last=False)
+            self.__diskSize -= size
+            self.__images.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            Logger.deepDebug(f"Thumbnail {path} evicted")
+    
+    def getPhoto(self, path : str) -> 'ImageTk.PhotoImage':
+        """
+        Returns the thumbnail as an image that can be displayed by tkinter (a tk root must exist)
+        Recently used images are kept in memory, so they are decoded only once
+        """
+        with self.__lock:
+            photo = self.__images.get(path)
+            if photo is not None:
+                self.__images.move_to_end(path)
+                Metrics().count("photo.hit")
+                return photo
+        Metrics().count("photo.miss")
+        from PIL import Image, ImageTk
+        with Image.open(path) as image:
+            photo = ImageTk.PhotoImage(image)
+        with self.__lock:
+            self.__images[path] = photo
+            while len(self.__images) > self.__maxImages:
+                self.__images.popitem(last=False)
+        return photo
@@ -1,13 +1,15 @@
 import tkinter as tk
 from tkinter import ttk
-from ttkthemes import ThemedTk
-from PIL import Image, ImageTk
 import os
 
 try:
     from .mod import Mod
+    from .thumbnails import ThumbnailCache
+    from .metrics import Metrics
 except ImportError:
     from mod import Mod
+    from thumbnails import ThumbnailCache
+    from metrics import Metrics
     
 
 def resizeText(text : str, maxLineLength : int):
@@ -30,9 +32,13 @@ def resizeText(text : str, maxLineLength : int):
 
 
 class ModWidget(ttk.Frame):
-    def __init__(self, master, mod : Mod):
+    """
+    Display the icon and the description of a mod
+    The widget can be reused for another mod with setMod, which only updates the labels
+    """
+    def __init__(self, master, mod : Mod = None):
         super().__init__(master, width=200, height=400)
-        self.__mod = mod
+        self.__mod = None #type: Mod
         
         #create a border around the widget
         self.config(borderwidth=2, relief="groove")
@@ -40,34 +46,71 @@ class ModWidget(ttk.Frame):
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
         self.__createWidgets()
+        if mod is not None:
+            self.setMod(mod)
         
     def __createWidgets(self):
-        icon = Image.open(self.__mod.iconPath)
-        icon.thumbnail((128, 128))
-        icon = ImageTk.PhotoImage(icon)
-        self.__iconLabel = ttk.Label(self, image=icon, compound=tk.CENTER)
+        self.__iconLabel = ttk.Label(self, compound=tk.CENTER)
         self.__iconLabel.grid(row=0, column=0, columnspan=2, padx=5, pady=5)
-        self.__iconLabel.image = icon
-        
-        self.__title = ttk.Label(self, text=resizeText(self.__mod.title, 20), font=("Arial", 12, "bold"), justify="center")
         
+        self.__title = ttk.Label(self, font=("Arial", 12, "bold"), justify="center")
         self.__title.grid(row=1, column=0, columnspan=2)
         
-        self.__author = ttk.Label(self, text=resizeText(self.__mod.author, 20))
+        self.__author = ttk.Label(self)
         self.__author.grid(row=2, column=0)
         
-        self.__version = ttk.Label(self, text=self.__mod.version)
+        self.__version = ttk.Label(self)
         self.__version.grid(row=2, column=1)
         
-        self.__description = ttk.Label(self, text=resizeText(self.__mod.description, 40))
+        self.__description = ttk.Label(self)
         self.__description.grid(row=3, column=0, columnspan=2)
         
+    def setMod(self, mod : Mod):
+        """
+        Display another mod in this widget
+        """
+        if mod is self.__mod:
+            return
+        self.__mod = mod
+        with Metrics().timer("widget.setMod"):
+            self.__display(mod)
+            
+    def __display(self, mod : Mod):
+        try:
+            iconPath = mod.iconPath
+            icon = ThumbnailCache().getPhoto(iconPath) if iconPath is not None else ""
+            title = resizeText(mod.title, 20)
+            author = resizeText(mod.author, 20)
+            version = mod.version
+            description = resizeText(mod.description, 40)
+        except Exception as e: # lazy mods report their errors when they are displayed
+            icon = ""
+            title = resizeText(os.path.basename(mod.zippath), 20)
+            author = ""
+            version = ""
+            description = resizeText(f"Could not load this mod : {e}", 40)
+            
+        self.__iconLabel.configure(image=icon)
+        self.__iconLabel.image = icon
+        self.__title.configure(text=title)
+        self.__author.configure(text=author)
+        self.__version.configure(text=version)
+        self.__description.configure(text=description)
+        
+    def getMod(self) -> Mod:
+        return self.__mod
+        
         
 if __name__ == "__main__":
+    import sys
+    from ttkthemes import ThemedTk
     from gamuLogger import Logger, LEVELS
     
     Logger.setLevel("stdout", LEVELS.DEBUG)
-    mod = Mod(r"E:\Code\fs_mods_manager\Ford Mustang.zip")
+    if len(sys.argv) != 2:
+        Logger.critical("Usage : python -m src.tk_mod <mod archive>")
+        sys.exit(1)
+    mod = Mod(sys.argv[1])
     root = ThemedTk()
     root.set_theme("arc")
     root.geometry("600x400")
@@ -1,59 +1,222 @@
 import tkinter as tk
 from tkinter import ttk
-from ttkthemes import ThemedTk
-from PIL import Image, ImageTk
 import os
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Sequence
+
+from gamuLogger import Logger
 
 try:
     from .modStack import ModStack
+    from .sortedMods import SORT_KEYS
+    from .conflicts import ConflictReport
     from .config import Config
     from .tk_mod import ModWidget
+    from .mod import Mod
 except ImportError:
     from modStack import ModStack
+    from sortedMods import SORT_KEYS
+    from conflicts import ConflictReport
     from config import Config
     from tk_mod import ModWidget
+    from mod import Mod
+    
+Logger.setModule("tk_modStack")
+
+MODS_PER_PAGE = 18
+FRAME_HISTORY = 500 # number of frame times kept for the statistics
     
     
-class ScrollableFrame(ttk.Frame):
-    def __init__(self, master, **kwargs):
+class VirtualGrid(ttk.Frame):
+    """
+    A scrollable grid of ModWidgets, but only the widgets visible in the viewport exist
+    Scrolling binds this fixed pool of widgets to other mods instead of creating new ones,
+    so the number of widgets does not depend on the number of mods
+    """
+    def __init__(self, master, columns : int = 5, tileHeight : int = 400, padding : int = 5, **kwargs):
         super().__init__(master, **kwargs)
+        self.__items = [] #type: Sequence[Mod]
+        self.__columns = columns
+        self.__rowHeight = tileHeight + 2 * padding
+        self.__padding = padding
+        self.__firstRow = 0
+        self.__viewportHeight = 1
+        self.__pool = [] #type: list[ModWidget]
+        self.__shown = [] #type: list[bool]
+        self.__frameTimes = deque(maxlen=FRAME_HISTORY) #type: deque[float]
         
-        self.__canvas = tk.Canvas(self)
-        self.__canvas.pack(side="left", fill="both", expand=True)
+        self.__content = ttk.Frame(self)
+        self.__content.grid_propagate(False) # the viewport decides the size of the pool, not the other way around
+        self.__content.pack(side="left", fill="both", expand=True)
         
-        self.__scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.__canvas.yview)
+        self.__scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.__yview)
         self.__scrollbar.pack(side="right", fill="y")
         
-        self.__canvas.configure(yscrollcommand=self.__scrollbar.set)
+        self.__content.bind("<Configure>", self.__onConfigure)
+        self.bind("<Enter>", self.__bindMouseWheel)
+        self.bind("<Leave>", self.__unbindMouseWheel)
+        
+    def setItems(self, items : Sequence[Mod], keepPosition : bool = False):
+        """
+        Display another sequence of mods (anything with __len__ and __getitem__), starting from the top unless keepPosition is set
+        """
+        self.__items = items
+        if not keepPosition:
+            self.__firstRow = 0
+        self.render()
+        
+    def __rowCount(self) -> int:
+        return math.ceil(len(self.__items) / self.__columns)
+    
+    def __fullyVisibleRows(self) -> int:
+        return max(1, self.__viewportHeight // self.__rowHeight)
+        
+    def __onConfigure(self, event):
+        self.__viewportHeight = max(1, event.height)
+        rows = math.ceil(self.__viewportHeight / self.__rowHeight)
+        size = rows * self.__columns
+        if size == len(self.__pool):
+            return
         
-        self.__content = ttk.Frame(self.__canvas)
-        self.__contentID = self.__canvas.create_window((0, 0), window=self.__content, anchor="nw")
+        # the pool follows the size of the viewport
+        while len(self.__pool) > size:
+            self.__pool.pop().destroy()
+            self.__shown.pop()
+        while len(self.__pool) < size:
+            i = len(self.__pool)
+            widget = ModWidget(self.__content)
+            widget.grid(row=i // self.__columns, column=i % self.__columns, padx=self.__padding, pady=self.__padding, sticky="nsew")
+            self.__pool.append(widget)
+            self.__shown.append(True)
+        Logger.debug(f"Mod widget pool resized to {size} widgets")
+        self.render()
         
-        self.__content.bind("<Configure>", self.__onFrameConfigure)
-        self.__canvas.bind("<Configure>", self.__onCanvasConfigure)
+    def render(self):
+        """
+        Bind the widgets of the pool to the mods of the current rows
+        """
+        start = time.perf_counter()
+        self.__firstRow = max(0, min(self.__firstRow, self.__rowCount() - self.__fullyVisibleRows()))
+        total = len(self.__items)
+        firstIndex = self.__firstRow * self.__columns
+        for i, widget in enumerate(self.__pool):
+            index = firstIndex + i
+            if index < total:
+                widget.setMod(self.__items[index])
+                if not self.__shown[i]:
+                    widget.grid()
+                    self.__shown[i] = True
+            elif self.__shown[i]:
+                widget.grid_remove()
+                self.__shown[i] = False
+        self.__scrollbar.set(*self.__fractions())
         
-        self.bind("<MouseWheel>", self.__onMouseWheel)
+        elapsed = time.perf_counter() - start
+        self.__frameTimes.append(elapsed)
+        Logger.deepDebug(f"Rendered mods {firstIndex}-{min(total, firstIndex + len(self.__pool))} of {total} in {elapsed * 1000:.2f} ms")
         
-    def __onFrameConfigure(self, event):
-        self.__canvas.configure(scrollregion=self.__canvas.bbox("all"))
+    def __fractions(self) -> tuple[float, float]:
+        rows = self.__rowCount()
+        if rows == 0:
+            return 0.0, 1.0
+        return self.__firstRow / rows, min(1.0, (self.__firstRow + self.__fullyVisibleRows()) / rows)
+    
+    def __yview(self, *args):
+        if args[0] == "moveto":
+            row = int(float(args[1]) * self.__rowCount())
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            row = self.__firstRow + (amount if args[2] == "units" else amount * self.__fullyVisibleRows())
+        else:
+            return
+        self.scrollToRow(row)
+        
+    def scrollToRow(self, row : int):
+        row = max(0, min(row, self.__rowCount() - self.__fullyVisibleRows()))
+        if row != self.__firstRow:
+            self.__firstRow = row
+            self.render()
+            
+    def scrollToIndex(self, index : int):
+        self.scrollToRow(index // self.__columns)
+        
+    def __bindMouseWheel(self, event):
+        self.bind_all("<MouseWheel>", self.__onMouseWheel)
+        self.bind_all("<Button-4>", self.__onMouseWheel)
+        self.bind_all("<Button-5>", self.__onMouseWheel)
         
-    def __onCanvasConfigure(self, event):
-        self.__canvas.itemconfig(self.__contentID, width=event.width)
+    def __unbindMouseWheel(self, event):
+        self.unbind_all("<MouseWheel>")
+        self.unbind_all("<Button-4>")
+        self.unbind_all("<Button-5>")
         
     def __onMouseWheel(self, event):
-        self.__canvas.yview_scroll(-1*(event.delta//120), "units")
+        if event.num == 4:
+            step = -1
+        elif event.num == 5:
+            step = 1
+        else:
+            step = -1 if event.delta > 0 else 1
+        self.scrollToRow(self.__firstRow + step)
+        
+    def getFrameStats(self) -> dict[str, float]:
+        """
+        Statistics (in milliseconds) about the time taken to render the last frames
+        """
+        if not self.__frameTimes:
+            return {"frames": 0, "mean": 0.0, "p95": 0.0, "max": 0.0}
+        times = sorted(self.__frameTimes)
+        return {
+            "frames": len(times),
+            "mean": sum(times) / len(times) * 1000,
+            "p95": times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+            "max": times[-1] * 1000
+        }
+        
+    def getWidgetCount(self) -> int:
+        return len(self.__pool)
+    
+
+class ConflictsWindow(tk.Toplevel):
+    """
+    List of the conflicts of a stack, selecting one shows its first archive in the grid
+    """
+    def __init__(self, master, report : ConflictReport, onSelect : Callable[[str], Any]):
+        super().__init__(master)
+        self.title(f"Conflicts in {report.stack}")
+        self.geometry("900x400")
+        self.__onSelect = onSelect
+        self.__archives = {} #type: dict[str, str] # row -> first archive
+        
+        ttk.Label(self, text=f"{len(report.conflicts)} conflicts between {report.nbArchives} archives ({report.seconds * 1000:.0f} ms)").pack(fill="x")
+        self.__tree = ttk.Treeview(self, columns=("kind", "archives", "detail"), show="headings")
+        for column, width in (("kind", 80), ("archives", 300), ("detail", 500)):
+            self.__tree.heading(column, text=column.capitalize())
+            self.__tree.column(column, width=width, stretch=column == "detail")
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.__tree.yview)
+        self.__tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        self.__tree.pack(fill="both", expand=True)
+        
+        for conflict in report.conflicts:
+            detail = conflict.detail + (f" : {', '.join(conflict.files)}" if conflict.kind == conflict.OVERLAP else "")
+            row = self.__tree.insert("", "end", values=(conflict.kind, ", ".join(conflict.archives), detail))
+            self.__archives[row] = conflict.archives[0]
+        self.__tree.bind("<<TreeviewSelect>>", self.__select)
         
-    def getContent(self):
-        return self.__content
+    def __select(self, event):
+        selection = self.__tree.selection()
+        if selection:
+            self.__onSelect(self.__archives[selection[0]])
     
 
 class ModStackWidget(ttk.Frame):
     def __init__(self, master, stack : ModStack):
         super().__init__(master)
         self.__stack = stack
-        
-        self.__startIndex = 0 # the index of the first mod to display
-        self.__endIndex = 18 # the index of the last mod to display( not included)
+        self.__filter = None #type: set[str] | None
         
         self.__createWidgets()
         
@@ -70,47 +233,112 @@ class ModStackWidget(ttk.Frame):
         self.__disableButton = ttk.Button(self.__navbar, text="Disable", command=self.__disable)
         self.__disableButton.grid(row=0, column=2)
         
-        self.__mods = ScrollableFrame(self)
+        sortKey, reverse = self.__stack.getSortKey()
+        self.__sortKey = tk.StringVar(self, sortKey)
+        self.__reverse = tk.BooleanVar(self, reverse)
+        self.__sortBox = ttk.Combobox(self.__navbar, textvariable=self.__sortKey, values=list(SORT_KEYS), state="readonly", width=8)
+        self.__sortBox.grid(row=0, column=3, padx=(10, 0))
+        self.__sortBox.bind("<<ComboboxSelected>>", self.__sort)
+        ttk.Checkbutton(self.__navbar, text="Descending", variable=self.__reverse, command=self.__sort).grid(row=0, column=4)
+        
+        ttk.Button(self.__navbar, text="Conflicts", command=self.__showConflicts).grid(row=0, column=5, padx=(10, 0))
+        
+        self.__mods = VirtualGrid(self)
         self.__mods.pack(fill="both", expand=True)
+        self.__mods.setItems(self.__stack)
+        self.__updateState()
         
-        self.__createModWidgets()
+    def __updateState(self):
+        enabled = self.__stack.isEnabled()
+        self.__name.configure(text=self.__stack.getName() + (" (enabled)" if enabled else ""))
+        self.__enableButton.state(["disabled"] if enabled else ["!disabled"])
+        self.__disableButton.state(["!disabled"] if enabled else ["disabled"])
         
-    def __clearModWidgets(self):
-        for widget in self.__mods.getContent().winfo_children():
-            widget.destroy()
+    def refresh(self):
+        """
+        Update the displayed mods after the stack changed
+        """
+        if self.__filter is None:
+            self.__mods.render()
+        else:
+            self.__mods.setItems(self.__filteredMods(), keepPosition=True)
+        self.__updateState()
         
-    def __createModWidgets(self):
-            start = max(0, self.__startIndex)
-            end = min(len(self.__stack), self.__endIndex)
-            for i in range(start, end):
-                Logger.debug(f"({i+1}/{len(self.__stack)})\tCreating widget for mod {self.__stack.getModByIndex(i).zippath}")
-                mod = self.__stack.getModByIndex(i)
-                modWidget = ModWidget(self.__mods.getContent(), mod)
-                modWidget.grid(row=i//5, column=i%5, padx=5, pady=5, sticky="nsew")
+    def __sort(self, *args):
+        start = time.perf_counter()
+        self.__stack.sortBy(self.__sortKey.get(), self.__reverse.get())
+        Logger.debug(f"{self.__stack} sorted by {self.__sortKey.get()} in {(time.perf_counter() - start) * 1000:.2f} ms")
+        if self.__filter is None:
+            self.__mods.setItems(self.__stack)
+        else:
+            self.__mods.setItems(self.__filteredMods())
+        
+    def __showConflicts(self):
+        self.configure(cursor="watch")
+        self.update_idletasks()
+        try:
+            report = self.__stack.getConflicts()
+        finally:
+            self.configure(cursor="")
+        ConflictsWindow(self, report, self.showArchive)
+        
+    def showArchive(self, file : str):
+        """
+        Scroll the grid to the mod of the archive, if it is displayed
+        """
+        if self.__filter is None:
+            index = self.__stack.indexOf(file)
+        else:
+            files = [item for item, _ in self.__stack.getItems() if item in self.__filter]
+            index = files.index(file) if file in files else None
+        if index is not None:
+            self.__mods.scrollToIndex(index)
+        
+    def setFilter(self, files : set[str] | None):
+        """
+        Only display the mods of these archives (e.g. search results), or every mod if files is None
+        """
+        if files is None and self.__filter is None:
+            return
+        self.__filter = files
+        self.__mods.setItems(self.__stack if files is None else self.__filteredMods())
+        
+    def __filteredMods(self) -> list[Mod]:
+        return [mod for file, mod in self.__stack.getItems() if file in self.__filter]
                 
     def setPage(self, page : int):
-        self.__startIndex = page * 18
-        self.__endIndex = (page + 1) * 18
-        self.__clearModWidgets()
-        self.__createModWidgets()
-        
-        # for i, mod in enumerate(self.__stack.content()):
-        #     Logger.debug(f"({i+1}/{len(self.__stack)})\tCreating widget for mod {mod.zippath}")
-        #     modWidget = ModWidget(self.__mods, mod)
-        #     modWidget.grid(row=i, column=0)
+        self.__mods.scrollToIndex(page * MODS_PER_PAGE)
+        
+    def getGrid(self) -> VirtualGrid:
+        return self.__mods
             
     def __enable(self):
-        self.__stack.enable()
+        try:
+            self.__stack.enable()
+        except OSError as e:
+            Logger.error(f"Could not enable {self.__stack} : {e}")
+        self.__updateState()
         
     def __disable(self):
-        self.__stack.disable()
+        try:
+            self.__stack.disable()
+        except OSError as e:
+            Logger.error(f"Could not disable {self.__stack} : {e}")
+        self.__updateState()
         
         
 if __name__ == "__main__":
-    from gamuLogger import Logger, LEVELS
+    from argparse import ArgumentParser
+    from ttkthemes import ThemedTk
+    from gamuLogger import LEVELS
+    
+    parser = ArgumentParser(description="Display a stack")
+    parser.add_argument("stack", nargs="?", default="mods crane", help="name of the stack folder")
+    parser.add_argument("--autoscroll", action="store_true", help="scroll through the whole stack and log the frame times")
+    args = parser.parse_args()
     
     Logger.setLevel("stdout", LEVELS.DEBUG)
-    stack = ModStack(os.path.join(Config().get("stack_folder"), "mods crane"))
+    stack = ModStack(os.path.join(Config().get("stack_folder"), args.stack))
     root = ThemedTk()
     root.set_theme("arc")
     root.geometry("600x400")
@@ -118,4 +346,14 @@ if __name__ == "__main__":
     modStackWidget = ModStackWidget(root, stack)
     modStackWidget.pack(fill="both", expand=True)
     
+    if args.autoscroll:
+        def scroll(row = 0):
+            grid = modStackWidget.getGrid()
+            if row * 5 < len(stack):
+                grid.scrollToRow(row)
+                root.after(1, scroll, row + 1)
+            else:
+                Logger.info(f"{len(stack)} mods displayed with {grid.getWidgetCount()} widgets, frame times : {grid.getFrameStats()}")
+        root.after(500, scroll)
+    
     root.mainloop()
@@ -1,31 +1,191 @@
+import time
 import tkinter as tk
 from tkinter import ttk
-from ttkthemes import ThemedTk
+from queue import Queue, Empty
+
+from gamuLogger import Logger
 
 try:
     from .manager import Manager
     from .config import Config
     from .modStack import ModStack
+    from .tk_modStack import ModStackWidget
+    from .thread import Runner
+    from .profiling import StartupProfiler
 except ImportError:
     from manager import Manager
     from config import Config
     from modStack import ModStack
+    from tk_modStack import ModStackWidget
+    from thread import Runner
+    from profiling import StartupProfiler
+    
+Logger.setModule("ui")
+
+POLL_INTERVAL = 50 # ms between two reads of the loading events
+EVENTS_PER_TICK = 500 # keep the window responsive when many mods are loaded at once
+SEARCH_DELAY = 150 # ms without typing before the search runs
 
-class UI(ThemedTk):
-    def __init__(self):
+class UI(tk.Tk):
+    def __init__(self, startTime : float = None):
+        """
+        Show the window immediately and load the stacks in the background
+        startTime (from time.perf_counter) is the start of the application, used to report the time to first window
+        """
         super().__init__()
-        self.set_theme("equilux")
+        self.__startTime = startTime if startTime is not None else time.perf_counter()
+        from ttkthemes import ThemedStyle # same as subclassing ThemedTk, without loading ttkthemes on import
+        ThemedStyle(self).set_theme("equilux")
 
         self.title("Mod Manager")
+        self.geometry("1200x800")
+        
+        # filled by the loading threads, only read from the tk thread
+        self.__events = Queue() #type: Queue[tuple]
+        self.__stackWidgets = {} #type: dict[str, ModStackWidget]
+        self.__stackButtons = {} #type: dict[str, ttk.Button]
+        self.__searchResults = None #type: dict[str, set[str]] | None
+        self.__searchJob = None #type: str
+        self.__currentStack = None #type: str
+        self.__loadedMods = 0
+        self.__totalMods = 0
+        self.__loading = True
+        
+        self.__createWidgets()
+        self.bind("<Map>", self.__onFirstMap)
 
-        self.__manager = Manager()
+        self.__manager = Manager(load=False)
+        self.__runner = Runner()
+        self.__runner.submit(self.__loadStacks)
+        self.__runner.runAsync(1)
+        self.after(POLL_INTERVAL, self.__processEvents)
+        
+    def __createWidgets(self):
+        self.__sidebar = ttk.Frame(self)
+        self.__sidebar.pack(side="left", fill="y")
+        
+        self.__query = tk.StringVar(self)
+        self.__query.trace_add("write", self.__onQueryChanged)
+        self.__searchBox = ttk.Entry(self.__sidebar, textvariable=self.__query)
+        self.__searchBox.pack(fill="x", pady=(0, 5))
+        
+        self.__status = ttk.Label(self, text="Loading stacks...")
+        self.__status.pack(side="bottom", fill="x")
         
-        for stack in self.__manager.getStacksNames():
-            self.__createStackButton(stack)
+        self.__progress = ttk.Progressbar(self, mode="determinate", maximum=1)
+        self.__progress.pack(side="bottom", fill="x")
+        
+        self.__view = ttk.Frame(self)
+        self.__view.pack(side="right", fill="both", expand=True)
+        
+    def __onFirstMap(self, event):
+        if event.widget is not self:
+            return
+        self.unbind("<Map>")
+        StartupProfiler().mark("first paint")
+        Logger.info(f"Window shown {(time.perf_counter() - self.__startTime) * 1000:.0f} ms after startup")
+            
+    def __loadStacks(self):
+        """
+        Runs in a worker thread, every result is sent to the tk thread through the event queue
+        """
+        try:
+            self.__manager.load(
+                onStackCreated=lambda stack: self.__events.put(("stack", stack)),
+                onModLoaded=lambda stack, file, mod: self.__events.put(("mod", stack, mod))
+            )
+        except Exception as e:
+            Logger.error(f"Could not load the stacks : {e}")
+            self.__events.put(("error", e))
+        self.__events.put(("done",))
+        
+    def __processEvents(self):
+        changedStacks = set()
+        for _ in range(EVENTS_PER_TICK):
+            try:
+                event = self.__events.get_nowait()
+            except Empty:
+                break
+            kind = event[0]
+            if kind == "stack":
+                stack = event[1] #type: ModStack
+                self.__createStackButton(stack.getName())
+                self.__totalMods += stack.getArchiveCount()
+                self.__progress.configure(maximum=max(1, self.__totalMods))
+                if self.__currentStack is None:
+                    self.__showStack(stack.getName())
+            elif kind == "mod":
+                self.__loadedMods += 1
+                changedStacks.add(event[1].getName())
+            elif kind == "changed": # from the watcher
+                if event[1].getName() not in self.__stackButtons: # created after the start
+                    self.__createStackButton(event[1].getName())
+                changedStacks.add(event[1].getName())
+            elif kind == "error":
+                self.__status.configure(text=f"Could not load the stacks : {event[1]}")
+            elif kind == "done":
+                self.__loading = False
+                Logger.info(f"Every stack loaded {(time.perf_counter() - self.__startTime):.2f}s after startup")
+                StartupProfiler().mark("every stack loaded")
+                StartupProfiler().report()
+                if Config().get("watch_stacks", False, True):
+                    self.__manager.startWatching(lambda stack, changes: self.__events.put(("changed", stack, changes)))
+                
+        if changedStacks and self.__searchResults is not None:
+            self.__search()
+        if self.__currentStack in changedStacks:
+            self.__stackWidgets[self.__currentStack].refresh()
+        if self.__loading:
+            self.__progress.configure(value=self.__loadedMods)
+            status = f"Loading mods... {self.__loadedMods}/{self.__totalMods}"
+        elif self.__loadedMods or self.__totalMods:
+            self.__progress.configure(value=self.__progress["maximum"])
+            status = f"{self.__loadedMods} mods loaded"
+        else:
+            status = self.__status["text"]
+        if self.__searchResults is not None:
+            status = f"{sum(len(files) for files in self.__searchResults.values())} mods match \"{self.__query.get().strip()}\""
+        self.__status.configure(text=status)
+        self.after(POLL_INTERVAL, self.__processEvents)
             
     def __createStackButton(self, stack : str):
-        button = ttk.Button(self, text=stack, command=lambda: self.__enableStack(stack))
-        button.pack()
+        button = ttk.Button(self.__sidebar, text=stack, command=lambda: self.__showStack(stack))
+        button.pack(fill="x")
+        self.__stackButtons[stack] = button
+        
+    def __onQueryChanged(self, *args):
+        if self.__searchJob is not None:
+            self.after_cancel(self.__searchJob)
+        self.__searchJob = self.after(SEARCH_DELAY, self.__search)
+        
+    def __search(self):
+        """
+        Filter every stack with the query of the search box, and show the number of results of each stack on its button
+        """
+        self.__searchJob = None
+        query = self.__query.get().strip()
+        start = time.perf_counter()
+        self.__searchResults = self.__manager.search(query) if query else None
+        Logger.debug(f"Search for {query!r} done in {(time.perf_counter() - start) * 1000:.2f} ms")
+        for stack, button in self.__stackButtons.items():
+            if self.__searchResults is None:
+                button.configure(text=stack)
+            else:
+                button.configure(text=f"{stack} ({len(self.__searchResults.get(stack, ()))})")
+        if self.__currentStack is not None:
+            self.__stackWidgets[self.__currentStack].setFilter(self.__currentFilter(self.__currentStack))
+            
+    def __currentFilter(self, stack : str) -> set[str] | None:
+        if self.__searchResults is None:
+            return None
+        return self.__searchResults.get(stack, set())
         
-    def __enableStack(self, stack : str):
-        self.__manager.getStack(stack).enable()
+    def __showStack(self, stack : str):
+        if self.__currentStack is not None:
+            self.__stackWidgets[self.__currentStack].pack_forget()
+        if stack not in self.__stackWidgets:
+            self.__stackWidgets[stack] = ModStackWidget(self.__view, self.__manager.getStack(stack))
+        self.__stackWidgets[stack].pack(fill="both", expand=True)
+        self.__stackWidgets[stack].setFilter(self.__currentFilter(stack))
+        self.__stackWidgets[stack].refresh()
+        self.__currentStack = stack
@@ -0,0 +1,221 @@
+"""
+Integrity check of the archives : every entry is decompressed and its crc compared to the one of the central directory,
+so corrupted or half-downloaded archives are found before the game loads them
+Archives are checked in parallel on worker processes, the results are kept in the mod index per (path, size, mtime)
+so an archive is only checked again once it changed
+"""
+import os
+import time
+import zlib
+from concurrent.futures import Executor, as_completed
+from typing import Any, Callable
+from zipfile import BadZipFile
+
+from gamuLogger import Logger, LEVELS
+
+try:
+    from .modIndex import ModIndex
+    from .metrics import Metrics
+    from .zipReader import ZipReader
+except ImportError:
+    from modIndex import ModIndex
+    from metrics import Metrics
+    from zipReader import ZipReader
+
+Logger.setModule("verify")
+
+MAX_ERRORS = 20 # per archive, a badly truncated archive has an error for each of its entries
+
+
+class ArchiveCheck:
+    """
+    Result of the integrity check of an archive
+    errors are (entry, message), entry is None when the archive itself cannot be read
+    """
+    def __init__(self, path : str, ok : bool, errors : list[tuple[str | None, str]], entries : int = 0, nbBytes : int = 0, seconds : float = 0.0, cached : bool = False):
+        self.path = path
+        self.ok = ok
+        self.errors = errors
+        self.entries = entries # entries checked
+        self.bytes = nbBytes # uncompressed bytes checked
+        self.seconds = seconds
+        self.cached = cached # result of a previous run, the archive did not change since
+
+    @staticmethod
+    def fromRecord(path : str, record : dict[str, Any], cached : bool = False) -> 'ArchiveCheck':
+        return ArchiveCheck(path, record["ok"], [tuple(error) for error in record["errors"]], record["entries"], record["bytes"], record.get("seconds", 0.0), cached)
+
+    def toDict(self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "stack": os.path.basename(os.path.dirname(self.path)),
+            "ok": self.ok,
+            "errors": [{"entry": entry, "error": message} for entry, message in self.errors],
+            "entries": self.entries,
+            "bytes": self.bytes,
+            "seconds": self.seconds,
+            "cached": self.cached,
+        }
+
+    def __str__(self) -> str:
+        if self.ok:
+            return f"{self.path} : ok ({self.entries} files)"
+        return f"{self.path} : " + "; ".join(f"{entry} : {message}" if entry else message for entry, message in self.errors)
+
+
+class VerifyReport:
+    def __init__(self, checks : list[ArchiveCheck], seconds : float):
+        self.checks = checks
+        self.seconds = seconds
+
+    @property
+    def failures(self) -> list[ArchiveCheck]:
+        return [check for check in self.checks if not check.ok]
+
+    @property
+    def nbCached(self) -> int:
+        return sum(check.cached for check in self.checks)
+
+    @property
+    def ok(self) -> bool:
+        return all(check.ok for check in self.checks)
+
+    def toDict(self) -> dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "archives": len(self.checks),
+            "checked": len(self.checks) - self.nbCached,
+            "cached": self.nbCached,
+            "failed": len(self.failures),
+            "bytes": sum(check.bytes for check in self.checks if not check.cached),
+            "seconds": self.seconds,
+            "failures": [check.toDict() for check in self.failures],
+        }
+
+    def __str__(self) -> str:
+        lines = [f"{len(self.failures)} corrupted archives out of {len(self.checks)} ({len(self.checks) - self.nbCached} checked, {self.nbCached} unchanged since their last check) in {self.seconds:.2f}s"]
+        lines.extend(str(check) for check in self.failures)
+        return "\n".join(lines)
+
+
+def checkArchive(path : str) -> dict[str, Any]:
+    """
+    Decompress every entry of the archive and check its crc and size, returns a plain record (it runs in worker processes)
+    It never raises : a failure is an error of the archive, "transient" is set when the file could not be read
+    (locked, permissions...) rather than being corrupted, such a result is not kept
+    """
+    start = time.perf_counter()
+    errors = [] #type: list[tuple[str | None, str]]
+    entries, nbBytes = 0, 0
+    transient = False
+    try:
+        with ZipReader(path) as reader:
+            for name in reader.names():
+                try:
+                    nbBytes += reader.check(name)
+                    entries += 1
+                except (BadZipFile, zlib.error, RuntimeError) as e: # RuntimeError : encrypted, the game cannot read it either
+                    errors.append((name, str(e)))
+                    if len(errors) >= MAX_ERRORS:
+                        errors.append((None, f"stopped after {MAX_ERRORS} errors"))
+                        break
+    except BadZipFile as e:
+        errors.append((None, str(e)))
+    except OSError as e:
+        errors.append((None, f"Could not read the archive : {e}"))
+        transient = True
+    except Exception as e: # anything else the archive makes the reader raise, the next archives are still checked
+        errors.append((None, f"Could not check the archive : {e!r}"))
+        transient = True
+    return {"ok": not errors, "errors": errors, "entries": entries, "bytes": nbBytes, "seconds": time.perf_counter() - start, "transient": transient}
+
+
+def verifyArchives(paths : list[str], executor : Executor = None, force : bool = False, onChecked : Callable[[ArchiveCheck], Any] = None) -> VerifyReport:
+    """
+    Check the archives, on the executor if one is given
+    Archives checked since they last changed are not checked again, unless force is True
+    onChecked(check) is called for each archive (from this thread)
+    """
+    start = time.perf_counter()
+    checks = [] #type: list[ArchiveCheck]
+    toCheck = {} #type: dict[str, tuple[int, int]] # path -> (size, mtime) before the check
+
+    def done(check : ArchiveCheck):
+        checks.append(check)
+        if not check.ok:
+            Logger.warning(str(check))
+        if onChecked is not None:
+            onChecked(check)
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            done(ArchiveCheck(path, False, [(None, str(e))]))
+            continue
+        record = None if force else ModIndex().getCheck(path, stat.st_size, stat.st_mtime_ns)
+        Metrics().count("verify.hit" if record is not None else "verify.miss")
+        if record is not None:
+            done(ArchiveCheck.fromRecord(path, record, cached=True))
+        else:
+            toCheck[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def store(path : str, record : dict[str, Any]):
+        Metrics().observe("verify.archive", record["seconds"], path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        # an archive still being written (a download in progress) or that could not be read is checked again next time
+        if stat is not None and (stat.st_size, stat.st_mtime_ns) == toCheck[path] and not record["transient"]:
+            ModIndex().putCheck(path, stat.st_size, stat.st_mtime_ns, record | {"checkedAt": time.time()})
+        done(ArchiveCheck.fromRecord(path, record))
+
+    # the biggest archives first, so a big map does not end up alone on a worker at the end
+    ordered = sorted(toCheck, key=lambda path: toCheck[path][0], reverse=True)
+    Logger.debug(f"{len(ordered)} archives to check, {len(paths) - len(ordered)} unchanged since their last check")
+    if executor is None:
+        for path in ordered:
+            store(path, checkArchive(path))
+    else:
+        futures = {executor.submit(checkArchive, path): path for path in ordered}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                record = future.result()
+            except Exception as e: # the worker died (e.g. out of memory)
+                done(ArchiveCheck(path, False, [(None, f"Could not check the archive : {e}")]))
+                continue
+            store(path, record)
+
+    report = VerifyReport(sorted(checks, key=lambda check: check.path), time.perf_counter() - start)
+    Logger.info(f"Checked {len(checks)} archives in {report.seconds:.2f}s, {len(report.failures)} corrupted")
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    from argparse import ArgumentParser
+    from multiprocessing import freeze_support
+    try:
+        from .manager import Manager
+    except ImportError:
+        from manager import Manager
+
+    freeze_support()
+    parser = ArgumentParser(description="Check the integrity of the archives of the stacks (exit code 1 if an archive is corrupted)")
+    parser.add_argument("stacks", nargs="*", help="names of the stacks to check (every stack by default)")
+    parser.add_argument("--force", action="store_true", help="check again the archives that did not change since their last check")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    Logger.setLevel("stdout", LEVELS.CRITICAL if args.json else LEVELS.INFO) # stdout is kept for the json report
+    manager = Manager(load=False) # the archives are checked, not parsed
+    manager.findStacks()
+    report = manager.verify(args.stacks or None, args.force)
+    if args.json:
+        print(json.dumps(report.toDict(), indent=4))
+    else:
+        Logger.info(str(report))
+    sys.exit(0 if report.ok else 1)
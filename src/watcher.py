@@ -0,0 +1,307 @@
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes, ctypes.util
+from queue import Queue
+from threading import Thread, Event
+from typing import Callable, Any
+
+from gamuLogger import Logger, LEVELS
+
+try:
+    from .config import Config
+    from .modStack import ModStack, ChangeSet, snapshot
+except ImportError:
+    from config import Config
+    from modStack import ModStack, ChangeSet, snapshot
+
+Logger.setModule("watcher")
+
+
+def subfolders(folder : str) -> set[str]:
+    try:
+        with os.scandir(folder) as entries:
+            return {entry.name for entry in entries if entry.is_dir()}
+    except FileNotFoundError:
+        return set()
+
+
+class PollingBackend:
+    """
+    Detect changes by taking a snapshot of every folder at a regular interval
+    """
+    def __init__(self, folders : list[str], interval : float = 2.0):
+        self.__interval = interval
+        self.__snapshots = {folder: snapshot(folder) for folder in folders}
+        self.__root = None #type: str | None
+        self.__subfolders = set() #type: set[str]
+        self.__closed = Event()
+        
+    def watch(self, folder : str):
+        self.__snapshots[folder] = snapshot(folder)
+        
+    def watchRoot(self, root : str):
+        """
+        root is returned by wait when a folder is created in it
+        """
+        self.__root = root
+        self.__subfolders = subfolders(root)
+        
+    def wait(self, timeout : float) -> set[str]:
+        """
+        Returns the folders that changed, waiting at most max(timeout, interval) seconds
+        """
+        if self.__closed.wait(max(timeout, self.__interval)):
+            return set()
+        changed = set()
+        if self.__root is not None:
+            current = subfolders(self.__root)
+            if current - self.__subfolders:
+                changed.add(self.__root)
+            self.__subfolders = current
+        for folder, previous in list(self.__snapshots.items()): # a folder can be added meanwhile
+            try:
+                current = snapshot(folder)
+            except FileNotFoundError:
+                current = {}
+            if current != previous:
+                self.__snapshots[folder] = current
+                changed.add(folder)
+        return changed
+    
+    def close(self):
+        self.__closed.set()
+        
+        
+class InotifyBackend:
+    """
+    Detect changes with inotify (linux only)
+    """
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    ROOT_MASK = IN_CREATE | IN_MOVED_TO
+    
+    EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+    
+    def __init__(self, folders : list[str]):
+        self.__libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.__fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_init1 failed : {os.strerror(code)}")
+        self.__watches = {} #type: dict[int, str]
+        self.__rootWd = None #type: int | None
+        try:
+            for folder in folders:
+                self.watch(folder)
+        except OSError:
+            os.close(self.__fd)
+            raise
+            
+    def __addWatch(self, folder : str, mask : int) -> int:
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(folder), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"Could not watch {folder} : {os.strerror(code)}")
+        self.__watches[wd] = folder
+        return wd
+            
+    def watch(self, folder : str):
+        self.__addWatch(folder, self.MASK)
+        
+    def watchRoot(self, root : str):
+        """
+        root is returned by wait when a folder is created in it
+        """
+        self.__rootWd = self.__addWatch(root, self.ROOT_MASK)
+            
+    def wait(self, timeout : float) -> set[str]:
+        """
+        Returns the folders in which an archive changed, waiting at most timeout seconds
+        """
+        try:
+            ready, _, _ = select.select([self.__fd], [], [], timeout)
+        except (OSError, ValueError): # closed from another thread
+            return set()
+        if not ready:
+            return set()
+        chunks = [] # everything queued is read, the overflow event comes last
+        while True:
+            try:
+                chunk = os.read(self.__fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EBADF):
+                    break
+                raise
+            if not chunk:
+                break
+            chunks.append(chunk)
+        data = b"".join(chunks)
+        
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if wd == -1 and mask & self.IN_Q_OVERFLOW: # events were lost (e.g. a big copy), any folder may have changed
+                Logger.debug("inotify queue overflow, every folder is refreshed")
+                changed.update(self.__watches.values())
+            elif wd == self.__rootWd:
+                if mask & self.IN_ISDIR:
+                    changed.add(self.__watches[wd])
+            elif wd in self.__watches and name.endswith(b".zip"):
+                changed.add(self.__watches[wd])
+        return changed
+    
+    def close(self):
+        try:
+            os.close(self.__fd)
+        except OSError:
+            pass
+        
+
+def createBackend(folders : list[str]) -> InotifyBackend | PollingBackend:
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend(folders)
+        except (OSError, AttributeError) as e:
+            Logger.warning(f"inotify is not available ({e}), falling back to polling")
+    return PollingBackend(folders, Config().get("watch_poll_interval", 2.0, True))
+
+
+class Watcher:
+    """
+    Keep stacks in sync with their folders: archives added, replaced or deleted by hand are loaded
+    (or removed) without rescanning everything
+    Events are debounced per folder, so an archive still being written is loaded once it stopped changing
+    """
+    def __init__(self, stacks : list[ModStack], onChange : Callable[[ModStack, ChangeSet], Any] = None, debounce : float = None,
+                 backendFactory : Callable[[list[str]], InotifyBackend | PollingBackend] = createBackend,
+                 root : str = None, discover : Callable[[], list[ModStack]] = None):
+        """
+        backendFactory creates the backend from the folders to watch, the best one available by default
+        If root (the folder of the stacks) is given, the stacks created in it are found with discover(),
+        then loaded and watched, onChange is called for them with their archives
+        """
+        self.__stacks = {stack.getFolder(): stack for stack in stacks}
+        self.__root = root if discover is not None else None
+        self.__discover = discover
+        self.__onChange = onChange
+        self.__debounce = debounce if debounce is not None else Config().get("watch_debounce", 1.0, True)
+        self.__backendFactory = backendFactory
+        self.__backend = None #type: InotifyBackend | PollingBackend
+        self.__queue = Queue() #type: Queue[str | None]
+        self.__running = False
+        self.__threads = [] #type: list[Thread]
+        
+    def start(self):
+        if self.__running:
+            return
+        self.__backend = self.__backendFactory(list(self.__stacks))
+        if self.__root is not None:
+            self.__backend.watchRoot(self.__root)
+        self.__running = True
+        self.__threads = [
+            Thread(target=self.__watch, name="Watcher", daemon=True),
+            Thread(target=self.__work, name="Watcher-refresh", daemon=True)
+        ]
+        for thread in self.__threads:
+            thread.start()
+        Logger.info(f"Watching {len(self.__stacks)} stacks ({type(self.__backend).__name__})")
+        
+    def stop(self):
+        if not self.__running:
+            return
+        self.__running = False
+        self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__backend.close()
+        Logger.info("Stopped watching stacks")
+        
+    def __watch(self):
+        pending = {} #type: dict[str, float] # folder -> time of its last event
+        while self.__running:
+            now = time.monotonic()
+            timeout = min((last + self.__debounce - now for last in pending.values()), default=self.__debounce)
+            for folder in self.__backend.wait(max(timeout, 0.05)):
+                Logger.deepDebug(f"Change detected in {folder}")
+                pending[folder] = time.monotonic()
+            
+            now = time.monotonic()
+            for folder, last in list(pending.items()):
+                if now - last >= self.__debounce:
+                    del pending[folder]
+                    self.__queue.put(folder)
+                    
+    def __work(self):
+        while True:
+            folder = self.__queue.get()
+            if folder is None:
+                break
+            if folder == self.__root:
+                self.__addNewStacks()
+                continue
+            stack = self.__stacks[folder]
+            try:
+                changes = stack.refresh()
+            except Exception as e:
+                Logger.error(f"Could not refresh {stack} : {e}")
+                continue
+            if changes and self.__onChange is not None:
+                try:
+                    self.__onChange(stack, changes)
+                except Exception as e:
+                    Logger.error(f"Error in change callback of {stack} : {e}")
+
+    def __addNewStacks(self):
+        try:
+            stacks = [stack for stack in self.__discover() if stack.getFolder() not in self.__stacks]
+        except Exception as e:
+            Logger.error(f"Could not find the new stacks in {self.__root} : {e}")
+            return
+        for stack in stacks:
+            try:
+                self.__backend.watch(stack.getFolder()) # before loading, so no archive copied meanwhile is missed
+                self.__stacks[stack.getFolder()] = stack
+                stack.load()
+                stack.refresh() # archives added between the creation of the stack and its watch
+            except Exception as e:
+                Logger.error(f"Could not watch the new stack {stack} : {e}")
+                continue
+            Logger.info(f"New stack {stack} found, {stack.getArchiveCount()} archives")
+            if self.__onChange is not None:
+                try:
+                    self.__onChange(stack, ChangeSet(added=[os.path.basename(path) for path in stack.getArchivePaths()]))
+                except Exception as e:
+                    Logger.error(f"Error in change callback of {stack} : {e}")
+                    
+                    
+if __name__ == "__main__":
+    try:
+        from .manager import Manager
+    except ImportError:
+        from manager import Manager
+    
+    Logger.setLevel("stdout", LEVELS.DEBUG)
+    manager = Manager()
+    watcher = Watcher([manager.getStack(name) for name in manager.getStacksNames()], lambda stack, changes: Logger.info(f"{stack} : {changes}"))
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,269 @@
+"""
+Minimal zip reader for the metadata of a mod : the archive is memory-mapped, the central directory is read in a single pass
+(without creating a ZipInfo per entry) and only the entries asked for are decompressed
+Big maps have tens of thousands of entries, of which only modDesc.xml and the icon are needed
+"""
+import io
+import mmap
+import zlib
+import struct
+from array import array
+from typing import Iterable
+from zipfile import BadZipFile, ZipFile
+
+from gamuLogger import Logger
+
+Logger.setModule("zipReader")
+
+END_OF_DIRECTORY = struct.Struct("<4s4H2LH") # signature, disk numbers, entries on this disk, entries, directory size, directory offset, comment length
+ZIP64_LOCATOR = struct.Struct("<4sLQL") # signature, disk, offset of the zip64 end of directory, number of disks
+ZIP64_END_OF_DIRECTORY = struct.Struct("<4sQ2H2L4Q") # ..., entries on this disk, entries, directory size, directory offset
+DIRECTORY_ENTRY = struct.Struct("<4s4B4H3L5H2L")
+DIRECTORY_SCAN = struct.Struct("<4s4xH6x3L3H") # the fields of DIRECTORY_ENTRY read for every entry : signature, flags, crc, sizes, lengths
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+MAX_COMMENT = 0xFFFF
+CHUNK_SIZE = 64 * 1024 # bigger chunks are slower to check, they no longer fit in the cpu caches
+
+STORED = 0
+DEFLATED = 8
+UTF8_FLAG = 0x800
+ENCRYPTED_FLAG = 0x1
+
+
+class ZipReader:
+    """
+    Read-only view of an archive, use it as a context manager so the file is unmapped
+    Names are looked up exactly, then without case, then by stem (the part before the first dot), like findRealIcon,
+    through dicts : the exact one is built with the directory, the two others by the first lookup that needs them
+    """
+    def __init__(self, path : str):
+        self.filename = path
+        with open(path, "rb") as f:
+            try:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e: # empty file
+                raise BadZipFile(f"{path} is empty") from e
+        try:
+            self.__readDirectory()
+        except (struct.error, UnicodeDecodeError) as e: # offsets or lengths out of the file, names that cannot be decoded
+            self.close()
+            raise BadZipFile(f"{path} has a corrupted central directory ({e})") from e
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'ZipReader':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.__map.close()
+
+    def __findEnd(self) -> tuple[int, int, int]:
+        """
+        (number of entries, directory size, directory offset), from the end of central directory record
+        Sets the number of bytes found before the archive (e.g. a self-extracting stub), offsets are shifted by it
+        """
+        data = self.__map
+        start = max(0, len(data) - END_OF_DIRECTORY.size - MAX_COMMENT)
+        position = data.rfind(b"PK\x05\x06", start)
+        if position < 0:
+            raise BadZipFile(f"{self.filename} is not a zip file, or is truncated")
+        _, _, _, _, count, size, offset, _ = END_OF_DIRECTORY.unpack_from(data, position)
+        locator = position - ZIP64_LOCATOR.size
+        if locator >= 0 and data[locator:locator + 4] == b"PK\x06\x07":
+            _, _, end64, _ = ZIP64_LOCATOR.unpack_from(data, locator)
+            if end64 + ZIP64_END_OF_DIRECTORY.size > len(data):
+                raise BadZipFile(f"{self.filename} has a corrupted zip64 end of directory")
+            fields = ZIP64_END_OF_DIRECTORY.unpack_from(data, end64)
+            if fields[0] != b"PK\x06\x06":
+                raise BadZipFile(f"{self.filename} has a corrupted zip64 end of directory")
+            count, size, offset = fields[7], fields[8], fields[9]
+            position = end64
+        self.__shift = position - size - offset
+        if self.__shift < 0: # the directory would start before the file, or end after the end of directory record
+            raise BadZipFile(f"{self.filename} has a corrupted end of directory (directory offset out of the file)")
+        return count, size, offset + self.__shift
+
+    def __readDirectory(self):
+        """
+        Only what the index needs is kept for each entry (name, crc, size and where its directory record is),
+        the rest is read from the record when the entry is
+        """
+        count, size, offset = self.__findEnd()
+        data = self.__map
+        names = self.__names = [] #type: list[str]
+        crcs = self.__crcs = array("I")
+        sizes = self.__sizes = array("Q")
+        records = self.__records = [] #type: list[int]
+        unpack = DIRECTORY_SCAN.unpack_from
+        entrySize = DIRECTORY_ENTRY.size
+        position = offset
+        end = offset + size
+        for _ in range(count):
+            if position >= end:
+                break
+            if position + DIRECTORY_SCAN.size > len(data):
+                raise BadZipFile(f"{self.filename} has a corrupted central directory (entry out of the file)")
+            signature, flags, crc, _, fileSize, nameLength, extraLength, commentLength = unpack(data, position)
+            if signature != b"PK\x01\x02":
+                raise BadZipFile(f"{self.filename} has a corrupted central directory")
+            nameStart = position + entrySize
+            name = data[nameStart:nameStart + nameLength].decode("utf-8" if flags & UTF8_FLAG else "cp437")
+            if fileSize == 0xFFFFFFFF:
+                fileSize = self.__zip64Values(position)[0]
+            if name[-1:] != "/": # not a directory
+                names.append(name)
+                crcs.append(crc)
+                sizes.append(fileSize)
+                records.append(position)
+            position = nameStart + nameLength + extraLength + commentLength
+        self.__exact = self.__lookup(reversed(names))
+        self.__lower = None #type: dict[str, int] | None # built by the first lookup that needs them
+        self.__stems = None #type: dict[str, int] | None
+        
+    def __lookup(self, keys : Iterable[str]) -> dict[str, int]:
+        """
+        {key: index of the first name having it}, keys are given for the names in reverse order
+        """
+        return dict(zip(keys, range(len(self.__names) - 1, -1, -1)))
+
+    def __zip64Values(self, record : int) -> tuple[int, int, int]:
+        """
+        (size, compressed size, local header offset) of the directory record, the values stored as 0xFFFFFFFF
+        are in its zip64 extra field, in this order
+        """
+        data = self.__map
+        fields = DIRECTORY_ENTRY.unpack_from(data, record)
+        fileSize, compressedSize, localOffset = fields[11], fields[10], fields[18]
+        position = record + DIRECTORY_ENTRY.size + fields[12]
+        end = position + fields[13]
+        while position + 4 <= end:
+            tag, size = struct.unpack_from("<2H", data, position)
+            if tag == 0x0001:
+                values = iter(struct.unpack_from(f"<{size // 8}Q", data, position + 4))
+                if fileSize == 0xFFFFFFFF:
+                    fileSize = next(values)
+                if compressedSize == 0xFFFFFFFF:
+                    compressedSize = next(values)
+                if localOffset == 0xFFFFFFFF:
+                    localOffset = next(values)
+                break
+            position += 4 + size
+        return fileSize, compressedSize, localOffset
+
+    def find(self, name : str) -> str | None:
+        """
+        Name of the entry matching name exactly, else without case, else with the same stem ("icon.png" for "icon.dds")
+        """
+        index = self.__exact.get(name)
+        if index is None:
+            if self.__lower is None:
+                self.__lower = self.__lookup(map(str.lower, reversed(self.__names)))
+            index = self.__lower.get(name.lower())
+        if index is None:
+            if self.__stems is None:
+                self.__stems = self.__lookup(entry.partition(".")[0] for entry in reversed(self.__names))
+            index = self.__stems.get(name.partition(".")[0])
+        return self.__names[index] if index is not None else None
+
+    def __index(self, name : str) -> int:
+        index = self.__exact.get(name)
+        if index is None:
+            raise KeyError(f"There is no item named {name!r} in the archive")
+        return index
+
+    def getInfo(self, name : str) -> tuple[int, int]:
+        """
+        (crc, uncompressed size) of an entry
+        """
+        index = self.__index(name)
+        return self.__crcs[index], self.__sizes[index]
+
+    def __dataRange(self, name : str) -> tuple[int, int, int, int]:
+        """
+        (index, compression method, start, end) of the data of an entry in the mapped file
+        """
+        index = self.__index(name)
+        data = self.__map
+        try:
+            record = DIRECTORY_ENTRY.unpack_from(data, self.__records[index])
+            _, compressedSize, offset = self.__zip64Values(self.__records[index])
+        except struct.error as e: # zip64 extra field out of the file
+            raise BadZipFile(f"Bad directory record for {name} in {self.filename} ({e})") from e
+        flags, method = record[5], record[6]
+        if flags & ENCRYPTED_FLAG:
+            raise RuntimeError(f"{name} is encrypted")
+        offset += self.__shift
+        if offset < 0 or offset + LOCAL_HEADER.size > len(data):
+            raise BadZipFile(f"{name} is past the end of {self.filename} (truncated archive)")
+        signature, _, _, _, _, _, _, _, _, nameLength, extraLength = LOCAL_HEADER.unpack_from(data, offset)
+        if signature != b"PK\x03\x04":
+            raise BadZipFile(f"Bad local header for {name} in {self.filename}")
+        start = offset + LOCAL_HEADER.size + nameLength + extraLength
+        if start + compressedSize > len(data):
+            raise BadZipFile(f"{name} is past the end of {self.filename} (truncated archive)")
+        return index, method, start, start + compressedSize
+
+    def read(self, name : str) -> bytes:
+        """
+        Content of an entry, only this one is decompressed (its crc is checked)
+        """
+        index, method, start, end = self.__dataRange(name)
+        if method not in (STORED, DEFLATED): # bzip2, lzma... are rare in mods, zipfile handles them
+            with ZipFile(self.filename) as zipfile:
+                return zipfile.read(name)
+        raw = self.__map[start:end]
+        content = raw if method == STORED else zlib.decompress(raw, -15)
+        if zlib.crc32(content) != self.__crcs[index] or len(content) != self.__sizes[index]:
+            raise BadZipFile(f"Bad CRC or size for {name} in {self.filename}")
+        return content
+
+    def check(self, name : str, chunkSize : int = CHUNK_SIZE) -> int:
+        """
+        Decompress the entry chunk by chunk to check its crc and size without keeping its content, returns its size
+        Raises BadZipFile (or zlib.error) if the entry is corrupted
+        """
+        index, method, start, end = self.__dataRange(name)
+        if method not in (STORED, DEFLATED):
+            with ZipFile(self.filename) as zipfile, zipfile.open(name) as entry: # the crc is checked at the end
+                while entry.read(chunkSize):
+                    pass
+            return self.__sizes[index]
+        data = self.__map
+        decompressor = zlib.decompressobj(-15) if method == DEFLATED else None
+        crc, size = 0, 0
+        for position in range(start, end, chunkSize):
+            chunk = data[position:min(position + chunkSize, end)]
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if not decompressor.eof:
+                raise BadZipFile(f"{name} is truncated in {self.filename}")
+        if crc != self.__crcs[index]:
+            raise BadZipFile(f"Bad CRC for {name} in {self.filename}")
+        if size != self.__sizes[index]:
+            raise BadZipFile(f"Bad size for {name} in {self.filename} ({size} bytes instead of {self.__sizes[index]})")
+        return size
+
+    def open(self, name : str) -> io.BytesIO:
+        return io.BytesIO(self.read(name))
+
+    def names(self) -> list[str]:
+        return self.__names
+
+    def getCrcs(self) -> array:
+        return self.__crcs
+
+    def getSizes(self) -> array:
+        return self.__sizes
+
+    def __len__(self) -> int:
+        return len(self.__names)